@@ -1,6 +1,4 @@
-import os
-from dotenv import load_dotenv
-from utils.supabase_connector import connect_to_supabase, upsert_to_supabase
+from utils.supabase_connector import get_supabase_client, bulk_upsert_to_supabase
 from utils.csv_processing import csv_to_json
 from utils.open_api_data_processor import OpenApiDataProcessor
 
@@ -18,12 +16,7 @@ This is part 1 of the pipeline:
 """
 
 # Set up the data in this script.
-load_dotenv('.env.local')
-
-url = os.getenv('SUPABASE_URL')
-key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-supabase_client = connect_to_supabase(url, key)
+# The Supabase client is created by get_supabase_client() on first use, so importing this file doesn't connect
 table = "enriched_url_data"
 
 api_url = "https://data.cityofnewyork.us/resource/9cw8-7heb.csv"
@@ -37,7 +30,7 @@ def get_latest_registration_date():
     """
     column_name = "domain_registration_date"
 
-    response = (supabase_client.table(table)
+    response = (get_supabase_client().table(table)
                                 .select(column_name)
                                 .order(column_name, desc=True)
                                 .limit(1)
@@ -67,6 +60,10 @@ if __name__ == "__main__":
     # 3. Upsert that data into Supabase
 
     print(f"Upserting data into {table} Supabase table")
-    upsert_to_supabase(table, data_as_json, "domain_name", supabase_client)
+    report = bulk_upsert_to_supabase(table, data_as_json, "domain_name", get_supabase_client())
+    print(f"Upserted {report['rows_written']} rows ({report['rows_retried']} retried, {report['rows_failed']} failed, {report['duplicates_dropped']} duplicates dropped)")
+
+    for row in report['failed_rows']:
+        print(f"Failed to upsert {row['domain_name']}")
 
     print("Finished adding new URLs to Supabase.")
\ No newline at end of file
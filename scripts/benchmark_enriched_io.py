@@ -0,0 +1,87 @@
+from utils.arrow_io import rows_to_table, write_table, read_enriched_data
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+"""
+Run this file to compare reloading enriched data from CSV, as the notebook and resumed runs used to,
+against Parquet and Arrow files written by utils/arrow_io.py. Reports file sizes, and the time to reload
+every column and just the two columns an analysis of website_status over time needs.
+
+Usage:
+    python scripts/benchmark_enriched_io.py [--csv ENRICHED_EXPORT.csv] [--rows ROWS] [-n ITERATIONS]
+"""
+
+def generate_rows(row_count):
+    """Generate enriched rows with the mix of statuses, missing fields and text lengths the table has."""
+    random.seed(0)
+    start = datetime.datetime(2014, 10, 1)
+    rows = []
+    for i in range(row_count):
+        is_down = random.random() < 0.4
+        title = None if is_down else random.choice([f"Example {i} - " + "words " * random.randint(1, 12), "Not found"])
+        rows.append({
+            'domain_name': f"example{i}.nyc",
+            'domain_registration_date': (start + datetime.timedelta(minutes=97 * i)).isoformat(),
+            'nexus_category': random.choice(["INDIV", "ORG"]),
+            'status_code': "Error" if is_down else random.choice([200, 200, 200, 403, 404]),
+            'final_url': "Error" if is_down else f"https://example{i}.nyc/",
+            'title': title or "Error",
+            'description': "Error" if is_down else "A description of the site. " * random.randint(0, 6),
+            'image': "Error" if is_down else random.choice([f"https://example{i}.nyc/og.png", "Not found"]),
+            'is_url_found': not is_down,
+            'is_og_title_found': title not in (None, "Not found"),
+            'is_og_image_found': False,
+            'last_updated_at': start + datetime.timedelta(seconds=i),
+            'website_status': "is_down" if is_down else "is_complete",
+        })
+    return rows
+
+def time_function(function, iterations):
+    """Return the mean seconds function takes."""
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start_time) / iterations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='BenchmarkEnrichedIO',
+        description='Benchmark reloading enriched data from CSV against Parquet and Arrow.'
+    )
+    parser.add_argument('--csv', default=None, help='Export of the enriched_url_data table to benchmark on. Default None (generate rows).')
+    parser.add_argument('--rows', type=int, default=61000, help='Number of rows to generate without --csv. Default 61000, about the size of the registrations file.')
+    parser.add_argument('-n', '--iterations', type=int, default=5, help='Number of times to read each file. Default 5.')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.csv:
+            import csv
+            with open(args.csv, newline='') as f:
+                rows = list(csv.DictReader(f))
+            csv_path = args.csv
+        else:
+            import pandas as pd
+            rows = generate_rows(args.rows)
+            csv_path = os.path.join(directory, 'enriched.csv')
+            pd.DataFrame(rows).to_csv(csv_path, index=False)
+
+        table = rows_to_table(rows)
+        paths = {'CSV': csv_path}
+        for name, extension in (('Parquet', '.parquet'), ('Arrow', '.arrow')):
+            paths[name] = os.path.join(directory, 'enriched' + extension)
+            write_table(table, paths[name])
+
+        columns = ['website_status', 'last_updated_at']
+
+        print(f"{len(rows)} rows")
+        print(f"{'Format':<10} {'Size (MB)':>10} {'All columns (ms)':>17} {'2 columns (ms)':>15}")
+        for name, path in paths.items():
+            size = os.path.getsize(path) / (1024 * 1024)
+            all_columns_time = time_function(lambda: read_enriched_data(path), args.iterations)
+            some_columns_time = time_function(lambda: read_enriched_data(path, columns), args.iterations)
+            print(f"{name:<10} {size:>10.2f} {all_columns_time * 1000:>17.1f} {some_columns_time * 1000:>15.1f}")
@@ -0,0 +1,431 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+"""
+Run this file to benchmark enrich_urls and enrich_urls_async offline, against a local stand-in for the .nyc web.
+
+The stand-in serves HTTP and HTTPS on local ports. Every domain is assigned a behaviour by a stable hash of its name:
+fast pages, slow responses, redirect chains, redirects to one shared landing page, TLS failures, huge pages, identical parked pages, errors, hangs,
+and domains that don't resolve. Images load, 404, reject HEAD, or are pages in disguise, by a hash of their host. Each run happens in a child process that remaps every domain's DNS lookups
+and connections (by patching socket.getaddrinfo and socket.socket.connect) to the stand-in, so no real site is contacted.
+
+The report is JSON with throughput, p50/p95/p99 fetch latency and peak RSS for each mode and input file.
+
+Usage:
+    python scripts/benchmark_enrichment.py [--files files/test/test_150.csv ...] [--modes sync async] [--check-images] [-o report.json]
+"""
+
+DEFAULT_FILES = [f"files/test/test_{size}.csv" for size in (1, 7, 150, 500, 1000)]
+
+# Share of domains with each behaviour
+BEHAVIOUR_WEIGHTS = {
+    'normal': 46,
+    'shared_redirect': 4,
+    'slow': 15,
+    'redirect': 10,
+    'tls_failure': 8,
+    'parked': 6,
+    'huge': 3,
+    'server_error': 3,
+    'not_found': 2,
+    'unresolvable': 2,
+    'hang': 1,
+}
+
+# The registrar landing page every shared_redirect domain redirects to, which takes a while like a remote site
+LANDING_HOST = 'landing.stand-in.nyc'
+LANDING_SECONDS = 0.3
+
+# Share of hosts whose images behave each way
+IMAGE_BEHAVIOUR_WEIGHTS = {
+    'ok': 70,
+    'missing': 15,
+    'no_head': 10,
+    'soft_404': 5,
+}
+
+# The smallest valid PNG, a single transparent pixel
+PNG_BYTES = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                          '1f15c4890000000d49444154789c6360000000000005000166a2a4e80000000049454e44ae426082')
+
+HUGE_PAGE_BYTES = 4 * 1024 * 1024
+HANG_SECONDS = 30
+
+def pick_by_hash(key: str, weights: dict) -> str:
+    """Pick one of weights' keys by a stable hash of key, the same in every process."""
+    position = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big') % sum(weights.values())
+    for name, weight in weights.items():
+        if position < weight:
+            return name
+        position -= weight
+
+def get_behaviour(host: str) -> str:
+    """Get the behaviour of host, the same in every process."""
+    host = host.lower().split(':')[0]
+    if host.startswith('www.'):
+        host = host[4:]
+    if host == LANDING_HOST:
+        return 'landing'
+    return pick_by_hash(host, BEHAVIOUR_WEIGHTS)
+
+def get_image_behaviour(host: str) -> str:
+    """Get the behaviour of host's images, the same in every process."""
+    if host == LANDING_HOST:
+        return 'ok'
+    return pick_by_hash('image:' + host.lower(), IMAGE_BEHAVIOUR_WEIGHTS)
+
+def page(host: str, body: str = '') -> bytes:
+    """A page with Open Graph tags for host."""
+    return (f"<html><head><title>{host}</title>"
+            f"<meta property=\"og:title\" content=\"{host} in New York\">"
+            f"<meta property=\"og:description\" content=\"The website of {host}\">"
+            f"<meta property=\"og:image\" content=\"/images/{host}.png\">"
+            f"</head><body><h1>{host}</h1>{body}</body></html>").encode()
+
+def parked_page(host: str) -> bytes:
+    """The same parking page every parked domain serves, apart from its name."""
+    return (f"<html><head><title>{host} is for sale</title>"
+            f"<meta name=\"description\" content=\"{host} may be available. Make an offer today.\">"
+            "</head><body><img src=\"/parking/banner.png\"></body></html>").encode()
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str = 'text/html; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_image(self, host: str):
+        """Serve an image of host's, or fail the way broken thumbnails do."""
+        match get_image_behaviour(host):
+            case 'missing':
+                self.send_body(404, b"Not Found", 'text/plain')
+            case 'no_head' if self.command == 'HEAD':
+                self.send_body(405, b"", 'text/plain')
+            case 'soft_404':
+                self.send_body(200, b"<html><head><title>Page not found</title></head></html>")
+            case _:
+                self.send_body(200, PNG_BYTES, 'image/png')
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        host = self.headers.get('Host', 'unknown.nyc').split(':')[0]
+        behaviour = get_behaviour(host)
+
+        if self.path.startswith(('/images/', '/parking/')):
+            self.send_image(host)
+            return
+
+        try:
+            match behaviour:
+                case 'slow':
+                    time.sleep(random.uniform(0.3, 1.5))
+                    self.send_body(200, page(host))
+                case 'redirect':
+                    # / -> /hop/1 -> /hop/2 -> /hop/3 (the page)
+                    hop = int(self.path.rsplit('/', 1)[-1]) if self.path.startswith('/hop/') else 0
+                    if hop < 3:
+                        self.send_response(301)
+                        self.send_header('Location', f"/hop/{hop + 1}")
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                    else:
+                        self.send_body(200, page(host))
+                case 'shared_redirect':
+                    self.send_response(302)
+                    self.send_header('Location', f"https://{LANDING_HOST}/?utm_source=nyc")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                case 'landing':
+                    time.sleep(LANDING_SECONDS)
+                    self.send_body(200, page(host))
+                case 'parked':
+                    self.send_body(200, parked_page(host))
+                case 'huge':
+                    self.send_body(200, page(host, 'x' * HUGE_PAGE_BYTES))
+                case 'server_error':
+                    self.send_body(500, b"<html><head><title>Internal Server Error</title></head></html>")
+                case 'not_found':
+                    self.send_body(404, b"<html><head><title>Not Found</title></head></html>")
+                case 'hang':
+                    time.sleep(HANG_SECONDS)
+                    self.send_body(200, page(host))
+                case _:
+                    self.send_body(200, page(host))
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients give up on hangs and huge pages in head-only mode
+            pass
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Failed handshakes and dropped connections are part of the simulation
+        pass
+
+class TLSStandInServer(StandInServer):
+    def __init__(self, server_address, handler_class, ssl_context):
+        super().__init__(server_address, handler_class)
+        self.ssl_context = ssl_context
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        # Handshake on the request's thread, so a slow or failing one doesn't block accepting others
+        return self.ssl_context.wrap_socket(request, server_side=True, do_handshake_on_connect=False), client_address
+
+    def finish_request(self, request, client_address):
+        request.do_handshake()
+        super().finish_request(request, client_address)
+
+def create_certificate(hosts, directory: str):
+    """Create a self-signed certificate for every host with openssl. Returns (cert_path, key_path), or None without openssl."""
+    if shutil.which('openssl') is None:
+        return None
+
+    cert_path = os.path.join(directory, 'stand_in.crt')
+    key_path = os.path.join(directory, 'stand_in.key')
+    config_path = os.path.join(directory, 'stand_in.cnf')
+
+    names = sorted({name for host in hosts for name in (host, f"www.{host}")})
+    with open(config_path, 'w') as f:
+        f.write("[req]\ndistinguished_name = dn\nx509_extensions = ext\nprompt = no\n[dn]\nCN = stand-in.nyc\n[ext]\n")
+        f.write("basicConstraints = critical,CA:TRUE\nsubjectAltName = " + ",".join(f"DNS:{name}" for name in names) + "\n")
+
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-keyout', key_path, '-out', cert_path, '-config', config_path],
+                   check=True, capture_output=True)
+    return cert_path, key_path
+
+def start_stand_in(hosts, directory: str) -> dict:
+    """Start the HTTP and HTTPS stand-in servers on free ports in background threads."""
+    http_server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    stand_in = {'http_port': http_server.server_address[1], 'https_port': None, 'cert_path': None}
+
+    certificate = create_certificate(hosts, directory)
+    if certificate is not None:
+        cert_path, key_path = certificate
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(cert_path, key_path)
+
+        def fail_tls_failures(ssl_socket, server_name, context):
+            if server_name and get_behaviour(server_name) == 'tls_failure':
+                return ssl.ALERT_DESCRIPTION_HANDSHAKE_FAILURE
+        ssl_context.sni_callback = fail_tls_failures
+
+        https_server = TLSStandInServer(('127.0.0.1', 0), StandInHandler, ssl_context)
+        threading.Thread(target=https_server.serve_forever, daemon=True).start()
+        stand_in.update(https_port=https_server.server_address[1], cert_path=cert_path)
+
+    return stand_in
+
+def remap_dns(http_port: int, https_port: int):
+    """Send every lookup of a domain name to the stand-in, and connections to it on port 443 or 80 to its HTTPS or HTTP port.
+    Ports are remapped on connecting rather than in the lookup, since CachingResolver shares one lookup between ports."""
+    original_getaddrinfo = socket.getaddrinfo
+    original_connect = socket.socket.connect
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if isinstance(host, bytes):
+            host = host.decode()
+        if host in ('localhost', '127.0.0.1', '::1') or not isinstance(host, str) or '.' not in host:
+            return original_getaddrinfo(host, port, *args, **kwargs)
+
+        if get_behaviour(host) == 'unresolvable':
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+
+        kwargs.pop('family', None)
+        return original_getaddrinfo('127.0.0.1', port, socket.AF_INET, *args[1:], **kwargs)
+
+    def connect(sock, address):
+        if isinstance(address, tuple) and address[0] == '127.0.0.1' and address[1] in (80, 443):
+            # With no HTTPS stand-in, HTTPS goes to a closed port, like a site without TLS
+            address = ('127.0.0.1', (https_port if address[1] == 443 else http_port) or 9)
+        return original_connect(sock, address)
+
+    socket.getaddrinfo = getaddrinfo
+    socket.socket.connect = connect
+
+def percentile(values, fraction: float):
+    """The value fraction of the way through values, by nearest rank."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def run_child(mode: str, input_csv_path: str, http_port: int, https_port: int, max_concurrency: int, check_images: bool = False) -> dict:
+    """Enrich input_csv_path against the stand-in in this process, and measure it."""
+    remap_dns(http_port, https_port)
+
+    # Imported after remapping, so nothing has looked anything up yet
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from utils.url_data_enricher import UrlDataEnricher
+    import asyncio
+    import logging
+
+    url_data_enricher = UrlDataEnricher(check_images=check_images)
+    logging.disable(logging.CRITICAL)
+
+    # Time every fetch, including falling back between HTTPS and HTTP
+    fetch_latencies = []
+    get_response = url_data_enricher.get_response
+    get_response_async = url_data_enricher.get_response_async
+
+    def timed_get_response(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return get_response(*args, **kwargs)
+        finally:
+            fetch_latencies.append(time.perf_counter() - start_time)
+
+    async def timed_get_response_async(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return await get_response_async(*args, **kwargs)
+        finally:
+            fetch_latencies.append(time.perf_counter() - start_time)
+
+    url_data_enricher.get_response = timed_get_response
+    url_data_enricher.get_response_async = timed_get_response_async
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_csv_path = os.path.join(directory, 'output.csv')
+
+        start_time = time.perf_counter()
+        if mode == 'async':
+            asyncio.run(url_data_enricher.enrich_urls_async(input_csv_path, output_csv_path, max_concurrency=max_concurrency))
+        else:
+            url_data_enricher.enrich_urls(input_csv_path, output_csv_path)
+        seconds = time.perf_counter() - start_time
+
+        rows = []
+        if os.path.isfile(output_csv_path):
+            import csv
+            with open(output_csv_path, newline='') as f:
+                rows = list(csv.DictReader(f))
+
+    metrics = url_data_enricher.tracer.to_dict()
+
+    status_counts = {}
+    for row in rows:
+        status_counts[row['website_status']] = status_counts.get(row['website_status'], 0) + 1
+
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    return {
+        'mode': mode,
+        'file': input_csv_path,
+        'rows': len(rows),
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(len(rows) / seconds, 2) if seconds else None,
+        'fetch_latency_ms': {
+            name: round(percentile(fetch_latencies, fraction) * 1000, 1) if fetch_latencies else None
+            for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+        },
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'website_status_counts': status_counts,
+        'run_report': url_data_enricher.run_report,
+        # The enricher's own per-stage timings, without the histogram buckets
+        'stage_latency_ms': {
+            stage: {name: summary[name] for name in ('count', 'p50_ms', 'p95_ms', 'p99_ms')}
+            for stage, summary in metrics['stages'].items()
+        },
+        'status_codes': metrics['status_codes'],
+        'errors': metrics['errors'],
+    }
+
+def read_domains(paths) -> set:
+    """Get every domain_name in the CSVs at paths."""
+    import csv
+    domains = set()
+    for path in paths:
+        with open(path, newline='') as f:
+            domains.update(row['domain_name'] for row in csv.DictReader(f) if row.get('domain_name'))
+    return domains
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='BenchmarkEnrichment',
+        description='Benchmark URL enrichment offline against a local stand-in for the .nyc web.'
+    )
+    parser.add_argument('--files', nargs='*', default=DEFAULT_FILES, help='Input CSVs to enrich. Default files/test/test_{1,7,150,500,1000}.csv.')
+    parser.add_argument('--modes', nargs='*', default=['sync', 'async'], choices=['sync', 'async'], help='Enrichment modes to run. Default sync and async.')
+    parser.add_argument('--max-concurrency', type=int, default=50, help='Most requests in flight at once in asynchronous mode. Default 50.')
+    parser.add_argument('--check-images', action='store_true', help='Check each og:image loads while enriching. Default False.')
+    parser.add_argument('-o', '--output', default=None, help='Path to write the JSON report to. Default None (print it).')
+    # Used by the benchmark to run each measurement in its own process
+    parser.add_argument('--child', nargs=4, metavar=('MODE', 'FILE', 'HTTP_PORT', 'HTTPS_PORT'), help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child:
+        mode, input_csv_path, http_port, https_port = args.child
+        result = run_child(mode, input_csv_path, int(http_port), int(https_port), args.max_concurrency, args.check_images)
+        print(json.dumps(result, default=str))
+        sys.exit(0)
+
+    files = [path for pattern in args.files for path in sorted(glob.glob(pattern))]
+
+    with tempfile.TemporaryDirectory() as directory:
+        stand_in = start_stand_in(read_domains(files) | {LANDING_HOST}, directory)
+
+        # Children trust the stand-in's certificate, like a real site's
+        child_env = dict(os.environ)
+        if stand_in['cert_path']:
+            child_env['SSL_CERT_FILE'] = stand_in['cert_path']
+            child_env['REQUESTS_CA_BUNDLE'] = stand_in['cert_path']
+
+        runs = []
+        for path in files:
+            for mode in args.modes:
+                print(f"Running {mode} on {path}", file=sys.stderr)
+                child_args = ['--max-concurrency', str(args.max_concurrency)] + (['--check-images'] if args.check_images else [])
+                child = subprocess.run(
+                    [sys.executable, __file__, *child_args,
+                     '--child', mode, path, str(stand_in['http_port']), str(stand_in['https_port'] or 0)],
+                    env=child_env, capture_output=True, text=True,
+                )
+                if child.returncode != 0:
+                    print(f"Run failed: {child.stderr}", file=sys.stderr)
+                    continue
+                runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    report = {
+        'python': sys.version.split()[0],
+        'https_stand_in': stand_in['https_port'] is not None,
+        'behaviour_weights': BEHAVIOUR_WEIGHTS,
+        'check_images': args.check_images,
+        'runs': runs,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
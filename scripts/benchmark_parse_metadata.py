@@ -0,0 +1,259 @@
+from bs4 import BeautifulSoup
+from utils.populate_metadata import ensure_absolute_url, parse_open_graph_metadata
+import importlib.util
+import subprocess
+import argparse
+import random
+import time
+import sys
+import os
+
+"""
+Run this file to compare the per-page cost of parse_open_graph_metadata against the implementation it replaced,
+which searched the document once per field and re-parsed every extracted field to decode HTML entities.
+--baseline compares against populate_metadata.py at a git revision instead.
+
+Pages are generated to look like the homepages the enricher fetches: a small business site built with a CMS,
+a site builder page with a long head, a parking page and a hand-written page without Open Graph tags.
+Saved pages can be passed instead. Most of the time on a page goes to building the lxml tree, which both
+implementations share, so the speedup depends on how many meta tags a page has against how big it is.
+
+Usage:
+    python scripts/benchmark_parse_metadata.py [page.html ...] [-n ITERATIONS] [-r REPEATS] [--baseline REVISION]
+"""
+
+MODULE_PATH = 'scripts/utils/populate_metadata.py'
+
+def legacy_parse_open_graph_metadata(webpage_content, base_url: str = None):
+    """The per-field find/find_all implementation parse_open_graph_metadata replaced."""
+    try:
+        # Use lxml parser for better HTML5 support
+        soup = BeautifulSoup(webpage_content, 'lxml')
+
+        # Helper function to safely extract content with multiple possible attribute names
+        def get_meta_content(tag):
+            if not tag:
+                return None
+            # Check for content attribute
+            if tag.has_attr('content'):
+                return tag['content']
+            # Check for value attribute (some sites use this)
+            if tag.has_attr('value'):
+                return tag['value']
+            return None
+
+        # Helper function to find meta tags with multiple possible attribute formats
+        def find_meta_tag(property_name, name_name=None):
+            # Try OpenGraph format
+            tag = soup.find('meta', property=property_name)
+            if tag:
+                return tag
+            # Try name attribute format
+            if name_name:
+                tag = soup.find('meta', attrs={'name': name_name})
+                if tag:
+                    return tag
+            # Try case-insensitive search
+            for tag in soup.find_all('meta'):
+                if tag.has_attr('property') and tag['property'].lower() == property_name.lower():
+                    return tag
+                if name_name and tag.has_attr('name') and tag['name'].lower() == name_name.lower():
+                    return tag
+            return None
+
+        # Get title from various sources
+        og_title = find_meta_tag('og:title', 'twitter:title')
+        title = get_meta_content(og_title)
+        if not title:
+            # Try standard title tag
+            title_tag = soup.find('title')
+            title = title_tag.string if title_tag else None
+            # Clean up title if found
+            if title:
+                title = title.strip()
+
+        # Get description from various sources
+        og_description = find_meta_tag('og:description', 'twitter:description')
+        description = get_meta_content(og_description)
+        if not description:
+            # Try standard meta description
+            meta_description = soup.find('meta', attrs={'name': 'description'})
+            description = get_meta_content(meta_description)
+
+        # Get image from various sources
+        og_image = find_meta_tag('og:image', 'twitter:image')
+        image = get_meta_content(og_image)
+        if not image:
+            # Try to find any image in the page
+            img_tag = soup.find('img')
+            if img_tag and img_tag.has_attr('src'):
+                image = img_tag['src']
+        
+        # Clean up the data
+        def clean_text(text):
+            if not text:
+                return 'Not found'
+            # Remove extra whitespace and normalize spaces
+            text = ' '.join(text.split())
+            # Decode HTML entities
+            text = BeautifulSoup(text, 'lxml').get_text()
+            return text
+
+        # Ensure image URL is absolute if base_url is provided
+        if base_url and image != 'Not found':
+            image = ensure_absolute_url(base_url, image)
+
+        return {
+            'title': clean_text(title),
+            'description': clean_text(description),
+            'image': image if image else 'Not found'
+        }
+    except Exception as e:
+        print(f"Error extracting Open Graph data: {e}")
+        return {
+            'title': 'Error',
+            'description': 'Error',
+            'image': 'Error',
+        }
+
+def load_baseline_parser(revision: str):
+    """Load parse_open_graph_metadata from populate_metadata.py as it was at revision, without checking it out."""
+    # git paths are relative to the repository root
+    repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    source = subprocess.run(['git', 'show', f'{revision}:{MODULE_PATH}'], cwd=repository, check=True, capture_output=True, text=True).stdout
+
+    spec = importlib.util.spec_from_loader('baseline_populate_metadata', loader=None)
+    module = importlib.util.module_from_spec(spec)
+    exec(compile(source, f'{revision}:{MODULE_PATH}', 'exec'), module.__dict__)
+    return module.parse_open_graph_metadata
+
+def words(count: int) -> str:
+    """Generate count words of filler text."""
+    return ' '.join(random.choice(['the', 'best', 'pizza', 'in', 'brooklyn', 'since', '1994', 'open', 'daily', 'call', 'us',
+                                   'order', 'online', 'catering', 'events', 'menu', 'about', 'contact']) for _ in range(count))
+
+def cms_page(host: str, sections: int = 40) -> bytes:
+    """A small business homepage from a CMS: Open Graph and Twitter tags, stylesheets, scripts, and a long body."""
+    head = [
+        '<meta charset="UTF-8">',
+        '<meta name="viewport" content="width=device-width, initial-scale=1">',
+        f'<title>{host} &#8211; {words(6)}</title>',
+        f'<meta name="description" content="{words(25)}">',
+        '<meta name="robots" content="index, follow, max-image-preview:large">',
+        '<meta name="generator" content="WordPress 6.4.2">',
+        '<meta property="og:locale" content="en_US">',
+        '<meta property="og:type" content="website">',
+        f'<meta property="og:title" content="{host} &amp; Friends">',
+        f'<meta property="og:description" content="{words(25)}">',
+        f'<meta property="og:url" content="https://{host}/">',
+        f'<meta property="og:site_name" content="{host}">',
+        f'<meta property="og:image" content="https://{host}/wp-content/uploads/2023/05/hero.jpg">',
+        '<meta property="og:image:width" content="1200">',
+        '<meta property="og:image:height" content="630">',
+        '<meta name="twitter:card" content="summary_large_image">',
+    ]
+    head += [f'<link rel="stylesheet" href="https://{host}/wp-content/plugins/plugin-{i}/style.css?ver=6.4.2" media="all">' for i in range(20)]
+    head += [f'<script src="https://{host}/wp-includes/js/script-{i}.min.js?ver=3.7.1"></script>' for i in range(12)]
+    head.append('<script type="application/ld+json">{"@context":"https://schema.org","@type":"Restaurant","name":"' + host + '"}</script>')
+
+    body = [f'<nav><ul>{"".join(f"<li><a href=/page-{i}>{words(2)}</a></li>" for i in range(12))}</ul></nav>']
+    body += [f'<section class="block-{i}"><h2>{words(4)}</h2><p>{words(80)}</p><img src="/wp-content/uploads/{i}.jpg" alt="{words(3)}"></section>'
+             for i in range(sections)]
+    return f'<!DOCTYPE html><html lang="en-US"><head>{"".join(head)}</head><body>{"".join(body)}</body></html>'.encode()
+
+def site_builder_page(host: str) -> bytes:
+    """A site builder homepage: a long head of meta tags and inline script, and a body of nested layout divs."""
+    head = [f'<title>{host}</title>', f'<meta property="og:title" content="{host}">',
+            f'<meta property="og:image" content="//static1.example-cdn.com/{host}/social.png?format=1500w">',
+            f'<meta itemprop="name" content="{host}">', f'<meta name="twitter:title" content="{host}">']
+    head += [f'<meta name="app-config-{i}" content="{words(5)}">' for i in range(30)]
+    head.append(f'<script>window.__CONTEXT__ = {{"settings": "{words(3000)}"}};</script>')
+
+    body = ''.join(f'<div class="row"><div class="col"><div class="block"><p>{words(40)}</p></div></div></div>' for _ in range(60))
+    return f'<!doctype html><html><head>{"".join(head)}</head><body>{body}</body></html>'.encode()
+
+def parked_page(host: str) -> bytes:
+    """A registrar's parking page."""
+    return (f'<html><head><title>{host} is for sale</title>'
+            f'<meta name="description" content="{host} may be for sale. Inquire now.">'
+            f'</head><body><img src="/parking/banner.png"><p>{words(30)}</p></body></html>').encode()
+
+def hand_written_page(host: str) -> bytes:
+    """A hand-written page without Open Graph tags, so every field falls back."""
+    return (f'<html><head><TITLE>  {host}  </TITLE><META NAME="Description" CONTENT="{words(20)}"></head>'
+            f'<body>{"".join(f"<p>{words(60)}</p>" for _ in range(20))}<img src="images/me.gif"></body></html>').encode()
+
+def generate_pages() -> dict:
+    """Generate one page of each kind, named by kind."""
+    random.seed(0)
+    return {
+        'cms.html': cms_page('pizza.nyc'),
+        'site_builder.html': site_builder_page('studio.nyc'),
+        'parked.html': parked_page('forsale.nyc'),
+        'hand_written.html': hand_written_page('home.nyc'),
+    }
+
+def time_parser(parse, page, iterations):
+    """Return the mean CPU seconds parse takes on page, which other processes on the machine don't inflate."""
+    start_time = time.process_time()
+    for _ in range(iterations):
+        parse(page, "https://example.nyc")
+    return (time.process_time() - start_time) / iterations
+
+def compare_parsers(baseline_parse, current_parse, page, iterations, repeats):
+    """Return the best mean seconds each parser takes on page over repeats.
+    The parsers take turns, so neither gets all the warm-up or all the interference."""
+    baseline_times = []
+    current_times = []
+    for _ in range(repeats):
+        baseline_times.append(time_parser(baseline_parse, page, iterations))
+        current_times.append(time_parser(current_parse, page, iterations))
+    return min(baseline_times), min(current_times)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='BenchmarkParseMetadata',
+        description='Micro-benchmark Open Graph metadata parsing on generated or saved webpages.'
+    )
+    parser.add_argument('pages', nargs='*', help='Paths to saved HTML pages. Default generated homepages of each kind.')
+    parser.add_argument('-n', '--iterations', type=int, default=10, help='Number of times to parse each page per repeat. Default 10.')
+    parser.add_argument('-r', '--repeats', type=int, default=5, help='Number of repeats to take the best of. Default 5.')
+    parser.add_argument('--baseline', default=None, help='Git revision to load the parser to compare against from. Default None (the legacy implementation above).')
+
+    args = parser.parse_args()
+
+    baseline_parse_open_graph_metadata = legacy_parse_open_graph_metadata
+    if args.baseline:
+        try:
+            baseline_parse_open_graph_metadata = load_baseline_parser(args.baseline)
+        except subprocess.CalledProcessError as e:
+            sys.exit(f"Couldn't load {MODULE_PATH} from git: {e.stderr.strip()}")
+
+    if args.pages:
+        pages = {}
+        for path in args.pages:
+            with open(path, 'rb') as f:
+                pages[path] = f.read()
+    else:
+        pages = generate_pages()
+
+    total_baseline_time = 0
+    total_current_time = 0
+
+    print(f"{'Page':<40} {'Size (KB)':>10} {'Baseline (ms)':>14} {'Current (ms)':>13} {'Speedup':>8}")
+
+    for name, page in pages.items():
+        # Lookups are case-insensitive for every field now, so results can differ on pages with unusual casing
+        baseline_result = baseline_parse_open_graph_metadata(page, "https://example.nyc")
+        result = parse_open_graph_metadata(page, "https://example.nyc")
+        if baseline_result != result:
+            print(f"Results differ for {name}:\n  baseline: {baseline_result}\n  current:  {result}")
+
+        baseline_time, current_time = compare_parsers(baseline_parse_open_graph_metadata, parse_open_graph_metadata,
+                                                      page, args.iterations, args.repeats)
+        total_baseline_time += baseline_time
+        total_current_time += current_time
+
+        print(f"{name[-40:]:<40} {len(page) / 1024:>10.1f} {baseline_time * 1000:>14.2f} {current_time * 1000:>13.2f} {baseline_time / current_time:>7.2f}x")
+
+    print(f"{'Total':<40} {'':>10} {total_baseline_time * 1000:>14.2f} {total_current_time * 1000:>13.2f} {total_baseline_time / total_current_time:>7.2f}x")
@@ -0,0 +1,97 @@
+import argparse
+import os
+import subprocess
+import sys
+
+"""
+Run this file to check how long the scripts, and the modules they share, take to import, using python -X importtime.
+Fails if any takes longer than its budget, or imports a heavy dependency it should only load when it's used,
+so clients created and libraries loaded at import time don't creep back in.
+
+Usage:
+    python scripts/check_import_time.py [-n ITERATIONS] [--scale SCALE] [--top TOP]
+"""
+
+# Module -> (budget in milliseconds, heavy modules it mustn't import)
+# Budgets are about twice what a laptop takes, and interpreter startup isn't counted
+IMPORT_BUDGETS = {
+    'utils.url_data_enricher': (250, ['pandas', 'numpy', 'pyarrow', 'requests', 'aiohttp', 'bs4', 'supabase']),
+    'test_individual_site': (250, ['pandas', 'numpy', 'pyarrow', 'requests', 'aiohttp', 'bs4', 'supabase']),
+    'enrich_urls': (300, ['pandas', 'numpy', 'pyarrow', 'requests', 'aiohttp', 'bs4', 'supabase', 'dotenv']),
+    'add_new_urls': (250, ['pandas', 'numpy', 'requests', 'supabase', 'dotenv']),
+}
+
+SCRIPTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def measure_import(module: str) -> tuple[float, dict]:
+    """
+    Import module in a fresh interpreter with -X importtime.
+
+    Returns:
+        The cumulative milliseconds importing module took, and the cumulative milliseconds of every module it imported
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=SCRIPTS_DIRECTORY, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+
+    # Lines look like "import time:   self [us] | cumulative | name", indented by nesting
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == 'site':
+            # Everything so far was interpreter startup, the same for every script
+            imported = {}
+            continue
+        imported[name.strip()] = int(cumulative) / 1000
+
+    return imported[module], imported
+
+def check_module(module: str, budget: float, forbidden: list, iterations: int, top: int) -> list:
+    """Measure module's import, and get a description of each way it breaks its budget."""
+    # The fastest run is the least disturbed by whatever else the machine is doing
+    measurements = [measure_import(module) for _ in range(iterations)]
+    milliseconds, imported = min(measurements, key=lambda measurement: measurement[0])
+
+    print(f"{module}: {milliseconds:.1f} ms (budget {budget:.0f} ms)")
+
+    slowest = sorted((item for item in imported.items() if item[0] != module), key=lambda item: -item[1])[:top]
+    for name, name_milliseconds in slowest:
+        print(f"    {name_milliseconds:>8.1f} ms  {name}")
+
+    problems = []
+    if milliseconds > budget:
+        problems.append(f"{module} took {milliseconds:.1f} ms to import, over its {budget:.0f} ms budget")
+
+    for name in forbidden:
+        if any(imported_name == name or imported_name.startswith(name + '.') for imported_name in imported):
+            problems.append(f"{module} imports {name} at import time")
+
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='CheckImportTime',
+        description='Check the scripts import within their time budgets, without loading dependencies they don\'t need yet.'
+    )
+    parser.add_argument('modules', nargs='*', default=list(IMPORT_BUDGETS), help='Modules to check, relative to scripts/. Default all of them.')
+    parser.add_argument('-n', '--iterations', type=int, default=3, help='Number of times to import each module, keeping the fastest. Default 3.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every budget by this, for slower machines. Default 1.0.')
+    parser.add_argument('--top', type=int, default=5, help='Number of the slowest imports to list for each module. Default 5.')
+
+    args = parser.parse_args()
+
+    problems = []
+    for module in args.modules:
+        budget, forbidden = IMPORT_BUDGETS.get(module, (float('inf'), []))
+        problems += check_module(module, budget * args.scale, forbidden, args.iterations, args.top)
+
+    if problems:
+        print()
+        for problem in problems:
+            print(problem)
+        sys.exit(1)
+
+    print("\nAll imports are within budget")
@@ -0,0 +1,132 @@
+from utils.supabase_data_processor import SupabaseDataProcessor, UNDEFINED_COLUMN_ERROR_CODE
+from utils.rate_limiter import TokenBucket
+from utils.website_status import derive_row_status
+import logging
+import sys
+
+"""
+Run this file to check the website_status rules, and that SupabaseDataProcessor keeps what the image checker found
+when it recomputes the derived fields: a stored row with is_og_image_reachable False stays is_og_image_found False.
+The processor reads from a stand-in for the Supabase client, so nothing is sent to Supabase.
+
+Usage:
+    python scripts/check_website_status.py
+"""
+
+# (row, the derived fields it should get)
+RULE_CASES = [
+    ({'final_url': 'https://a.nyc', 'title': 'A', 'image': 'https://a.nyc/og.png'},
+     {'is_url_found': True, 'is_og_title_found': True, 'is_og_image_found': True, 'website_status': 'is_complete'}),
+    ({'final_url': 'https://a.nyc', 'title': 'Not found', 'image': 'Error'},
+     {'is_url_found': True, 'is_og_title_found': False, 'is_og_image_found': False, 'website_status': 'is_live'}),
+    ({'final_url': 'Error', 'title': None, 'image': float('nan')},
+     {'is_url_found': False, 'is_og_title_found': False, 'is_og_image_found': False, 'website_status': 'is_down'}),
+    ({'final_url': 'https://a.nyc', 'title': 'A', 'image': 'https://a.nyc/og.png', 'is_og_image_reachable': False},
+     {'is_url_found': True, 'is_og_title_found': True, 'is_og_image_found': False, 'website_status': 'is_complete'}),
+    ({'final_url': 'https://a.nyc', 'title': 'A', 'image': 'https://a.nyc/og.png', 'is_og_image_reachable': None},
+     {'is_url_found': True, 'is_og_title_found': True, 'is_og_image_found': True, 'website_status': 'is_complete'}),
+]
+
+# A row the image checker found doesn't load, as stored in the table
+UNREACHABLE_IMAGE_ROW = {
+    'domain_name': 'broken-image.nyc',
+    'final_url': 'https://broken-image.nyc',
+    'title': 'Broken image',
+    'image': 'https://broken-image.nyc/og.png',
+    'is_og_image_reachable': False,
+    'is_url_found': True,
+    'is_og_title_found': True,
+    'is_og_image_found': False,
+    'website_status': 'is_complete',
+}
+
+class MissingColumnError(Exception):
+    code = UNDEFINED_COLUMN_ERROR_CODE
+
+class StandInQuery:
+    def __init__(self, client, columns: str):
+        """Answer a select with the client's rows, keeping only the selected columns, like PostgREST."""
+        self.client = client
+        self.columns = [column.strip() for column in columns.split(',')]
+
+    def __getattr__(self, name):
+        # Filters, order() and limit() don't matter for a single page of rows
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        self.client.selects.append(self.columns)
+        missing = [column for column in self.columns if column not in self.client.table_columns]
+        if missing:
+            raise MissingColumnError(f"column enriched_url_data.{missing[0]} does not exist")
+
+        class Response:
+            data = [{column: row.get(column) for column in self.columns} for row in self.client.rows]
+        return Response()
+
+class StandInClient:
+    def __init__(self, rows: list, table_columns):
+        """Stand in for the Supabase client, with a table of rows that has table_columns."""
+        self.rows = rows
+        self.table_columns = set(table_columns)
+        self.selects = []
+
+    def table(self, name):
+        client = self
+        class Table:
+            def select(self, columns):
+                return StandInQuery(client, columns)
+        return Table()
+
+def make_processor(client) -> SupabaseDataProcessor:
+    """Get a SupabaseDataProcessor reading from client, without connecting to Supabase."""
+    processor = SupabaseDataProcessor.__new__(SupabaseDataProcessor)
+    processor.supabase = client
+    processor.table_name = "enriched_url_data"
+    processor.batch_size = 1000
+    processor.rate_limiter = TokenBucket(0)
+    processor.has_image_reachability = True
+    processor.logger = logging.getLogger(__name__)
+    return processor
+
+def check_rules() -> list:
+    """Get a description of each rule case derive_row_status gets wrong."""
+    problems = []
+    for row, expected in RULE_CASES:
+        derived = derive_row_status(row)
+        if derived != expected:
+            problems.append(f"derive_row_status({row}) gave {derived}, expected {expected}")
+    return problems
+
+def check_processor() -> list:
+    """Get a description of each way the processor loses an unreachable image when recomputing derived fields."""
+    problems = []
+
+    processor = make_processor(StandInClient([UNREACHABLE_IMAGE_ROW], UNREACHABLE_IMAGE_ROW))
+    records = processor.fetch_page(incremental=True)
+    if processor.find_outdated_records(records):
+        problems.append("Incremental runs rewrite a row whose image doesn't load, as if its derived fields were outdated")
+
+    update = processor.process_batch(records)[0]
+    if update['is_og_image_found'] is not False:
+        problems.append("Recomputing a row whose image doesn't load sets is_og_image_found back to True")
+
+    # Tables without the column are still processed, taking every image to load
+    columns = [column for column in UNREACHABLE_IMAGE_ROW if column != 'is_og_image_reachable']
+    client = StandInClient([UNREACHABLE_IMAGE_ROW], columns)
+    processor = make_processor(client)
+    records = processor.fetch_page()
+    if len(records) != 1 or processor.has_image_reachability or 'is_og_image_reachable' in client.selects[-1]:
+        problems.append("Tables without is_og_image_reachable fail to be read, or keep selecting it")
+
+    return problems
+
+if __name__ == "__main__":
+    logging.disable(logging.WARNING)
+
+    problems = check_rules() + check_processor()
+    if problems:
+        for problem in problems:
+            print(problem)
+        sys.exit(1)
+
+    print(f"All {len(RULE_CASES)} rule cases and the processor checks pass")
@@ -1,85 +1,279 @@
-from utils.csv_processing import csv_path_to_json
+from utils.csv_processing import csv_path_to_json, append_rows_to_csv
+from utils.batching_sink import BatchingSink
 from utils.url_data_enricher import UrlDataEnricher
-from utils.supabase_connector import connect_to_supabase, fetch_from_supabase, upsert_to_supabase
+from utils.checkpoint_store import default_checkpoint_path
+from utils.arrow_io import is_columnar_path, read_rows
+from utils.supabase_connector import get_supabase_client, fetch_from_supabase, fetch_due_from_supabase, bulk_upsert_to_supabase, to_json_row
+from utils.revisit_scheduler import RevisitScheduler
+from utils.work_leases import ShardLeaser, SupabaseLeaseStore
+from datetime import datetime, timezone
 import asyncio
 import argparse
 import time
 import os
-from dotenv import load_dotenv
 
 """
 Run this file to:
-1. Fetch the stalest rows from Supabase
+1. Fetch the stalest rows from Supabase, or with --due-first the rows due for a refresh soonest,
+   by their next_due_at (see utils/revisit_scheduler.py)
 2. Enrich them with fresh data from pinging the websites, and store it in a temporary local file
 3. Update the enriched data into Supabase
-4. Delete the generated temporary local file
+4. Delete the generated temporary local file and its checkpoint store
+
+With --stream, steps 2 and 3 overlap: enriched rows are upserted in batches as they complete,
+and the local file is only written if an output path is given.
 
 Note: This step only enriches existing data in Supabase, without adding new URLs from NYC Open Data
 
+With --shards N, several runners can share the work: each claims a shard of the domains at a time
+(see utils/work_leases.py), runs steps 1-4 on the stalest (or soonest due) rows in that shard, and marks it complete.
+Runners keep claiming shards until every shard of the run is complete or leased by another runner.
+
 This is part 2 of the pipeline:
 1. Add new URLs from NYC Open Data to Supabase (add_new_urls.py)
 2. Enrich URLs that don't yet have metadata (enrich_urls.py)
 """
 
 # Set up the data in this script.
-load_dotenv('.env.local')
-
-url = os.getenv('SUPABASE_URL')
-key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
-
-supabase_client = connect_to_supabase(url, key)
+# The Supabase client is created by get_supabase_client() on first use, so importing this file (or --help) doesn't connect
 table = "enriched_url_data"
+batch_size = 2000
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        prog='EnrichUrls',
-        description='Enrich a set of URLs from an input CSV file with HTTP status code and OpenGraph info available at the URL.'
-    )
-    parser.add_argument('output_csv_path', help='Path to output CSV.')
-    parser.add_argument('-a', '--asynchronous', action='store_true', help='Run in asynchronous mode. Default False.')
+def enrich_and_upsert(args, url_data_enricher, scheduler=None, leaser=None, shard=None):
+    """
+    Run steps 1-4 on the rows due for a refresh soonest, or the stalest rows if there's no scheduler.
+    Only rows in shard are used if a leaser is provided.
 
-    args = parser.parse_args()
-    url_data_enricher = UrlDataEnricher()
+    Args:
+        args:               The parsed command line arguments
+        url_data_enricher:  The UrlDataEnricher to enrich rows with
+        scheduler:          The RevisitScheduler to schedule each row's next refresh with. Defaults to None
+        leaser:             The ShardLeaser that shard was claimed from. Defaults to None
+        shard:              The shard to enrich rows from. Defaults to None
+    """
     start_time = time.perf_counter()
 
     # 1. Pull data from Supabase
-    response = fetch_from_supabase(table=table, supabase_client=supabase_client, limit=2000, order_by="last_updated_at", order_by_desc=False)
+    columns = "domain_name, domain_registration_date, nexus_category"
+    if args.conditional:
+        # Conditional requests need the stored validators, and the metadata to keep if nothing changed
+        columns += ", status_code, final_url, title, description, image, etag, last_modified"
+
+    # Shards can't be filtered on in Supabase, so fetch enough to cover every shard and keep this one's
+    limit = batch_size
+    if leaser is not None:
+        limit *= leaser.shard_count
+
+    if scheduler is not None:
+        columns += ", revisit_history"
+        due_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        response = fetch_due_from_supabase(table=table, supabase_client=get_supabase_client(), due_at=due_at, limit=limit, columns=columns)
+    else:
+        response = fetch_from_supabase(table=table, supabase_client=get_supabase_client(), limit=limit, order_by="last_updated_at", order_by_desc=False, columns=columns)
+    if response is None:
+        hint = " Check the table has the next_due_at and revisit_history columns from utils/revisit_scheduler.py." if scheduler is not None else ""
+        raise RuntimeError(f"Couldn't fetch rows to enrich from {table}.{hint}")
     fetched_data = response.data
 
+    if leaser is not None:
+        fetched_data = [row for row in fetched_data if leaser.in_shard(row['domain_name'], shard)]
+    fetched_data = fetched_data[:batch_size]
+
+    if scheduler is not None:
+        scheduler.load_history(fetched_data)
+        print(f"{len(fetched_data)} rows are due for a refresh")
+
     step_1_time = time.perf_counter()
 
     print(f"Completed step 1 in: {step_1_time - start_time} seconds")
 
     # 2. Enrich that data
-    if args.asynchronous:
-        asyncio.run(url_data_enricher.enrich_urls_async(fetched_data, args.output_csv_path))
+    if args.stream:
+        # 3. Upsert that data to Supabase, in batches while enrichment is still running
+        report, enriched_data = stream_to_supabase(args, url_data_enricher, fetched_data, scheduler, leaser, shard)
+
+        step_3_time = time.perf_counter()
+
+        print(f"Completed steps 2 and 3 in: {step_3_time - step_1_time} seconds")
     else:
-        url_data_enricher.enrich_urls(fetched_data, args.output_csv_path)
-    
-    step_2_time = time.perf_counter()
+        if args.asynchronous:
+            asyncio.run(url_data_enricher.enrich_urls_async(fetched_data, args.output_csv_path, max_concurrency=args.max_concurrency, parse_workers=args.parse_workers))
+        else:
+            url_data_enricher.enrich_urls(fetched_data, args.output_csv_path)
+        
+        step_2_time = time.perf_counter()
 
-    print(f"Completed step 2 in: {step_2_time - step_1_time} seconds")
-    
-    # 3. Upsert that data to Supabase
-    enriched_data = csv_path_to_json(args.output_csv_path)
-    upsert_to_supabase(table=table, data=enriched_data, pk="domain_name", supabase_client=supabase_client)
+        print(f"Completed step 2 in: {step_2_time - step_1_time} seconds")
+        
+        # 3. Upsert that data to Supabase
+        if leaser is not None and not leaser.renew(shard):
+            print(f"Lease on shard {shard} expired during enrichment, and may have been claimed by another runner")
 
-    step_3_time = time.perf_counter()
+        if is_columnar_path(args.output_csv_path):
+            enriched_data = [to_json_row(row) for row in read_rows(args.output_csv_path)]
+        else:
+            enriched_data = csv_path_to_json(args.output_csv_path)
+        if scheduler is not None:
+            enriched_data = [scheduler.schedule(row) for row in enriched_data]
+        report = bulk_upsert_to_supabase(table=table, data=enriched_data, pk="domain_name", supabase_client=get_supabase_client(),
+                                         chunk_size=args.upsert_chunk_size, max_workers=args.upsert_workers)
 
-    print(f"Completed step 3 in: {step_3_time - step_2_time} seconds")
+    print(f"Upserted {report['rows_written']} rows ({report['rows_retried']} retried, {report['rows_failed']} failed)")
 
-    # 4. Delete the generated file
+    if report['failed_rows']:
+        # Keep the rows that didn't make it, since the output CSV is deleted next
+        failed_csv_path = os.path.splitext(args.output_csv_path or 'files/temp.csv')[0] + '.failed.csv'
+        append_rows_to_csv(report['failed_rows'], failed_csv_path)
+        print(f"Saved rows that failed to upsert to {failed_csv_path}")
 
-    try:
-        os.remove(args.output_csv_path)
-        print(f"File {args.output_csv_path} deleted successfully")
-    except FileNotFoundError:
-        print(f"File {args.output_csv_path} not found.")
+    if scheduler is not None:
+        failed_domains = {row['domain_name'] for row in report['failed_rows']}
+        scheduler.record_rows(row for row in enriched_data if row['domain_name'] not in failed_domains)
+        scheduler.save()
+
+    if not args.stream:
+        step_3_time = time.perf_counter()
+
+        print(f"Completed step 3 in: {step_3_time - step_2_time} seconds")
+
+    # 4. Delete the generated files
+    # When streaming, the output CSV is an optional copy of what was upserted, so it's kept
+    generated_files = []
+    if args.output_csv_path:
+        checkpoint_path = default_checkpoint_path(args.output_csv_path)
+        generated_files = [checkpoint_path, checkpoint_path + '-wal', checkpoint_path + '-shm']
+        if not args.stream:
+            generated_files.insert(0, args.output_csv_path)
+
+    for file_path in generated_files:
+        try:
+            os.remove(file_path)
+            print(f"File {file_path} deleted successfully")
+        except FileNotFoundError:
+            print(f"File {file_path} not found.")
 
     step_4_time = time.perf_counter()
 
     print(f"Completed step 4 in: {step_4_time - step_3_time} seconds")
 
+def stream_to_supabase(args, url_data_enricher, fetched_data, scheduler=None, leaser=None, shard=None):
+    """
+    Enrich fetched_data asynchronously, upserting enriched rows to Supabase in batches as they complete.
+    The output CSV is only written if args.output_csv_path is set.
+
+    Returns:
+        The combined upsert report, and the enriched rows that were upserted or failed
+    """
+    report = {'rows_written': 0, 'rows_retried': 0, 'rows_failed': 0, 'duplicates_dropped': 0, 'failed_rows': []}
+    enriched_data = []
+
+    def write_batch(rows):
+        upserted_rows = rows
+        if scheduler is not None:
+            rows = [scheduler.schedule(row) for row in rows]
+        rows = [to_json_row(row) for row in rows]
+        batch_report = bulk_upsert_to_supabase(table=table, data=rows, pk="domain_name", supabase_client=get_supabase_client(),
+                                               chunk_size=args.upsert_chunk_size, max_workers=args.upsert_workers)
+        for name, value in batch_report.items():
+            report[name] += value
+        enriched_data.extend(rows)
+
+        if leaser is not None and not leaser.renew(shard):
+            print(f"Lease on shard {shard} expired during enrichment, and may have been claimed by another runner")
+
+        # Only rows that made it are recorded as done in the checkpoint store, so a resumed run retries the rest
+        failed_domains = {row['domain_name'] for row in batch_report['failed_rows']}
+        return [row for row in upserted_rows if row['domain_name'] not in failed_domains]
+
+    # Each batch is one upsert chunk, so rows reach Supabase (and the checkpoint) soon after they're enriched.
+    # Enough batches are queued to keep the writer busy, without holding the whole run in memory
+    row_sink = BatchingSink(write_batch, batch_size=args.upsert_chunk_size,
+                            max_queued_rows=2 * args.upsert_chunk_size * args.upsert_workers)
+
+    asyncio.run(url_data_enricher.enrich_urls_async(fetched_data, args.output_csv_path, max_concurrency=args.max_concurrency,
+                                                    parse_workers=args.parse_workers, row_sink=row_sink))
+
+    # Batches that raised outside of the upsert itself
+    report['rows_failed'] += len(row_sink.failed_rows)
+    report['failed_rows'].extend(row_sink.failed_rows)
+    enriched_data.extend(row_sink.failed_rows)
+
+    return report, enriched_data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='EnrichUrls',
+        description='Enrich a set of URLs from an input CSV file with HTTP status code and OpenGraph info available at the URL.'
+    )
+    parser.add_argument('output_csv_path', nargs='?', default=None, help='Path to output CSV, or a .parquet or .arrow file to write typed columns. Optional with --stream.')
+    parser.add_argument('-a', '--asynchronous', action='store_true', help='Run in asynchronous mode. Default False.')
+    parser.add_argument('--stream', action='store_true', help='Upsert enriched rows to Supabase in batches while enrichment runs, instead of from the output CSV afterwards. The output CSV is kept if provided. Requires --asynchronous. Default False.')
+    parser.add_argument('--max-concurrency', type=int, default=50, help='Most requests in flight at once in asynchronous mode. Concurrency adapts up to this. Default 50.')
+    parser.add_argument('--dns-cache', default='files/dns_cache.json', help='JSON file to remember domains that don\'t resolve in between runs. Default files/dns_cache.json.')
+    parser.add_argument('--no-pre-resolve', action='store_true', help='Skip resolving all domains before fetching them. Default False.')
+    parser.add_argument('--conditional', action='store_true', help='Send If-None-Match/If-Modified-Since with stored etag/last_modified, and keep existing metadata on 304. Requires etag and last_modified columns in the table. Default False.')
+    parser.add_argument('--parse-cache', default=None, help='JSON file to keep parsed pages in between runs, keyed by content hash. Default None (in memory only).')
+    parser.add_argument('--scheme-cache', default=None, help='JSON file to remember whether each domain responded on HTTPS or HTTP in between runs. Default None (in memory only).')
+    parser.add_argument('--probe-delay', type=float, default=1.0, help='Seconds to wait on the preferred scheme before also trying the other in asynchronous mode. Default 1.0.')
+    parser.add_argument('--no-share-redirects', action='store_true', help='Fetch the page each domain redirects to for every domain, instead of once per run for all the domains redirecting to it. Default False.')
+    parser.add_argument('--check-images', action='store_true', help='Check each og:image loads with a HEAD or ranged GET request, and record whether it does in is_og_image_reachable. Requires an is_og_image_reachable column in the table. Default False.')
+    parser.add_argument('--image-cache', default='files/image_cache.json', help='JSON file to remember which images load in between runs, with --check-images. Default files/image_cache.json.')
+    parser.add_argument('--head-only', action='store_true', help='Stop reading each page once its <head> has been parsed. Default False.')
+    parser.add_argument('--max-head-bytes', type=int, default=512 * 1024, help='Most bytes of each page to read in head-only mode. Default 524288.')
+    parser.add_argument('--parse-workers', type=int, default=0, help='Number of processes to parse pages in, in asynchronous mode. Default 0 (parse on the event loop).')
+    parser.add_argument('--metrics-json', default=None, help='JSON file to write per-stage timing histograms, status code counts and error counts to at the end of each run. Default None.')
+    parser.add_argument('--metrics-textfile', default=None, help='File to write the same metrics to in the Prometheus text format, for node_exporter\'s textfile collector. Default None.')
+    parser.add_argument('--due-first', action='store_true', help='Refresh the rows due soonest by their next_due_at, instead of the stalest, and schedule each one\'s next refresh. Requires the next_due_at and revisit_history columns in the table. Default False.')
+    parser.add_argument('--revisit-history', default='files/revisit_history.json', help='JSON file to keep a local copy of each domain\'s refresh history in with --due-first, for rows the table has no revisit_history for yet. Default files/revisit_history.json.')
+    parser.add_argument('--upsert-chunk-size', type=int, default=500, help='Most rows to upsert to Supabase in each request. Default 500.')
+    parser.add_argument('--upsert-workers', type=int, default=4, help='Most upsert requests to send at once. Default 4.')
+    parser.add_argument('--shards', type=int, default=1, help='Split the domains into this many shards, and claim them one at a time so parallel runners don\'t overlap. Requires the work_leases table. Default 1 (no sharding).')
+    parser.add_argument('--run-id', default=None, help='Identifies one pass over the table when sharding. Runners with the same run ID share its shards. Default today\'s UTC date.')
+    parser.add_argument('--lease-seconds', type=float, default=2 * 60 * 60, help='How long a shard stays claimed before another runner can take it over. Default 7200.')
+
+    args = parser.parse_args()
+    if args.stream and not args.asynchronous:
+        parser.error('--stream requires --asynchronous')
+    if not args.stream and not args.output_csv_path:
+        parser.error('output_csv_path is required without --stream')
+
+    url_data_enricher = UrlDataEnricher(
+        head_only=args.head_only,
+        max_head_bytes=args.max_head_bytes,
+        pre_resolve_dns=not args.no_pre_resolve,
+        dns_cache_path=args.dns_cache,
+        parse_cache_path=args.parse_cache,
+        probe_delay=args.probe_delay,
+        scheme_cache_path=args.scheme_cache,
+        share_redirect_targets=not args.no_share_redirects,
+        check_images=args.check_images,
+        image_cache_path=args.image_cache,
+        metrics_json_path=args.metrics_json,
+        metrics_textfile_path=args.metrics_textfile,
+        conditional_requests=args.conditional,
+    )
+    scheduler = RevisitScheduler(history_path=args.revisit_history) if args.due_first else None
+    start_time = time.perf_counter()
+
+    if args.shards > 1:
+        leaser = ShardLeaser(SupabaseLeaseStore(get_supabase_client()),
+                             run_id=args.run_id or datetime.now(timezone.utc).strftime('%Y-%m-%d'),
+                             shard_count=args.shards,
+                             lease_seconds=args.lease_seconds)
+
+        while (shard := leaser.claim_shard()) is not None:
+            print(f"Claimed shard {shard} of {args.shards} in run {leaser.run_id}")
+            try:
+                enrich_and_upsert(args, url_data_enricher, scheduler, leaser, shard)
+            except BaseException:
+                leaser.release(shard)
+                raise
+            leaser.complete(shard)
+
+        print(f"No shards left to claim in run {leaser.run_id}")
+    else:
+        enrich_and_upsert(args, url_data_enricher, scheduler)
+
     end_time = time.perf_counter()
 
     print(f"Completed everything in: {end_time - start_time} seconds")
\ No newline at end of file
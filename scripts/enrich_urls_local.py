@@ -17,16 +17,43 @@ if __name__ == "__main__":
         description='Enrich a set of URLs from an input CSV file with HTTP status code and OpenGraph info available at the URL.'
     )
 
-    parser.add_argument('input_csv_path', help='Path to input CSV.')
-    parser.add_argument('output_csv_path', help='Path to output CSV.')
+    parser.add_argument('input_csv_path', help='Path to input CSV, Parquet or Arrow file.')
+    parser.add_argument('output_csv_path', help='Path to output CSV, or a .parquet or .arrow file to write typed columns.')
     parser.add_argument('-a', '--asynchronous', action='store_true', help='Run in asynchronous mode. Default False.')
+    parser.add_argument('--max-concurrency', type=int, default=50, help='Most requests in flight at once in asynchronous mode. Concurrency adapts up to this. Default 50.')
+    parser.add_argument('--dns-cache', default=None, help='JSON file to remember domains that don\'t resolve in between runs. Default None.')
+    parser.add_argument('--no-pre-resolve', action='store_true', help='Skip resolving all domains before fetching them. Default False.')
+    parser.add_argument('--parse-cache', default=None, help='JSON file to keep parsed pages in between runs, keyed by content hash. Default None (in memory only).')
+    parser.add_argument('--scheme-cache', default=None, help='JSON file to remember whether each domain responded on HTTPS or HTTP in between runs. Default None (in memory only).')
+    parser.add_argument('--probe-delay', type=float, default=1.0, help='Seconds to wait on the preferred scheme before also trying the other in asynchronous mode. Default 1.0.')
+    parser.add_argument('--no-share-redirects', action='store_true', help='Fetch the page each domain redirects to for every domain, instead of once per run for all the domains redirecting to it. Default False.')
+    parser.add_argument('--check-images', action='store_true', help='Check each og:image loads with a HEAD or ranged GET request, and record whether it does in is_og_image_reachable. Default False.')
+    parser.add_argument('--image-cache', default=None, help='JSON file to remember which images load in between runs, with --check-images. Default None (in memory only).')
+    parser.add_argument('--head-only', action='store_true', help='Stop reading each page once its <head> has been parsed. Default False.')
+    parser.add_argument('--max-head-bytes', type=int, default=512 * 1024, help='Most bytes of each page to read in head-only mode. Default 524288.')
+    parser.add_argument('--parse-workers', type=int, default=0, help='Number of processes to parse pages in, in asynchronous mode. Default 0 (parse on the event loop).')
+    parser.add_argument('--metrics-json', default=None, help='JSON file to write per-stage timing histograms, status code counts and error counts to at the end of each run. Default None.')
+    parser.add_argument('--metrics-textfile', default=None, help='File to write the same metrics to in the Prometheus text format, for node_exporter\'s textfile collector. Default None.')
 
     args = parser.parse_args()
-    url_data_enricher = UrlDataEnricher()
+    url_data_enricher = UrlDataEnricher(
+        head_only=args.head_only,
+        max_head_bytes=args.max_head_bytes,
+        pre_resolve_dns=not args.no_pre_resolve,
+        dns_cache_path=args.dns_cache,
+        parse_cache_path=args.parse_cache,
+        probe_delay=args.probe_delay,
+        scheme_cache_path=args.scheme_cache,
+        share_redirect_targets=not args.no_share_redirects,
+        check_images=args.check_images,
+        image_cache_path=args.image_cache,
+        metrics_json_path=args.metrics_json,
+        metrics_textfile_path=args.metrics_textfile,
+    )
     start_time = time.perf_counter()
 
     if args.asynchronous:
-        asyncio.run(url_data_enricher.enrich_urls_async(args.input_csv_path, args.output_csv_path))
+        asyncio.run(url_data_enricher.enrich_urls_async(args.input_csv_path, args.output_csv_path, max_concurrency=args.max_concurrency, parse_workers=args.parse_workers))
     else:
         url_data_enricher.enrich_urls(args.input_csv_path, args.output_csv_path)
         # url_data_enricher.enrich_urls(test_csv, args.output_csv_path)
@@ -6,11 +6,12 @@ def main():
         description='Test metadata scraping for a single .nyc domain'
     )
     parser.add_argument('url', help='The .nyc domain to test (e.g., example.nyc)')
+    parser.add_argument('--head-only', action='store_true', help='Stop reading the page once its <head> has been parsed')
 
     args = parser.parse_args()
     
     # Initialize the URL data enricher
-    enricher = UrlDataEnricher()
+    enricher = UrlDataEnricher(head_only=args.head_only)
     
     # Enrich the URL
     result = enricher.enrich_url(args.url, "2025-05-19T00:00:00", "INDIV")
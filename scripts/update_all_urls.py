@@ -1,8 +1,44 @@
 import os
+import json
+import argparse
+from datetime import datetime
 from dotenv import load_dotenv
 from utils.supabase_data_processor import SupabaseDataProcessor
 
+"""
+Run this file to recompute the derived fields (is_url_found, is_og_title_found, is_og_image_found, website_status)
+of rows in Supabase from their final_url, title and image.
+
+By default only rows updated since the last recompute are read (tracked in a watermark file),
+and only rows whose derived fields are out of date are rewritten. Use --full to rewrite every row.
+"""
+
+def read_watermark(watermark_path):
+    """Get the time the last incremental recompute started, or None if there's no watermark yet."""
+    try:
+        with open(watermark_path) as f:
+            return json.load(f)['last_recomputed_at']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_watermark(watermark_path, recomputed_at):
+    """Record the time a recompute started, so the next one can start from there."""
+    directory = os.path.dirname(watermark_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(watermark_path, 'w') as f:
+        json.dump({'last_recomputed_at': recomputed_at}, f)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='UpdateAllUrls',
+        description='Recompute the derived fields of rows in Supabase.'
+    )
+    parser.add_argument('--full', action='store_true', help='Read and rewrite every row, instead of only out of date rows changed since the last recompute. Default False.')
+    parser.add_argument('--watermark', default='files/recompute_watermark.json', help='JSON file to keep the time of the last incremental recompute in. Default files/recompute_watermark.json.')
+
+    args = parser.parse_args()
+
     load_dotenv('.env.local')
 
     url = os.getenv('SUPABASE_URL')
@@ -14,4 +50,14 @@ if __name__ == "__main__":
         key,
     )
 
-    processor.process_all_records()
\ No newline at end of file
+    if args.full:
+        processor.process_all_records()
+    else:
+        started_at = datetime.utcnow()
+
+        changed_since = read_watermark(args.watermark)
+        if changed_since is not None:
+            print(f"Recomputing rows changed since {changed_since}")
+
+        processor.process_all_records(incremental=True, changed_since=changed_since)
+        write_watermark(args.watermark, started_at.isoformat())
@@ -0,0 +1,223 @@
+import datetime
+import functools
+import os
+
+"""
+Reading and writing enrichment data as Parquet, or Arrow IPC (.arrow/.feather), as well as CSV.
+
+Parquet files are written with the typed columns of get_enriched_schema(), one row group at a time, so large runs never hold
+the whole table in memory. Parquet and Arrow files are memory-mapped when read, and only the columns asked for
+are read, so reloading the enriched data for analysis doesn't parse the whole file like a CSV does.
+
+pyarrow is imported on first use, so runs that only read and write CSV don't need it installed.
+"""
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+@functools.cache
+def get_enriched_schema():
+    """Get the typed columns of enriched rows, as a pyarrow.Schema."""
+    import pyarrow as pa
+
+    # Low-cardinality columns are dictionary encoded, so each distinct value is stored once.
+    # status_code is a string since failed fetches record "Error" instead of a code
+    return pa.schema([
+        ('domain_name', pa.string()),
+        ('domain_registration_date', pa.string()),
+        ('nexus_category', pa.dictionary(pa.int8(), pa.string())),
+        ('status_code', pa.dictionary(pa.int16(), pa.string())),
+        ('final_url', pa.string()),
+        ('title', pa.string()),
+        ('description', pa.string()),
+        ('image', pa.string()),
+        ('is_url_found', pa.bool_()),
+        ('is_og_title_found', pa.bool_()),
+        ('is_og_image_found', pa.bool_()),
+        ('last_updated_at', pa.timestamp('us')),
+        ('website_status', pa.dictionary(pa.int8(), pa.string())),
+        ('etag', pa.string()),
+        ('last_modified', pa.string()),
+        ('is_og_image_reachable', pa.bool_()),
+    ])
+
+def is_parquet_path(path) -> bool:
+    """True if path is a Parquet file, by its extension."""
+    return isinstance(path, str) and path.lower().endswith(PARQUET_EXTENSIONS)
+
+def is_arrow_path(path) -> bool:
+    """True if path is an Arrow IPC file, by its extension."""
+    return isinstance(path, str) and path.lower().endswith(ARROW_EXTENSIONS)
+
+def is_columnar_path(path) -> bool:
+    """True if path is a Parquet or Arrow IPC file, by its extension."""
+    return is_parquet_path(path) or is_arrow_path(path)
+
+def to_arrow_value(value, arrow_type):
+    """Convert a value from an enriched row, a checkpoint, or a CSV cell, to the Python type arrow_type holds.
+    Missing values (None, NaN, and empty cells in non-string columns) become None."""
+    import pyarrow as pa
+
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+
+    if pa.types.is_string(arrow_type):
+        return value if isinstance(value, str) else str(value)
+    if value == '':
+        return None
+    if pa.types.is_boolean(arrow_type):
+        return value if isinstance(value, bool) else str(value).lower() == 'true'
+    if pa.types.is_timestamp(arrow_type):
+        # Checkpoints and CSVs hold datetimes the way str() writes them
+        return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(str(value))
+    return value
+
+def rows_to_table(rows, schema=None):
+    """Build a pyarrow.Table with schema's typed columns (by default the enriched schema) from a list of row dicts.
+    Columns rows don't have are null."""
+    import pyarrow as pa
+
+    schema = schema or get_enriched_schema()
+    return pa.Table.from_pydict({
+        field.name: [to_arrow_value(row.get(field.name), field.type) for row in rows]
+        for field in schema
+    }, schema=schema)
+
+class BufferedParquetWriter:
+    def __init__(self, file_path: str, schema=None, row_group_rows: int = 10000, compression: str = 'zstd'):
+        """
+        Write rows to a Parquet file one row group at a time, the Parquet counterpart of BufferedCsvWriter.
+        Only one row group's rows are held in memory. The file is only valid once close()d.
+
+        Args:
+            file_path:      The Parquet file to write. Replaced if it exists
+            schema:         The typed columns to write, as a pyarrow.Schema. Defaults to get_enriched_schema()
+            row_group_rows: Write a row group once this many rows are buffered. Defaults to 10000
+            compression:    The compression codec for each column. Defaults to zstd
+        """
+        self.file_path = file_path
+        self.schema = schema or get_enriched_schema()
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+
+        self.buffer = []
+        self.writer = None
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_row(self, row: dict):
+        """Buffer a row, writing a row group once the buffer is full."""
+        self.buffer.append(row)
+        if len(self.buffer) >= self.row_group_rows:
+            self.flush()
+
+    def write_rows(self, rows):
+        """Buffer each of the rows."""
+        for row in rows:
+            self.write_row(row)
+
+    def open_writer(self):
+        """Open the file for writing, on the first flush."""
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.file_path, self.schema, compression=self.compression)
+
+    def flush(self):
+        """Write all buffered rows as a row group."""
+        if not self.buffer:
+            return
+        if self.writer is None:
+            self.writer = self.open_writer()
+
+        rows, self.buffer = self.buffer, []
+        self.writer.write_table(rows_to_table(rows, self.schema))
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Write any buffered rows, and the file footer."""
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class BufferedArrowWriter(BufferedParquetWriter):
+    """
+    Write rows to an Arrow IPC file one record batch at a time, like BufferedParquetWriter does row groups.
+    The columns are written uncompressed, so the file can be memory-mapped and read without copying.
+    """
+
+    def open_writer(self):
+        """Open the file for writing, on the first flush."""
+        import pyarrow as pa
+        return pa.ipc.new_file(self.file_path, self.schema)
+
+def read_table(path: str, columns: list = None):
+    """
+    Read a Parquet, Arrow IPC or CSV file into a pyarrow.Table.
+    Parquet and Arrow files are memory-mapped, and Arrow files are read without copying.
+
+    Args:
+        path:       The file to read
+        columns:    The columns to read. Defaults to None (all of them)
+    """
+    import pyarrow as pa
+
+    if is_parquet_path(path):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns, memory_map=True)
+
+    if is_arrow_path(path):
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        return table.select(columns) if columns else table
+
+    import pyarrow.csv
+    # Empty cells stay empty strings, like csv.DictReader, and status_code and dates stay as written
+    convert_options = pyarrow.csv.ConvertOptions(include_columns=columns, strings_can_be_null=False,
+                                                 column_types={'status_code': pa.string(), 'domain_registration_date': pa.string()})
+    return pyarrow.csv.read_csv(path, convert_options=convert_options)
+
+def read_enriched_data(path: str, columns: list = None):
+    """Read enrichment data from a Parquet, Arrow IPC or CSV file into a pandas.DataFrame.
+    Dictionary-encoded columns become categoricals."""
+    if not is_columnar_path(path):
+        import pandas as pd
+        return pd.read_csv(path, usecols=columns)
+    return read_table(path, columns).to_pandas()
+
+def read_rows(path: str) -> list:
+    """Read every row of a Parquet, Arrow IPC or CSV file as a list of dicts."""
+    return read_table(path).to_pylist()
+
+def iter_row_batches(path: str, batch_rows: int = 1000):
+    """Read a Parquet or Arrow IPC file batch_rows at a time, yielding each batch as a list of dicts.
+    Parquet files are decoded a batch at a time, so only one is ever in memory."""
+    import pyarrow as pa
+
+    if is_parquet_path(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_rows):
+            yield batch.to_pylist()
+        return
+
+    # Arrow files are memory-mapped, so reading them whole doesn't copy anything until a batch is converted
+    for batch in pa.ipc.open_file(pa.memory_map(path, 'r')).read_all().to_batches(max_chunksize=batch_rows):
+        yield batch.to_pylist()
+
+def write_table(table, path: str, row_group_rows: int = 10000):
+    """Write a pyarrow.Table to a Parquet or Arrow IPC file, by path's extension, through a temporary file."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    temp_path = path + '.tmp'
+    if is_arrow_path(path):
+        with pa.ipc.new_file(temp_path, table.schema) as writer:
+            writer.write_table(table, max_chunksize=row_group_rows)
+    else:
+        pq.write_table(table, temp_path, row_group_size=row_group_rows, compression='zstd')
+    os.replace(temp_path, path)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+
+class BatchingSink:
+    def __init__(self, write_batch, batch_size: int = 500, max_queued_rows: int = 2000, flush_interval: float = 5.0):
+        """
+        Stream rows from async producers into a blocking batch writer, e.g. an upsert to Supabase.
+
+        Use it as an async context manager inside the event loop, and put() each row as it's produced.
+        Batches are written on a worker thread while producers keep running. If writes fall behind,
+        put() waits once max_queued_rows are queued, so memory stays bounded.
+        Leaving the context writes everything still queued.
+
+        Args:
+            write_batch:        Called with each list of rows to write. Runs on a worker thread, and returns the rows
+                                it wrote, or None if it wrote them all
+            batch_size:         The most rows to pass to write_batch at once. Defaults to 500
+            max_queued_rows:    The most rows waiting to be written before put() waits. Defaults to 2000
+            flush_interval:     Seconds after the first row of a batch arrives to write the batch, even if it isn't full.
+                                Defaults to 5 seconds
+        """
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.max_queued_rows = max_queued_rows
+        self.flush_interval = flush_interval
+
+        # Called on the event loop with the rows of each batch that were written, e.g. to record them in a checkpoint store
+        self.on_written = None
+
+        # Created on entering, inside the event loop
+        self.queue = None
+        self.worker = None
+
+        self.rows_sent = 0
+        self.batches_written = 0
+        self.failed_rows = []
+
+    async def __aenter__(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queued_rows)
+        self.worker = asyncio.create_task(self.run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # None marks the end of the stream
+        await self.queue.put(None)
+        await self.worker
+
+    async def put(self, row: dict):
+        """Queue row to be written, waiting if the queue is full."""
+        await self.queue.put(row)
+
+    async def run(self):
+        """Collect queued rows into batches and write them, until the end of the stream."""
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = None
+        while True:
+            try:
+                timeout = max(0, deadline - loop.time()) if batch else None
+                row = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self.write(batch)
+                batch = []
+                continue
+
+            if row is None:
+                break
+
+            if not batch:
+                # A steady trickle of rows doesn't hold a batch back past its deadline
+                deadline = loop.time() + self.flush_interval
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                await self.write(batch)
+                batch = []
+
+        if batch:
+            await self.write(batch)
+
+    async def write(self, batch: list):
+        """Write batch on a worker thread, keeping the event loop free."""
+        try:
+            written_rows = await asyncio.to_thread(self.write_batch, batch)
+            self.rows_sent += len(batch)
+            self.batches_written += 1
+        except Exception as e:
+            # Keep streaming, and leave it to the caller to decide what to do with the failed rows
+            self.logger.exception(f"Error writing batch of {len(batch)} rows: {e}")
+            self.failed_rows.extend(batch)
+            return
+
+        if self.on_written is not None:
+            self.on_written(batch if written_rows is None else written_rows)
+
+    def summary(self) -> dict:
+        """Summarize what was passed to write_batch."""
+        return {
+            'sink_rows_sent': self.rows_sent,
+            'sink_batches_written': self.batches_written,
+            'sink_rows_failed': len(self.failed_rows),
+        }
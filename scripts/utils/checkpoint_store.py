@@ -0,0 +1,133 @@
+from utils.csv_processing import BufferedCsvWriter, get_fieldnames
+import csv
+import json
+import os
+import sqlite3
+
+def default_checkpoint_path(output_csv_path: str) -> str:
+    """Get the checkpoint store path used for an output CSV (or Parquet or Arrow file), e.g. 'files/temp.checkpoint.db' for 'files/temp.csv'."""
+    return os.path.splitext(output_csv_path)[0] + '.checkpoint.db'
+
+class CheckpointStore:
+    def __init__(self, path: str):
+        """
+        Record enriched rows in a SQLite database as they complete, keyed by domain_name.
+
+        The store is the source of truth for a run: resuming only needs an indexed lookup per domain,
+        a crash loses at most the rows that were still in flight, and the output CSV is exported from it.
+
+        Args:
+            path: The SQLite database file. Created if it doesn't exist yet
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+        # WAL with synchronous=NORMAL keeps commits cheap while still surviving a process crash
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS enriched_rows (
+                domain_name TEXT PRIMARY KEY,
+                row TEXT NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM enriched_rows").fetchone()[0]
+
+    def is_processed(self, domain_name: str) -> bool:
+        """True if a row for domain_name has been recorded."""
+        cursor = self.connection.execute("SELECT 1 FROM enriched_rows WHERE domain_name = ?", (domain_name,))
+        return cursor.fetchone() is not None
+
+    def record(self, row: dict):
+        """Record a completed row, replacing any earlier row for the same domain_name."""
+        self.record_rows([row])
+
+    def record_rows(self, rows):
+        """Record completed rows in a single transaction."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO enriched_rows (domain_name, row) VALUES (?, ?)",
+            # Values like datetimes are stored the way they'd be written to CSV
+            ((row['domain_name'], json.dumps(row, default=str)) for row in rows)
+        )
+        self.connection.commit()
+
+    def rows(self):
+        """Yield every recorded row, in the order they were recorded."""
+        for (row,) in self.connection.execute("SELECT row FROM enriched_rows ORDER BY rowid"):
+            yield json.loads(row)
+
+    def import_csv(self, csv_path: str) -> int:
+        """Record every row of an existing output CSV, e.g. one written before checkpoints existed.
+        Returns the number of rows imported."""
+        with open(csv_path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+        self.record_rows(rows)
+        return len(rows)
+
+    def import_columnar(self, path: str) -> int:
+        """Record every row of an existing output Parquet or Arrow IPC file. Returns the number of rows imported."""
+        from utils.arrow_io import read_rows
+        rows = read_rows(path)
+
+        self.record_rows(rows)
+        return len(rows)
+
+    def export_csv(self, csv_path: str) -> int:
+        """Write every recorded row to a new CSV at csv_path, replacing any existing file.
+        Returns the number of rows exported."""
+        # Write to a temporary file first, so the old export stays intact until the new one is complete
+        temp_path = csv_path + '.tmp'
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+        # Rows can gain columns part way through a run, e.g. etag and last_modified, so the header has every column
+        with BufferedCsvWriter(temp_path, fieldnames=get_fieldnames(self.rows())) as writer:
+            writer.write_rows(self.rows())
+        rows_exported = writer.rows_written
+
+        if rows_exported:
+            os.replace(temp_path, csv_path)
+        elif os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+        return rows_exported
+
+    def export_columnar(self, path: str, row_group_rows: int = 10000) -> int:
+        """Write every recorded row to a new Parquet or Arrow IPC file at path, by its extension, one row group
+        (or record batch) at a time, replacing any existing file. Returns the number of rows exported."""
+        from utils.arrow_io import BufferedParquetWriter, BufferedArrowWriter, is_arrow_path
+        writer_class = BufferedArrowWriter if is_arrow_path(path) else BufferedParquetWriter
+
+        # Write to a temporary file first, so the old export stays intact until the new one is complete
+        temp_path = path + '.tmp'
+        with writer_class(temp_path, row_group_rows=row_group_rows) as writer:
+            writer.write_rows(self.rows())
+        rows_exported = writer.rows_written
+
+        if rows_exported:
+            os.replace(temp_path, path)
+        elif os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+        return rows_exported
+
+    def export(self, output_path: str) -> int:
+        """Export every recorded row to output_path, as Parquet or Arrow IPC by its extension, and CSV otherwise.
+        Returns the number of rows exported."""
+        from utils.arrow_io import is_columnar_path
+        if is_columnar_path(output_path):
+            return self.export_columnar(output_path)
+        return self.export_csv(output_path)
+
+    def close(self):
+        self.connection.close()
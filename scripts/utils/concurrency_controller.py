@@ -0,0 +1,114 @@
+import asyncio
+import statistics
+
+class AdaptiveConcurrencyController:
+    def __init__(self,
+                 initial_concurrency: int = 5,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 50,
+                 error_threshold: float = 0.25,
+                 latency_tolerance: float = 2.0,
+                 backoff_factor: float = 0.5):
+        """
+        Limit the number of concurrent requests, adjusting the limit with AIMD (additive increase, multiplicative decrease).
+
+        Use it like an asyncio.Semaphore, and record() the outcome of every request made while holding a slot.
+        After each window of requests (as many as the current limit), the limit is:
+        - Increased by 1 if the error rate and latency are healthy
+        - Held if latency has grown past latency_tolerance times the best window seen so far
+        - Multiplied by backoff_factor if the rate of timeouts and connection errors is above error_threshold
+
+        Args:
+            initial_concurrency:    The limit to start at. Defaults to 5
+            min_concurrency:        The lowest the limit can go. Defaults to 1
+            max_concurrency:        The highest the limit can go. Defaults to 50
+            error_threshold:        The share of a window's requests that can time out or fail to connect
+                                    before backing off. Defaults to 0.25
+            latency_tolerance:      How many times the baseline median latency a window can take
+                                    before the limit stops increasing. Defaults to 2.0
+            backoff_factor:         What to multiply the limit by when backing off. Defaults to 0.5
+        """
+        self.limit = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.error_threshold = error_threshold
+        self.latency_tolerance = latency_tolerance
+        self.backoff_factor = backoff_factor
+
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+        # Outcomes of the requests in the current window
+        self.latencies = []
+        self.window_size = 0
+        self.window_errors = 0
+
+        # Lowest window median latency seen, allowed to drift up slowly as conditions change
+        self.baseline_latency = None
+
+        self.peak_limit = initial_concurrency
+        self.increases = 0
+        self.backoffs = 0
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.in_flight -= 1
+            # The limit may have changed, so wake every waiter to re-check it
+            self.condition.notify_all()
+
+    def record(self, latency: float = None, congested: bool = False):
+        """
+        Record the outcome of one request.
+
+        Args:
+            latency:    Seconds the request took, if it completed
+            congested:  True if the request timed out or the connection failed in a way that suggests overload
+        """
+        self.window_size += 1
+        if latency is not None:
+            self.latencies.append(latency)
+        if congested:
+            self.window_errors += 1
+
+        if self.window_size >= self.limit:
+            self.adjust()
+
+    def adjust(self):
+        """Adjust the limit based on the window just completed, and start a new window."""
+        error_rate = self.window_errors / self.window_size
+        median_latency = statistics.median(self.latencies) if self.latencies else None
+
+        if median_latency is not None:
+            if self.baseline_latency is None:
+                self.baseline_latency = median_latency
+            else:
+                self.baseline_latency = min(median_latency, self.baseline_latency * 1.1)
+
+        if error_rate > self.error_threshold:
+            self.limit = max(self.min_concurrency, int(self.limit * self.backoff_factor))
+            self.backoffs += 1
+        elif median_latency is None or median_latency > self.baseline_latency * self.latency_tolerance:
+            pass
+        elif self.limit < self.max_concurrency:
+            self.limit += 1
+            self.increases += 1
+            self.peak_limit = max(self.peak_limit, self.limit)
+
+        self.latencies = []
+        self.window_size = 0
+        self.window_errors = 0
+
+    def summary(self) -> dict:
+        """Summarize how the limit moved over the run."""
+        return {
+            'settled_concurrency': self.limit,
+            'peak_concurrency': self.peak_limit,
+            'concurrency_increases': self.increases,
+            'concurrency_backoffs': self.backoffs,
+        }
@@ -1,26 +1,149 @@
 import os
-import pandas as pd
+import csv
 import json
+import atexit
+import signal
+import threading
+import time
+
+class BufferedCsvWriter:
+    def __init__(self, file_path: str, fieldnames: list = None, flush_rows: int = 500, flush_interval: float = 5.0):
+        """
+        Append rows to a CSV file in batches, keeping the file open between flushes.
+        The header is written once, when the file is new or empty.
+        Buffered rows are flushed on close(), at interpreter exit, and on SIGINT/SIGTERM.
+
+        Args:
+            file_path:      The CSV file to append to. Created if it doesn't exist yet
+            fieldnames:     The columns to write. Defaults to the existing file's header, or the keys of the rows in the
+                            first flush. Pass every column if later rows can have columns earlier ones don't
+            flush_rows:     Flush once this many rows are buffered. Defaults to 500
+            flush_interval: Flush when a row is written this many seconds after the last flush. Defaults to 5 seconds
+        """
+        self.file_path = file_path
+        self.fieldnames = fieldnames
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.buffer = []
+        self.file = None
+        self.writer = None
+        self.flushing = False
+        self.last_flush_time = time.monotonic()
+        self.rows_written = 0
+
+        # Flush whatever is buffered if the process is stopped
+        self.previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self.previous_handlers[signum] = signal.signal(signum, self.handle_signal)
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_row(self, row: dict):
+        """Buffer a row, flushing if the buffer is full or the flush interval has passed."""
+        self.buffer.append(row)
+
+        if (len(self.buffer) >= self.flush_rows
+                or time.monotonic() - self.last_flush_time >= self.flush_interval):
+            self.flush()
+
+    def write_rows(self, rows):
+        """Buffer each of the rows."""
+        for row in rows:
+            self.write_row(row)
+
+    def open(self):
+        """Open the file for appending, and write the header if the file is new or empty."""
+        has_header = os.path.isfile(self.file_path) and os.path.getsize(self.file_path) > 0
+
+        if has_header and self.fieldnames is None:
+            with open(self.file_path, newline='') as f:
+                self.fieldnames = next(csv.reader(f))
+        elif self.fieldnames is None:
+            self.fieldnames = get_fieldnames(self.buffer)
+
+        self.file = open(self.file_path, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames, extrasaction='ignore')
+
+        if not has_header:
+            self.writer.writeheader()
+
+    def flush(self):
+        """Write all buffered rows to the file."""
+        # A signal can arrive in the middle of a flush, so don't write the same rows twice
+        if self.flushing or not self.buffer:
+            return
+
+        self.flushing = True
+        try:
+            if self.file is None:
+                self.open()
+
+            rows, self.buffer = self.buffer, []
+            self.writer.writerows({key: format_csv_value(value) for key, value in row.items()} for row in rows)
+            self.file.flush()
+
+            self.rows_written += len(rows)
+            self.last_flush_time = time.monotonic()
+        finally:
+            self.flushing = False
+
+    def close(self):
+        """Flush any buffered rows, close the file, and restore the previous signal handlers."""
+        self.flush()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        for signum, handler in self.previous_handlers.items():
+            signal.signal(signum, handler)
+        self.previous_handlers = {}
+        atexit.unregister(self.close)
+
+    def handle_signal(self, signum, frame):
+        """Flush buffered rows, then let the previous handler deal with the signal."""
+        self.flush()
+
+        previous_handler = self.previous_handlers.get(signum)
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+        elif previous_handler == signal.SIG_DFL:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+def get_fieldnames(rows) -> list:
+    """Get every key of rows, in the order they first appear."""
+    fieldnames = {}
+    for row in rows:
+        fieldnames.update(dict.fromkeys(row))
+    return list(fieldnames)
+
+def format_csv_value(value):
+    """Format a value the way pandas.DataFrame.to_csv would, writing missing values as empty strings."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return value
 
 def append_rows_to_csv(rows, file_path):
     """Append an array of rows to the given file. If the file doesn't exist yet, create it."""
-    for row in rows:
-        append_row_to_csv(row, file_path)
+    with BufferedCsvWriter(file_path) as writer:
+        writer.write_rows(rows)
 
 def append_row_to_csv(row, file_path):
-    """Append a single row to the given file. If the file doesn't exist yet, create it."""
-    file_exists = os.path.isfile(file_path)
-
-    pd.DataFrame([row]).to_csv(
-        file_path,
-        mode='a',
-        sep=",",
-        header=not file_exists, # Write header only if file doesn't exist
-        index=False
-    )
+    """Append a single row to the given file. If the file doesn't exist yet, create it.
+    When appending many rows, use a BufferedCsvWriter instead."""
+    append_rows_to_csv([row], file_path)
 
 def csv_path_to_json(csv_path):
     """Read the CSV at csv_path, and convert it to an array of JSON objects for each row."""
+    import pandas as pd
     csv = pd.DataFrame(pd.read_csv(csv_path))
 
     return csv_to_json(csv)
@@ -0,0 +1,82 @@
+from aiohttp.resolver import ThreadedResolver
+from utils.persistent_cache import PersistentCache
+import asyncio
+import socket
+
+# getaddrinfo errors that mean the domain has no addresses at all (NXDOMAIN or no records),
+# as opposed to temporary failures like EAI_AGAIN that are worth retrying
+UNRESOLVABLE_ERRNOS = {socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)}
+
+class CachingResolver(ThreadedResolver):
+    def __init__(self,
+                 ttl: float = 300,
+                 negative_ttl: float = 7 * 24 * 60 * 60,
+                 negative_cache_path: str = None,
+                 max_concurrent_lookups: int = 64):
+        """
+        An aiohttp resolver that shares a TTL cache of lookups across a whole batch of domains.
+
+        Use pre_resolve() to look up every domain in a batch concurrently before fetching them.
+        Fetches then reuse the cached addresses, and domains that don't exist can skip HTTP entirely.
+        Must be created inside a running event loop.
+
+        Args:
+            ttl:                    Seconds to cache resolved addresses for. Defaults to 5 minutes
+            negative_ttl:           Seconds to remember that a domain doesn't resolve. Defaults to 7 days
+            negative_cache_path:    JSON file to keep unresolvable domains in between runs. Defaults to None (in memory only)
+            max_concurrent_lookups: The most lookups to run at once in pre_resolve(). Defaults to 64
+        """
+        super().__init__()
+        self.cache = PersistentCache(ttl=ttl)
+        self.negative_cache = PersistentCache(ttl=negative_ttl, path=negative_cache_path)
+        self.max_concurrent_lookups = max_concurrent_lookups
+
+    def is_unresolvable(self, host: str) -> bool:
+        """True if host is known not to resolve."""
+        return self.negative_cache.get(host, False)
+
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET) -> list:
+        if self.is_unresolvable(host):
+            raise socket.gaierror(socket.EAI_NONAME, f"{host} is cached as unresolvable")
+
+        # Addresses are cached by host alone, looked up for every family, so a fetch on any port
+        # (HTTPS, or HTTP after it) reuses the lookup pre_resolve() made
+        addresses = self.cache.get(host)
+        if addresses is None:
+            try:
+                addresses = await super().resolve(host, 0, socket.AF_UNSPEC)
+            except socket.gaierror as e:
+                if e.errno in UNRESOLVABLE_ERRNOS:
+                    self.negative_cache.set(host, True)
+                raise
+            self.cache.set(host, addresses)
+
+        hosts = [{**address, 'port': port} for address in addresses if family == socket.AF_UNSPEC or address['family'] == family]
+        if not hosts:
+            # None of the addresses are in family, so let the lookup fail (or succeed) the way it would uncached
+            return await super().resolve(host, port, family)
+
+        return hosts
+
+    async def pre_resolve(self, hosts) -> set:
+        """
+        Resolve all hosts concurrently, filling the cache.
+        Returns the set of hosts that don't resolve.
+        """
+        lookup_slots = asyncio.Semaphore(self.max_concurrent_lookups)
+
+        async def pre_resolve_host(host):
+            async with lookup_slots:
+                try:
+                    await self.resolve(host)
+                except OSError:
+                    # Temporary failures aren't cached, and are retried when the host is fetched
+                    pass
+
+        await asyncio.gather(*(pre_resolve_host(host) for host in set(hosts)))
+
+        return {host for host in set(hosts) if self.is_unresolvable(host)}
+
+    def save(self):
+        """Save the unresolvable domains, if negative_cache_path was provided."""
+        self.negative_cache.save()
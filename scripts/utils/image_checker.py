@@ -0,0 +1,204 @@
+from utils.persistent_cache import PersistentCache
+import asyncio
+
+"""
+Checking that the og:image URLs pages point to actually load, so the site doesn't show broken thumbnails.
+
+Each image is checked with a HEAD request, falling back to a GET for only its first bytes when the server
+rejects HEAD. Results are cached by URL between runs, and concurrent checks of the same URL share one request,
+so shared CDN assets and parking page logos are only checked once.
+
+Only answers are cached. A check that times out or can't connect is inconclusive, since the image's server
+may just be slow or briefly down, so it's retried on the next run rather than remembered as not loading.
+
+UrlDataEnricher keeps the og:image URL either way, and records the result in an is_og_image_reachable column,
+added to the table with:
+
+    ALTER TABLE enriched_url_data ADD COLUMN is_og_image_reachable BOOLEAN;
+
+aiohttp and requests are only imported when checking in their mode.
+"""
+
+# Bytes to ask for when HEAD isn't answered
+RANGE_HEADER = 'bytes=0-1023'
+
+# Content types served for images besides image/*, by CDNs that don't know better
+GENERIC_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream')
+
+def is_image_response(status_code: int, content_type: str | None) -> bool:
+    """True if a response to an image request means the image loads: not an error, and not a page served in its place."""
+    if status_code >= 400:
+        return False
+    if not content_type:
+        return True
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith('image/') or content_type in GENERIC_CONTENT_TYPES
+
+class ImageChecker:
+    def __init__(self,
+                 max_concurrency: int = 10,
+                 timeout: float = 5,
+                 ttl: float = 7 * 24 * 60 * 60,
+                 failure_ttl: float = 24 * 60 * 60,
+                 max_entries: int = 100000,
+                 cache_path: str = None):
+        """
+        Check whether image URLs load, caching the results.
+
+        Use it as an async context manager around check_async() calls, which opens the aiohttp session they share.
+
+        Args:
+            max_concurrency:    The most image requests in flight at once, kept low so checks don't compete with page fetches.
+                                Defaults to 10
+            timeout:            Seconds to wait for each request. Defaults to 5
+            ttl:                Seconds to remember an image loads. Defaults to 7 days
+            failure_ttl:        Seconds to remember an image doesn't load, shorter as it may be a passing outage. Defaults to 1 day
+            max_entries:        The most image URLs to remember, evicting the least recently checked first. Defaults to 100000
+            cache_path:         JSON file to keep results in between runs. Defaults to None (in memory only)
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.cache = PersistentCache(max_entries=max_entries, path=cache_path)
+
+        # Image URL -> the asyncio.Task checking it, while in flight
+        self.in_flight = {}
+
+        # Created by __aenter__ in asynchronous mode, and on the first check() in synchronous mode
+        self.session = None
+        self.slots = None
+        self.requests_session = None
+
+        self.reset_stats()
+
+    async def __aenter__(self):
+        import aiohttp
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.slots = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for task in list(self.in_flight.values()):
+            task.cancel()
+        await self.session.close()
+        self.session = None
+        self.slots = None
+
+    def reset_stats(self):
+        """Reset the counts, e.g. at the start of a run."""
+        self.checks = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.unreachable = 0
+        self.inconclusive = 0
+
+    def get_cached(self, url: str) -> bool | None:
+        """Get whether url loaded when it was last checked, or None if it hasn't been checked recently.
+        Data URIs are always found, and URLs that aren't HTTP never are."""
+        if url.startswith('data:image/'):
+            return True
+        if not url.startswith(('http://', 'https://')):
+            return False
+
+        is_reachable = self.cache.get(url)
+        if is_reachable is not None:
+            self.cache_hits += 1
+        return is_reachable
+
+    def store(self, url: str, is_reachable: bool | None) -> bool | None:
+        """Cache whether url loads, and return it. Inconclusive checks (None) aren't cached."""
+        self.checks += 1
+        if is_reachable is None:
+            self.inconclusive += 1
+            return None
+        if not is_reachable:
+            self.unreachable += 1
+        self.cache.set(url, is_reachable, ttl=self.ttl if is_reachable else self.failure_ttl)
+        return is_reachable
+
+    async def request_async(self, url: str) -> bool | None:
+        """Request url with HEAD, then a ranged GET if that fails, and return whether it's an image that loads,
+        or None if the GET got no response."""
+        import aiohttp
+
+        async with self.slots:
+            try:
+                async with self.session.head(url, allow_redirects=True) as response:
+                    # Only an error is worth retrying. A page served in the image's place is just as wrong with GET
+                    if response.status < 400:
+                        return is_image_response(response.status, response.headers.get('Content-Type'))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+            # Plenty of servers reject HEAD, so ask for just the start of the image instead.
+            # The body is dropped unread when the response closes
+            try:
+                async with self.session.get(url, headers={'Range': RANGE_HEADER}) as response:
+                    return is_image_response(response.status, response.headers.get('Content-Type'))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None
+
+    async def check_async(self, url: str) -> bool | None:
+        """True if the image at url loads, or None if the check was inconclusive.
+        Checks of a URL already being checked wait for that check."""
+        is_reachable = self.get_cached(url)
+        if is_reachable is not None:
+            return is_reachable
+
+        task = self.in_flight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self.request_async(url))
+            self.in_flight[url] = task
+            task.add_done_callback(lambda task: self.finish_check(url, task))
+        else:
+            self.coalesced += 1
+
+        # The shared check carries on if the caller that started it is cancelled
+        return await asyncio.shield(task)
+
+    def finish_check(self, url: str, task: asyncio.Task):
+        """Cache the result of a shared check, unless it was cancelled."""
+        self.in_flight.pop(url, None)
+        if not task.cancelled() and task.exception() is None:
+            self.store(url, task.result())
+
+    def check(self, url: str) -> bool | None:
+        """True if the image at url loads, or None if the check was inconclusive, checked synchronously."""
+        import requests
+
+        is_reachable = self.get_cached(url)
+        if is_reachable is not None:
+            return is_reachable
+
+        # Certificates are verified, unlike page fetches, since a browser won't load an image with a bad one
+        if self.requests_session is None:
+            self.requests_session = requests.Session()
+
+        try:
+            with self.requests_session.head(url, timeout=self.timeout, allow_redirects=True) as response:
+                if response.status_code < 400:
+                    return self.store(url, is_image_response(response.status_code, response.headers.get('Content-Type')))
+        except requests.RequestException:
+            pass
+
+        try:
+            with self.requests_session.get(url, headers={'Range': RANGE_HEADER}, timeout=self.timeout, stream=True) as response:
+                return self.store(url, is_image_response(response.status_code, response.headers.get('Content-Type')))
+        except requests.RequestException:
+            return self.store(url, None)
+
+    def stats(self) -> dict:
+        """Get the counts of images checked, checks saved, images that don't load, and checks that got no answer."""
+        return {
+            'image_checks': self.checks,
+            'image_check_cache_hits': self.cache_hits,
+            'image_checks_coalesced': self.coalesced,
+            'unreachable_images': self.unreachable,
+            'inconclusive_image_checks': self.inconclusive,
+        }
+
+    def save(self):
+        """Save the cache, if cache_path was provided."""
+        self.cache.save()
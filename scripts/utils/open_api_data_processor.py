@@ -1,21 +1,40 @@
-import pandas as pd
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from datetime import datetime
+from typing import TYPE_CHECKING
+import io
 import logging
 
+# Imported where they're first needed, so importing add_new_urls.py doesn't load them
+if TYPE_CHECKING:
+    import pandas as pd
+
 class OpenApiDataProcessor:
-    def __init__(self, open_api_url: str, batch_size: int = 1000):
+    def __init__(self, open_api_url: str, batch_size: int = 1000, prefetch_pages: int = 4, timeout: float = 60):
         """
         Initialize the OpenApiDataPorcessor with NYC Open Data URL and configuration.
         
         Args:
             open_api_url:   The Open API URL from which to retrieve data
-            batch_size:     The number of records to retrieve in each API call. Defaults to 1000
+            batch_size:     The number of records to retrieve in each API call, sent as $limit. Defaults to 1000
+            prefetch_pages: The most API calls to have in flight at once. Defaults to 4
+            timeout:        Seconds to wait for each API call. Defaults to 60
         """
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
         self.open_api_url = open_api_url
         self.batch_size = batch_size
+        self.prefetch_pages = prefetch_pages
+        self.timeout = timeout
+
+        import requests
+
+        # Shared by the prefetching threads, so connections are reused between pages
+        self.session = requests.Session()
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=prefetch_pages))
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=prefetch_pages))
         
         if open_api_url[len(open_api_url)-3:] == 'csv':
             self.mode = 'csv'
@@ -25,66 +44,93 @@ class OpenApiDataProcessor:
             self.logger.error(f"Unrecognized URL format: {open_api_url}. Failed to create OpenApiDataProcessor.")
             return None
 
+    def get_page(self, offset: int, where: str = None) -> pd.DataFrame:
+        """Get the page of up to batch_size rows starting at offset, ordered by row id."""
+        import pandas as pd
+        params = {'$order': ':id', '$limit': self.batch_size, '$offset': offset}
+        if where:
+            params['$where'] = where
+
+        self.logger.debug(f"Retrieving rows {offset} to {offset + self.batch_size} from {self.open_api_url}")
+        response = self.session.get(self.open_api_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+
+        if not response.text.strip():
+            return pd.DataFrame()
+
+        match self.mode:
+            case 'csv':
+                return pd.read_csv(io.StringIO(response.text))
+            case 'json':
+                return pd.read_json(io.StringIO(response.text))
+
+    def iter_pages(self, where: str = None):
+        """
+        Yield each page of data from the provided NYC Open API URL in order, until the data runs out.
+        Up to prefetch_pages requests are kept in flight at once, so the next pages are
+        already downloading while the current one is handled.
+        """
+        with ThreadPoolExecutor(max_workers=self.prefetch_pages) as executor:
+            next_offset = 0
+            in_flight = deque()
+
+            def request_next_page():
+                nonlocal next_offset
+                in_flight.append(executor.submit(self.get_page, next_offset, where))
+                next_offset += self.batch_size
+
+            try:
+                for _ in range(self.prefetch_pages):
+                    request_next_page()
+
+                while in_flight:
+                    page = in_flight.popleft().result()
+                    if page.empty:
+                        break
+
+                    yield page
+
+                    # A short page is the last one
+                    if len(page) < self.batch_size:
+                        break
+                    request_next_page()
+            finally:
+                # Don't wait on pages past the end of the data
+                for future in in_flight:
+                    future.cancel()
+
+    def collect_pages(self, where: str = None) -> pd.DataFrame:
+        """Collect every page into one DataFrame, concatenated once at the end."""
+        import pandas as pd
+        pages = []
+        rows_collected = 0
+        for page in self.iter_pages(where):
+            pages.append(page)
+            rows_collected += len(page)
+            self.logger.debug(f"Collected {rows_collected} rows")
+
+        if not pages:
+            return pd.DataFrame()
+        return pd.concat(pages, ignore_index=True)
+
     def get_data(self) -> pd.DataFrame:
         """Collect all available data from the provided NYC Open API URL.
         Compatible with CSV and JSON endpoints."""
+        self.logger.info(f"Retrieving data from {self.open_api_url}")
+
+        df = self.collect_pages()
 
-        df = pd.DataFrame()
-        offset = 0
-        more_data = True
-
-        while(more_data):
-            url_to_call = self.open_api_url + "?$order=:id&$offset=" + str(offset)
-            url_to_call = url_to_call.replace(" ", "%20")
-            
-            self.logger.info(f"Retrieving data from {url_to_call}")
-
-            match self.mode:
-                case 'csv':
-                    next_data = pd.read_csv(url_to_call)
-                case 'json':
-                    next_data = pd.read_json(url_to_call)
-
-            if not next_data.empty:
-                self.logger.debug(f"Collecting from row {offset}")
-                df = pd.concat([df, next_data])
-                offset += self.batch_size
-                self.logger.debug(f"Collected {self.batch_size} rows.")
-            else:
-                more_data = False
-                self.logger.debug("No more data available.")
-
-        self.logger.info(f"Collected all available data from {self.open_api_url}")
+        self.logger.info(f"Collected all {len(df)} available rows from {self.open_api_url}")
         return df
 
-    def get_data_by_date(self, start_date, end_date = datetime.utcnow().isoformat()) -> pd.DataFrame:
+    def get_data_by_date(self, start_date, end_date = None) -> pd.DataFrame:
         """Collect all available data from the provided NYC Open API URL,
-        since the specified date."""
+        since the specified date. end_date defaults to now."""
+        end_date = end_date or datetime.utcnow().isoformat()
 
-        df = pd.DataFrame()
-        offset = 0
-        more_data = True
-        
         self.logger.info(f"Retrieving data from {self.open_api_url} from {start_date} to {end_date}")
 
-        while(more_data):
-            url_to_call = self.open_api_url + "?$order=:id&$offset=" + str(offset) + "&$where=domain_registration_date BETWEEN '" + str(start_date) + "' AND '" + str(end_date) + "'"
-            url_to_call = url_to_call.replace(" ", "%20")
-
-            match self.mode:
-                case 'csv':
-                    next_data = pd.read_csv(url_to_call)
-                case 'json':
-                    next_data = pd.read_json(url_to_call)
-
-            if not next_data.empty:
-                self.logger.debug(f"Collecting from row {offset}")
-                df = pd.concat([df, next_data])
-                offset += self.batch_size
-                self.logger.debug(f"Collected {self.batch_size} rows.")
-            else:
-                more_data = False
-                self.logger.debug("No more data available.")
-
-        self.logger.info(f"Collected all available data from {self.open_api_url}")
-        return df
\ No newline at end of file
+        df = self.collect_pages(where=f"domain_registration_date BETWEEN '{start_date}' AND '{end_date}'")
+
+        self.logger.info(f"Collected all {len(df)} available rows from {self.open_api_url}")
+        return df
@@ -0,0 +1,86 @@
+from utils.persistent_cache import PersistentCache
+import hashlib
+
+class ParseCacheEntry:
+    def __init__(self, cache, key: str, body: str | bytes, base_url: str, placeholders: dict):
+        """
+        The result of looking up a page in a ParseCache.
+        If metadata is None, parse body against base_url (both host-normalized) and pass the result to store().
+        """
+        self.cache = cache
+        self.key = key
+        self.body = body
+        self.base_url = base_url
+        self.placeholders = placeholders
+        self.metadata = None
+
+    def store(self, metadata: dict) -> dict:
+        """Cache metadata parsed from the normalized body, and return it with the real hosts restored."""
+        self.cache.cache.set(self.key, metadata)
+        self.metadata = metadata
+        return self.result()
+
+    def result(self) -> dict:
+        """The cached metadata with the real hosts restored."""
+        metadata = {}
+        for field, value in self.metadata.items():
+            if isinstance(value, str):
+                for placeholder, host in self.placeholders.items():
+                    value = value.replace(placeholder, host)
+            metadata[field] = value
+        return metadata
+
+class ParseCache:
+    def __init__(self, max_entries: int = 10000, path: str = None):
+        """
+        Memoize parsed Open Graph metadata by a hash of the page body.
+
+        Many domains serve byte-identical parking or placeholder pages that only differ by their own hostname.
+        Hosts are replaced with placeholders before hashing and parsing, and restored in the result,
+        so every copy of a template page shares one cache entry.
+
+        Args:
+            max_entries:    The most pages to keep, evicting the least recently used first. Defaults to 10000
+            path:           JSON file to keep the cache in between runs. Defaults to None (in memory only)
+        """
+        self.cache = PersistentCache(max_entries=max_entries, path=path)
+
+    def lookup(self, body: str | bytes, base_url: str, hosts) -> ParseCacheEntry:
+        """
+        Look up a page, normalizing each of hosts in body and base_url.
+        The returned entry has metadata set on a hit.
+        """
+        hosts = sorted({host for host in hosts if host}, key=len, reverse=True)
+
+        # Replace longer hosts first, so 'www.example.nyc' isn't left as 'www.' + placeholder
+        placeholders = {}
+        for index, host in enumerate(hosts):
+            placeholder = f"__allofnyc_host_{index}__"
+            placeholders[placeholder] = host
+            if isinstance(body, bytes):
+                body = body.replace(host.encode(), placeholder.encode())
+            else:
+                body = body.replace(host, placeholder)
+            base_url = base_url.replace(host, placeholder)
+
+        # Relative image paths resolve against base_url, so it's part of the key too
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(body if isinstance(body, bytes) else body.encode('utf-8', errors='replace'))
+        digest.update(b'\0' + base_url.encode('utf-8', errors='replace'))
+
+        entry = ParseCacheEntry(self, digest.hexdigest(), body, base_url, placeholders)
+        entry.metadata = self.cache.get(entry.key)
+        return entry
+
+    def reset_stats(self):
+        """Reset the hit/miss counts, e.g. at the start of a run."""
+        self.cache.hits = 0
+        self.cache.misses = 0
+
+    def stats(self) -> dict:
+        """Get the hit/miss counts and size of the cache."""
+        return self.cache.stats()
+
+    def save(self):
+        """Save the cache, if path was provided."""
+        self.cache.save()
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import json
+import os
+import time
+
+class PersistentCache:
+    def __init__(self, ttl: float = None, max_entries: int = None, path: str = None):
+        """
+        A key/value cache with optional expiry, size bound, and persistence between runs.
+
+        Args:
+            ttl:            Seconds an entry stays valid. Defaults to None, which never expires entries
+            max_entries:    The most entries to keep, evicting the least recently used first. Defaults to None (unbounded)
+            path:           JSON file to load entries from, and save them to with save(). Keys must be strings
+                            to be persisted. Defaults to None, which keeps the cache in memory only
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+
+        # key -> (expires_at, value), in least to most recently used order
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.isfile(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Get the value for key, or default if it's missing or has expired."""
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.entries[key]
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        """Set the value for key. ttl overrides the cache's ttl for this entry."""
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+
+        if self.max_entries is not None:
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def load(self):
+        """Load unexpired entries from the JSON file at path."""
+        try:
+            with open(self.path) as f:
+                saved_entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Failed to load cache from {self.path}: {e}")
+            return
+
+        now = time.time()
+        for key, expires_at, value in saved_entries:
+            if expires_at is None or expires_at > now:
+                self.entries[key] = (expires_at, value)
+
+        if self.max_entries is not None:
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        """Save unexpired entries to the JSON file at path."""
+        if not self.path:
+            return
+
+        now = time.time()
+        saved_entries = [
+            [key, expires_at, value]
+            for key, (expires_at, value) in self.entries.items()
+            if expires_at is None or expires_at > now
+        ]
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first, so a crash can't leave a half-written cache behind
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(saved_entries, f)
+        os.replace(temp_path, self.path)
+
+    def stats(self) -> dict:
+        """Get the hit/miss counts and size of the cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+        }
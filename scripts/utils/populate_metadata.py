@@ -1,4 +1,8 @@
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+import codecs
+import html
+import re
 
 def ensure_valid_protocol(url: str) -> str:
     """Ensure the URL starts with 'http://' or 'https://'."""
@@ -6,6 +10,10 @@ def ensure_valid_protocol(url: str) -> str:
         return 'https://' + url
     return url
 
+def get_hostname(url: str) -> str | None:
+    """Get the hostname of a URL or bare domain, e.g. 'example.nyc' for 'https://example.nyc/about'."""
+    return urlparse(ensure_valid_protocol(url)).hostname
+
 def ensure_absolute_url(base_url: str, path: str) -> str:
     """Convert a relative path to an absolute URL using the base URL."""
     if not path:
@@ -18,94 +26,167 @@ def ensure_absolute_url(base_url: str, path: str) -> str:
     base_url = base_url.rstrip('/')
     return f"{base_url}/{path}"
 
+def clean_text(text):
+    """Normalize whitespace and decode HTML entities in extracted text."""
+    if not text:
+        return 'Not found'
+    # Remove extra whitespace and normalize spaces
+    text = ' '.join(text.split())
+    # Decode HTML entities
+    return html.unescape(text)
+
+def get_charset(content_type: str) -> str | None:
+    """Get the charset declared in a Content-Type header, if any."""
+    if not content_type:
+        return None
+    match = re.search(r'charset=["\']?([\w.:-]+)', content_type, re.IGNORECASE)
+    return match.group(1) if match else None
+
+def index_meta_tag(attrs: dict, properties: dict, names: dict):
+    """
+    Add a meta tag's content to the property and name indexes.
+    Keys are lowercased so lookups are case-insensitive, and the first tag with content wins.
+
+    Args:
+        attrs:          The attributes of the <meta> tag
+        properties:     Index of <meta property=...> content to add to
+        names:          Index of <meta name=...> content to add to
+    """
+    # Some sites use the value attribute instead of content
+    content = attrs.get('content', attrs.get('value'))
+    if content is None:
+        return
+    if attrs.get('property'):
+        properties.setdefault(attrs['property'].lower(), content)
+    if attrs.get('name'):
+        names.setdefault(attrs['name'].lower(), content)
+
+def build_open_graph_metadata(properties: dict, names: dict, title: str = None, first_image: str = None, base_url: str = None) -> dict:
+    """
+    Pick the title, description, and image from indexed meta tag content.
+
+    Args:
+        properties:     Content of <meta property=...> tags, keyed by lowercased property
+        names:          Content of <meta name=...> tags, keyed by lowercased name
+        title:          Text of the <title> tag, used if no OpenGraph/Twitter title is found
+        first_image:    src of the first <img> tag, used if no OpenGraph/Twitter image is found
+        base_url:       URL used to make a relative image path absolute
+    """
+    title = properties.get('og:title') or names.get('twitter:title') or (title.strip() if title else None)
+    description = properties.get('og:description') or names.get('twitter:description') or names.get('description')
+    image = properties.get('og:image') or names.get('twitter:image') or first_image
+
+    # Ensure image URL is absolute if base_url is provided
+    if base_url and image != 'Not found':
+        image = ensure_absolute_url(base_url, image)
+
+    return {
+        'title': clean_text(title),
+        'description': clean_text(description),
+        'image': image if image else 'Not found'
+    }
+
+class OpenGraphHeadParser(HTMLParser):
+    """
+    Incrementally collect the <title>, <meta> tags and first <img> of a webpage.
+
+    Feed chunks of the document as they arrive with feed_bytes(), and stop reading
+    once is_complete is True. Everything parse_open_graph_metadata needs is usually
+    in the first few KB, so large pages don't have to be downloaded or parsed in full.
+    """
+
+    def __init__(self, encoding: str = None):
+        super().__init__()
+        self.properties = {}
+        self.names = {}
+        self.title = None
+        self.first_image = None
+        self.head_closed = False
+        self.in_title = False
+        self.title_parts = []
+
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    @property
+    def is_complete(self) -> bool:
+        """True once the <head> is closed and an image candidate has been seen.
+        Without an og:image or twitter:image, keep reading until the first <img>."""
+        if not self.head_closed:
+            return False
+        return (self.first_image is not None
+                or 'og:image' in self.properties
+                or 'twitter:image' in self.names)
+
+    def feed_bytes(self, chunk: bytes):
+        """Decode a chunk of the raw response body and feed it to the parser."""
+        self.feed(self.decoder.decode(chunk))
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            index_meta_tag(dict(attrs), self.properties, self.names)
+        elif tag == 'title' and self.title is None:
+            self.in_title = True
+        elif tag == 'img' and self.first_image is None:
+            # Only the first <img> is considered, like soup.find('img')
+            self.first_image = dict(attrs).get('src') or ''
+        elif tag == 'body':
+            self.head_closed = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self.in_title:
+            self.in_title = False
+            self.title = ''.join(self.title_parts)
+        elif tag == 'head':
+            self.head_closed = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title_parts.append(data)
+
+    def get_metadata(self, base_url: str = None) -> dict:
+        """Get the Open Graph metadata collected so far."""
+        try:
+            return build_open_graph_metadata(self.properties, self.names, self.title, self.first_image or None, base_url)
+        except Exception as e:
+            print(f"Error extracting Open Graph data: {e}")
+            return {
+                'title': 'Error',
+                'description': 'Error',
+                'image': 'Error',
+            }
+
 def parse_open_graph_metadata(webpage_content, base_url: str = None):
     """Parse Open Graph metadata from the provided webpage_content."""
+    # Imported here, so head-only parsing (OpenGraphHeadParser) doesn't pay for it
+    from bs4 import BeautifulSoup
+
     try:
         # Use lxml parser for better HTML5 support
         soup = BeautifulSoup(webpage_content, 'lxml')
 
-        # Helper function to safely extract content with multiple possible attribute names
-        def get_meta_content(tag):
-            if not tag:
-                return None
-            # Check for content attribute
-            if tag.has_attr('content'):
-                return tag['content']
-            # Check for value attribute (some sites use this)
-            if tag.has_attr('value'):
-                return tag['value']
-            return None
-
-        # Helper function to find meta tags with multiple possible attribute formats
-        def find_meta_tag(property_name, name_name=None):
-            # Try OpenGraph format
-            tag = soup.find('meta', property=property_name)
-            if tag:
-                return tag
-            # Try name attribute format
-            if name_name:
-                tag = soup.find('meta', attrs={'name': name_name})
-                if tag:
-                    return tag
-            # Try case-insensitive search
-            for tag in soup.find_all('meta'):
-                if tag.has_attr('property') and tag['property'].lower() == property_name.lower():
-                    return tag
-                if name_name and tag.has_attr('name') and tag['name'].lower() == name_name.lower():
-                    return tag
-            return None
-
-        # Get title from various sources
-        og_title = find_meta_tag('og:title', 'twitter:title')
-        title = get_meta_content(og_title)
-        if not title:
-            # Try standard title tag
-            title_tag = soup.find('title')
-            title = title_tag.string if title_tag else None
-            # Clean up title if found
-            if title:
-                title = title.strip()
-
-        # Get description from various sources
-        og_description = find_meta_tag('og:description', 'twitter:description')
-        description = get_meta_content(og_description)
-        if not description:
-            # Try standard meta description
-            meta_description = soup.find('meta', attrs={'name': 'description'})
-            description = get_meta_content(meta_description)
-
-        # Get image from various sources
-        og_image = find_meta_tag('og:image', 'twitter:image')
-        image = get_meta_content(og_image)
-        if not image:
-            # Try to find any image in the page
-            img_tag = soup.find('img')
-            if img_tag and img_tag.has_attr('src'):
-                image = img_tag['src']
-        
-        # Ensure image URL is absolute if base_url is provided
-        if base_url and image != 'Not found':
-            image = ensure_absolute_url(base_url, image)
-
-        # Clean up the data
-        def clean_text(text):
-            if not text:
-                return 'Not found'
-            # Remove extra whitespace and normalize spaces
-            text = ' '.join(text.split())
-            # Decode HTML entities
-            text = BeautifulSoup(text, 'lxml').get_text()
-            return text
+        # Index every meta tag once, so each field is a dict lookup
+        properties = {}
+        names = {}
+        for tag in soup.find_all('meta'):
+            index_meta_tag(tag.attrs, properties, names)
 
-        return {
-            'title': clean_text(title),
-            'description': clean_text(description),
-            'image': image if image else 'Not found'
-        }
+        title_tag = soup.find('title')
+        img_tag = soup.find('img')
+
+        return build_open_graph_metadata(
+            properties,
+            names,
+            title=title_tag.string if title_tag else None,
+            first_image=img_tag.get('src') if img_tag else None,
+            base_url=base_url,
+        )
     except Exception as e:
         print(f"Error extracting Open Graph data: {e}")
         return {
             'title': 'Error',
             'description': 'Error',
             'image': 'Error',
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,46 @@
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Limit how often something happens, e.g. requests to an API, without slowing it down when it's under the limit.
+
+        Tokens refill continuously at rate per second, up to capacity. Each acquire() takes tokens,
+        waiting only if there aren't enough. Safe to share between threads.
+
+        Args:
+            rate:       Tokens added per second. 0 or less disables limiting
+            capacity:   The most tokens that can build up, i.e. the largest burst allowed. Defaults to rate (1 second's worth)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.waited = 0.0
+
+    def acquire(self, tokens: float = 1):
+        """Take tokens, waiting until they're available. Returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        # More than capacity could never be available at once
+        tokens = min(tokens, self.capacity)
+
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    self.waited += waited
+                    return waited
+
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+from urllib.parse import urljoin, urldefrag
+import asyncio
+
+# Statuses that send the client on to the Location header
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+def get_redirect_url(status_code: int, headers, url: str) -> str | None:
+    """Get the URL a response redirects to, resolved against the url it came from, or None if it isn't a redirect."""
+    location = headers.get('Location')
+    if status_code not in REDIRECT_STATUSES or not location:
+        return None
+    return urldefrag(urljoin(str(url), location)).url
+
+class FetchedPage:
+    def __init__(self, status_code: int, final_url: str, validators: dict, open_graph_metadata: dict, redirect_chain: list):
+        """
+        The parsed page at the end of a redirect target's chain, shared by every domain that redirects to it.
+
+        Args:
+            status_code:            The status code of the final response
+            final_url:              The URL of the final response
+            validators:             The etag and last_modified of the final response
+            open_graph_metadata:    The Open Graph metadata parsed from the final response's body
+            redirect_chain:         Every URL fetched, from the redirect target to final_url
+        """
+        self.status_code = status_code
+        self.final_url = final_url
+        self.validators = validators
+        self.open_graph_metadata = open_graph_metadata
+        self.redirect_chain = redirect_chain
+
+    @property
+    def ok(self) -> bool:
+        """True if the final response wasn't an error, like requests.Response.ok."""
+        return self.status_code < 400
+
+class RedirectTargets:
+    def __init__(self, max_pages: int = 10000, max_counted_targets: int = 10000, top_targets: int = 10):
+        """
+        Share fetching the URLs domains redirect to over a run.
+
+        Many domains redirect to the same site: a brand's main website, a registrar's landing page, a hosting splash page.
+        The first domain to redirect to a URL fetches and parses it. Domains redirecting there while that fetch is
+        in flight wait for it instead of fetching it again, and later ones reuse its page.
+        Every URL in the page's redirect chain is cached, so domains redirecting part way along it reuse it too.
+        Failed fetches aren't cached, so later domains try again.
+
+        Pages and per-target counts are kept for the most recently used URLs only, so memory stays bounded
+        however many domains a run enriches. Targets shared by many domains stay in use, so they're kept.
+
+        Args:
+            max_pages:              The most URLs to keep pages for, evicting the least recently used first. Defaults to 10000
+            max_counted_targets:    The most redirect targets to count domains for, evicting the least recently
+                                    redirected to first. Defaults to 10000
+            top_targets:            Number of the most shared redirect targets to list in stats(). Defaults to 10
+        """
+        self.max_pages = max_pages
+        self.max_counted_targets = max_counted_targets
+        self.top_targets = top_targets
+        self.reset()
+
+    def reset(self):
+        """Forget every page and count, at the start of a run."""
+        # URL -> FetchedPage, or the asyncio.Task fetching it while in flight, least recently used first
+        self.pages = OrderedDict()
+        # Redirect target -> number of domains that redirected to it, least recently redirected to first
+        self.domain_counts = OrderedDict()
+        self.redirected_domains = 0
+        self.fetches = 0
+        self.hits = 0
+        self.coalesced = 0
+
+    def count_domain(self, url: str):
+        """Count a domain redirecting to url."""
+        self.redirected_domains += 1
+        self.domain_counts[url] = self.domain_counts.get(url, 0) + 1
+        self.domain_counts.move_to_end(url)
+        if len(self.domain_counts) > self.max_counted_targets:
+            self.domain_counts.popitem(last=False)
+
+    def set_page(self, url: str, page):
+        """Keep page (or the task fetching it) for url, evicting the least recently used URL if there are too many."""
+        self.pages[url] = page
+        self.pages.move_to_end(url)
+        if len(self.pages) > self.max_pages:
+            oldest_url, oldest = self.pages.popitem(last=False)
+            if isinstance(oldest, asyncio.Task):
+                # Fetches in flight are kept, so they can still be shared and cancelled, and are few
+                self.pages[oldest_url] = oldest
+
+    def get(self, url: str) -> FetchedPage | None:
+        """Get the page fetched from url this run, counting a domain redirecting to it."""
+        self.count_domain(url)
+        page = self.pages.get(url)
+        if isinstance(page, FetchedPage):
+            self.pages.move_to_end(url)
+            self.hits += 1
+            return page
+        return None
+
+    def store(self, url: str, page: FetchedPage):
+        """Cache the page fetched from url, under every URL in its redirect chain that isn't already cached."""
+        self.set_page(url, page)
+        for chain_url in page.redirect_chain:
+            if chain_url not in self.pages:
+                self.set_page(chain_url, page)
+
+    def fetch(self, url: str, fetch_page):
+        """Get the page fetched from url, counting a domain redirecting to it, or fetch it with fetch_page() (synchronously)."""
+        page = self.get(url)
+        if page is None:
+            self.fetches += 1
+            page = fetch_page()
+            self.store(url, page)
+        return page
+
+    async def fetch_async(self, url: str, fetch_page) -> FetchedPage:
+        """
+        Get the page fetched from url, counting a domain redirecting to it.
+        If no domain has redirected to url yet, await fetch_page() for it. If one is already fetching it, wait for that fetch.
+        The shared fetch carries on if the caller that started it is cancelled.
+        """
+        page = self.get(url)
+        if page is not None:
+            return page
+
+        task = self.pages.get(url)
+        if task is None:
+            self.fetches += 1
+            task = asyncio.ensure_future(fetch_page())
+            task.add_done_callback(lambda task: self.finish_fetch(url, task))
+            self.set_page(url, task)
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def finish_fetch(self, url: str, task: asyncio.Task):
+        """Cache the page a shared fetch got, or forget the fetch if it failed."""
+        self.pages.pop(url, None)
+        if not task.cancelled() and task.exception() is None:
+            self.store(url, task.result())
+
+    def cancel(self):
+        """Cancel shared fetches still in flight, which nothing is waiting on once every domain is done."""
+        for page in list(self.pages.values()):
+            if isinstance(page, asyncio.Task):
+                page.cancel()
+
+    def stats(self) -> dict:
+        """Get the counts of redirect targets fetched and fetches saved, and the most shared of the targets still counted."""
+        shared_targets = sorted(((url, count) for url, count in self.domain_counts.items() if count > 1), key=lambda item: -item[1])
+        return {
+            'redirected_domains': self.redirected_domains,
+            'redirect_target_fetches': self.fetches,
+            'redirect_fetches_saved': self.hits + self.coalesced,
+            'redirect_fetches_coalesced': self.coalesced,
+            'top_redirect_targets': dict(shared_targets[:self.top_targets]),
+        }
@@ -0,0 +1,254 @@
+from contextlib import contextmanager
+import bisect
+import json
+import os
+import time
+
+"""
+Per-stage timings of the requests UrlDataEnricher makes, and the responses and errors they end in.
+
+Stages:
+- dns:      Resolving the host. Asynchronous mode only, the synchronous mode counts it in connect
+- connect:  Opening the TCP connection. Includes the TLS handshake in asynchronous mode, where aiohttp doesn't time it apart
+- tls:      The TLS handshake. Synchronous mode only
+- ttfb:     From sending the request to receiving the response headers, per redirect hop
+- download: Reading the response body
+- parse:    Getting the Open Graph metadata from the body
+- image:    Checking the og:image loads, with check_images. Includes checks answered from the cache
+- write:    Recording a row in the checkpoint store
+- export:   Exporting the output CSV
+
+aiohttp and requests are only imported when attaching to them, so either mode only loads its own HTTP client.
+"""
+
+STAGES = ('dns', 'connect', 'tls', 'ttfb', 'download', 'parse', 'image', 'write', 'export')
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRIC_PREFIX = 'url_enricher'
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Count observations into buckets by upper bound, like a Prometheus histogram.
+
+        Args:
+            buckets:    Sorted upper bounds of the buckets. Larger observations go in an extra +Inf bucket.
+                        Defaults to DEFAULT_BUCKETS
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Add one observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate the q quantile by interpolating within its bucket, as Prometheus' histogram_quantile does.
+        Observations in the +Inf bucket are reported as the largest upper bound."""
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def cumulative_counts(self) -> list:
+        """Get (upper bound, observations at or below it) for every bucket, ending with +Inf."""
+        cumulative = []
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            cumulative.append((bound, seen))
+        return cumulative
+
+    def summary(self) -> dict:
+        """Summarize the histogram, with times in milliseconds."""
+        def milliseconds(seconds):
+            return round(seconds * 1000, 3) if seconds is not None else None
+
+        return {
+            'count': self.count,
+            'sum_ms': milliseconds(self.sum),
+            'mean_ms': milliseconds(self.sum / self.count) if self.count else None,
+            'p50_ms': milliseconds(self.quantile(0.5)),
+            'p95_ms': milliseconds(self.quantile(0.95)),
+            'p99_ms': milliseconds(self.quantile(0.99)),
+            'buckets': {
+                ('+Inf' if bound == float('inf') else str(bound)): count
+                for bound, count in self.cumulative_counts()
+            },
+        }
+
+def format_labels(**labels) -> str:
+    """Format Prometheus labels, escaping their values."""
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+def format_bound(bound: float) -> str:
+    """Format a bucket upper bound as Prometheus expects it."""
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+def write_atomically(path: str, text: str):
+    """Write text to path through a temporary file, so readers never see it half written."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+class RequestTracer:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Collect per-stage timing histograms, and counts of response status codes and error classes, over a run.
+
+        Attach it to aiohttp with trace_config(), and to a requests.Session with mount().
+        The stages outside the HTTP client (download, parse, image, write, export) are timed with time().
+
+        Args:
+            buckets:    Upper bounds of the histogram buckets, in seconds. Defaults to DEFAULT_BUCKETS
+        """
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self):
+        """Clear everything collected, at the start of a run."""
+        self.histograms = {stage: Histogram(self.buckets) for stage in STAGES}
+        self.status_codes = {}
+        self.errors = {}
+
+    def observe(self, stage: str, seconds: float):
+        """Record seconds spent in stage."""
+        self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        """Time the block as one observation of stage, whether it raises or not."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def count_status(self, status_code):
+        """Count a response by its status code."""
+        key = str(status_code)
+        self.status_codes[key] = self.status_codes.get(key, 0) + 1
+
+    def count_error(self, error: Exception):
+        """Count a failed request by its exception class."""
+        key = type(error).__name__
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def trace_config(self):
+        """Create an aiohttp TraceConfig recording the dns, connect and ttfb stages of every request."""
+        import aiohttp
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.dns_seconds = 0.0
+            context.headers_sent_at = None
+
+        async def on_dns_resolvehost_start(session, context, params):
+            context.dns_started_at = time.perf_counter()
+
+        async def on_dns_resolvehost_end(session, context, params):
+            context.dns_seconds = time.perf_counter() - context.dns_started_at
+            self.observe('dns', context.dns_seconds)
+
+        async def on_connection_create_start(session, context, params):
+            context.connect_started_at = time.perf_counter()
+
+        async def on_connection_create_end(session, context, params):
+            # Creating the connection resolves the host first, which is timed on its own
+            self.observe('connect', time.perf_counter() - context.connect_started_at - context.dns_seconds)
+
+        async def on_request_headers_sent(session, context, params):
+            context.headers_sent_at = time.perf_counter()
+
+        async def on_response_headers(session, context, params):
+            if context.headers_sent_at is not None:
+                self.observe('ttfb', time.perf_counter() - context.headers_sent_at)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_headers_sent.append(on_request_headers_sent)
+        # Redirect hops end in on_request_redirect instead of on_request_end
+        trace_config.on_request_redirect.append(on_response_headers)
+        trace_config.on_request_end.append(on_response_headers)
+
+        return trace_config
+
+    def mount(self, session):
+        """Mount adapters on a requests.Session that record the connect, tls, ttfb and download stages of every request."""
+        from utils.tracing_adapter import TracingAdapter
+        adapter = TracingAdapter(self)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def to_dict(self, run_report: dict = None) -> dict:
+        """Summarize everything collected, along with the run report if provided."""
+        return {
+            'stages': {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+            'status_codes': dict(sorted(self.status_codes.items())),
+            'errors': dict(sorted(self.errors.items())),
+            'run_report': run_report or {},
+        }
+
+    def to_prometheus(self, run_report: dict = None) -> str:
+        """Format everything collected in the Prometheus text exposition format,
+        with the numeric values of the run report as gauges."""
+        lines = [
+            f'# HELP {METRIC_PREFIX}_stage_seconds Seconds spent in each stage of enriching a URL.',
+            f'# TYPE {METRIC_PREFIX}_stage_seconds histogram',
+        ]
+        for stage, histogram in self.histograms.items():
+            for bound, count in histogram.cumulative_counts():
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{format_labels(stage=stage, le=format_bound(bound))} {count}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{format_labels(stage=stage)} {histogram.sum!r}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{format_labels(stage=stage)} {histogram.count}')
+
+        lines.append(f'# HELP {METRIC_PREFIX}_responses_total Responses received, by status code.')
+        lines.append(f'# TYPE {METRIC_PREFIX}_responses_total counter')
+        for status_code, count in sorted(self.status_codes.items()):
+            lines.append(f'{METRIC_PREFIX}_responses_total{format_labels(status_code=status_code)} {count}')
+
+        lines.append(f'# HELP {METRIC_PREFIX}_errors_total Requests that failed, by exception class.')
+        lines.append(f'# TYPE {METRIC_PREFIX}_errors_total counter')
+        for error, count in sorted(self.errors.items()):
+            lines.append(f'{METRIC_PREFIX}_errors_total{format_labels(error=error)} {count}')
+
+        lines.append(f'# HELP {METRIC_PREFIX}_run_report Stats from the run report.')
+        lines.append(f'# TYPE {METRIC_PREFIX}_run_report gauge')
+        for name, value in (run_report or {}).items():
+            if isinstance(value, (int, float)):
+                lines.append(f'{METRIC_PREFIX}_run_report{format_labels(name=name)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str, run_report: dict = None):
+        """Write to_dict() to a JSON file."""
+        write_atomically(path, json.dumps(self.to_dict(run_report), indent=2, default=str))
+
+    def write_textfile(self, path: str, run_report: dict = None):
+        """Write to_prometheus() to a file for node_exporter's textfile collector."""
+        write_atomically(path, self.to_prometheus(run_report))
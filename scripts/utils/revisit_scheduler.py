@@ -0,0 +1,140 @@
+from utils.persistent_cache import PersistentCache
+from utils.website_status import derive_row_status
+from datetime import datetime, timezone
+import hashlib
+import time
+
+"""
+Scheduling when each domain is next refreshed, from how often past refreshes found it changed.
+
+Each domain's history and the time it's next due are stored with its row in enriched_url_data, so the rows
+due soonest can be selected in Supabase rather than from a fixed window of stale rows. The columns are added with:
+
+    ALTER TABLE enriched_url_data
+        ADD COLUMN next_due_at TIMESTAMPTZ,
+        ADD COLUMN revisit_history JSONB;
+    CREATE INDEX enriched_url_data_next_due_at ON enriched_url_data (next_due_at NULLS FIRST);
+
+Rows without next_due_at haven't been scheduled yet, and are due straight away.
+"""
+
+DAY = 24 * 60 * 60
+
+def get_content_fingerprint(row: dict) -> str:
+    """Hash the fields of an enriched row that count as the site changing."""
+    digest = hashlib.blake2b(digest_size=8)
+    for field in ('title', 'image'):
+        digest.update(str(row.get(field) or '').encode('utf-8', errors='replace') + b'\0')
+    return digest.hexdigest()
+
+class RevisitScheduler:
+    def __init__(self,
+                 history_path: str = None,
+                 base_interval: float = 7 * DAY,
+                 min_interval: float = 1 * DAY,
+                 max_interval: float = 180 * DAY,
+                 max_failure_backoff: int = 5):
+        """
+        Decide which domains are due for a refresh, from the history of what past refreshes found.
+
+        Each domain's revisit interval starts at base_interval and is:
+        - Shortened the more often its title or image changed, and its website_status moved between
+          is_down/is_live/is_complete, per refresh
+        - Doubled for each consecutive refresh it was down, up to max_failure_backoff times
+        Domains without history are due straight away.
+
+        The history stored in the table is authoritative. The JSON file at history_path is only a local copy,
+        used for rows whose revisit_history hasn't been stored in the table yet.
+
+        Args:
+            history_path:           JSON file to keep a local copy of each domain's history in between runs. Defaults to None (in memory only)
+            base_interval:          Seconds between refreshes for a domain changing half as often as it's checked. Defaults to 7 days
+            min_interval:           The shortest interval between refreshes. Defaults to 1 day
+            max_interval:           The longest interval between refreshes. Defaults to 180 days
+            max_failure_backoff:    The most times to double the interval for consecutive failures. Defaults to 5
+        """
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_failure_backoff = max_failure_backoff
+
+        # domain_name -> {checks, content_changes, transitions, consecutive_failures, website_status, fingerprint, last_checked}
+        self.history = PersistentCache(path=history_path)
+
+    def get_interval(self, history: dict) -> float:
+        """Get the seconds to wait between refreshes of a domain with history."""
+        # Status transitions are rarer and more interesting than content edits, so they count double.
+        # Smoothed so a domain checked once isn't judged on that alone: with no changes observed yet the rate starts at 1/2
+        changes = history['content_changes'] + 2 * history['transitions']
+        change_rate = min(1.0, (changes + 1) / (history['checks'] + 2))
+
+        interval = self.base_interval * 0.5 / change_rate
+        interval *= 2 ** min(history['consecutive_failures'], self.max_failure_backoff)
+
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def get_next_due(self, domain_name: str) -> float:
+        """Get the time domain_name is next due for a refresh, or 0 if it has no history."""
+        history = self.history.get(domain_name)
+        if history is None:
+            return 0
+        return history['last_checked'] + self.get_interval(history)
+
+    def load_history(self, rows):
+        """Take the history of each row's domain from its revisit_history column, over the local copy."""
+        for row in rows:
+            history = row.get('revisit_history')
+            if history:
+                self.history.set(row['domain_name'], history)
+
+    def update_history(self, row: dict, now: float = None) -> dict:
+        """Get the history of row's domain updated with the result of refreshing it, without recording it."""
+        now = now or time.time()
+        website_status = derive_row_status(row)['website_status']
+        fingerprint = get_content_fingerprint(row)
+
+        history = self.history.get(row['domain_name'])
+        if history is None:
+            history = {
+                'checks': 0,
+                'content_changes': 0,
+                'transitions': 0,
+                'consecutive_failures': 0,
+                'website_status': website_status,
+                'fingerprint': fingerprint,
+            }
+        else:
+            # Copy, so entries in the cache are only changed through set()
+            history = dict(history)
+            if website_status != history['website_status']:
+                history['transitions'] += 1
+            elif website_status != "is_down" and fingerprint != history['fingerprint']:
+                history['content_changes'] += 1
+
+        history['checks'] += 1
+        history['consecutive_failures'] = history['consecutive_failures'] + 1 if website_status == "is_down" else 0
+        history['website_status'] = website_status
+        history['fingerprint'] = fingerprint
+        history['last_checked'] = now
+
+        return history
+
+    def schedule(self, row: dict, now: float = None) -> dict:
+        """Get a copy of the enriched row with its domain's updated revisit_history and next_due_at columns, to upsert."""
+        history = self.update_history(row, now)
+        next_due = history['last_checked'] + self.get_interval(history)
+        return {**row, 'revisit_history': history, 'next_due_at': datetime.fromtimestamp(next_due, timezone.utc).isoformat()}
+
+    def record(self, row: dict, now: float = None):
+        """Update the local copy of row's domain's history, from its revisit_history column if it was scheduled."""
+        history = row.get('revisit_history') or self.update_history(row, now)
+        self.history.set(row['domain_name'], history)
+
+    def record_rows(self, rows, now: float = None):
+        """Update the local copy of each row's domain's history."""
+        for row in rows:
+            self.record(row, now)
+
+    def save(self):
+        """Save the local copy of the history, if history_path was provided."""
+        self.history.save()
@@ -1,13 +1,35 @@
+import math
 import os
-from supabase import create_client
-from dotenv import load_dotenv
+import random
+import threading
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from .csv_processing import csv_to_json
 
+# Postgres error classes (data exceptions, integrity violations, syntax/access errors) and PostgREST request errors
+# that fail the same way every time they're retried
+NON_RETRYABLE_ERROR_CODE_PREFIXES = ('22', '23', '42', 'PGRST')
+
+# HTTP statuses that mean Supabase couldn't handle the request right now, whatever rows were in it
+UNAVAILABLE_STATUS_CODES = (408, 429)
+
 def connect_to_supabase(url, key):
     """Create and return a client connection to supabase using the provided URL and auth key."""
+    # Imported here, since the client library takes longer to import than most scripts take to start
+    from supabase import create_client
     supabase = create_client(url, key)
     return supabase
 
+@functools.cache
+def get_supabase_client(env_path='.env.local'):
+    """Get a client connected with the SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY in env_path (or the environment).
+    Created on first use, so scripts only connect once they need to, and shared after that."""
+    from dotenv import load_dotenv
+    load_dotenv(env_path)
+
+    return connect_to_supabase(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_SERVICE_ROLE_KEY'))
+
 def insert_to_supabase(table, data, supabase_client):
     """Insert data to table using the given supabase client."""
     try:
@@ -37,12 +59,130 @@ def upsert_to_supabase(table, data, pk, supabase_client):
         print(f"Encountered exception while upserting to {table}: {e}")
         return None
 
-def fetch_from_supabase(table, supabase_client, order_by = "domain_registration_date", order_by_desc=False, limit = 1000, as_csv=False):
+def to_json_row(row: dict) -> dict:
+    """Make row's values serializable in a Supabase request: NaN becomes None, numpy scalars become Python values,
+    and datetimes become ISO strings."""
+    json_row = {}
+    for column, value in row.items():
+        if hasattr(value, 'item'):
+            value = value.item()
+        if isinstance(value, float) and math.isnan(value):
+            value = None
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        json_row[column] = value
+    return json_row
+
+def is_transport_error(e: Exception) -> bool:
+    """True if the request never got a response from Supabase, like a timeout or a dropped connection."""
+    # The Supabase client has imported httpx by the time a request fails
+    import httpx
+    return isinstance(e, httpx.TransportError)
+
+def get_status_code(e: Exception) -> int | None:
+    """Get the HTTP status of a failed request's response, if the error carries one instead of a Postgres error code.
+    postgrest puts the status in code when the response body isn't JSON, like a gateway's 502 page."""
+    code = getattr(e, 'code', None)
+    if isinstance(code, int):
+        return code
+    if isinstance(code, str) and len(code) == 3 and code.isdigit():
+        return int(code)
+    return None
+
+def is_unavailable_error(e: Exception) -> bool:
+    """True if Supabase couldn't be reached or couldn't handle the request (a timeout, rate limit or 5xx),
+    so the request says nothing about its rows."""
+    if is_transport_error(e):
+        return True
+    status_code = get_status_code(e)
+    return status_code is not None and (status_code in UNAVAILABLE_STATUS_CODES or status_code >= 500)
+
+def is_retryable_error(e: Exception) -> bool:
+    """True if the request failed in a way that could succeed on retry,
+    rather than the rows themselves being rejected (or failing to serialize, like NaN values)."""
+    if is_unavailable_error(e):
+        return True
+    code = getattr(e, 'code', None)
+    return isinstance(code, str) and get_status_code(e) is None and not code.startswith(NON_RETRYABLE_ERROR_CODE_PREFIXES)
+
+def bulk_upsert_to_supabase(table, data, pk, supabase_client, chunk_size=500, max_workers=4, max_retries=3, backoff=1.0):
+    """
+    Upsert data to table in chunks, several at a time, so one bad row or timeout doesn't lose the rest.
+
+    Each chunk is retried with exponential backoff if the request fails. A chunk that still fails is split
+    in half, and each half sent again, until the rows the database rejects are isolated.
+    Chunks that can't reach Supabase, or that it's too busy or down to handle (408, 429 or 5xx responses),
+    fail whole once their retries run out, since splitting them won't help.
+    Rows with the same primary key are collapsed to the last one, since Postgres rejects a chunk with duplicates.
+
+    Args:
+        table:              The table to upsert to
+        data:               A list of rows to upsert
+        pk:                 The primary key column
+        supabase_client:    The Supabase client to use
+        chunk_size:         The most rows to send in each request. Defaults to 500
+        max_workers:        The most chunks to send at once. Defaults to 4
+        max_retries:        How many times to retry a failing request before splitting it. Defaults to 3
+        backoff:            Seconds to wait before the first retry, doubling for each after. Defaults to 1.0
+
+    Returns:
+        A report with the number of rows_written, rows_retried, rows_failed and duplicates_dropped,
+        and the failed_rows themselves
+    """
+    rows_by_pk = {row[pk]: row for row in data}
+    rows = list(rows_by_pk.values())
+
+    report = {
+        'rows_written': 0,
+        'rows_retried': 0,
+        'rows_failed': 0,
+        'duplicates_dropped': len(data) - len(rows),
+        'failed_rows': [],
+    }
+    report_lock = threading.Lock()
+
+    def send_chunk(chunk):
+        for attempt in range(max_retries + 1):
+            try:
+                supabase_client.table(table).upsert(chunk, on_conflict=pk).execute()
+                with report_lock:
+                    report['rows_written'] += len(chunk)
+                return
+            except Exception as e:
+                error = e
+                if not is_retryable_error(e) or attempt == max_retries:
+                    break
+                with report_lock:
+                    report['rows_retried'] += len(chunk)
+                # Jitter, so chunks that failed together don't all retry together
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+        if len(chunk) == 1 or is_unavailable_error(error):
+            print(f"Encountered exception while upserting {len(chunk)} rows to {table}: {error}")
+            with report_lock:
+                report['rows_failed'] += len(chunk)
+                report['failed_rows'].extend(chunk)
+            return
+
+        # Bisect, so the rows that can be written still are
+        middle = len(chunk) // 2
+        send_chunk(chunk[:middle])
+        send_chunk(chunk[middle:])
+
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() to surface any exception raised outside of the upsert itself
+        list(executor.map(send_chunk, chunks))
+
+    return report
+
+def fetch_from_supabase(table, supabase_client, order_by = "domain_registration_date", order_by_desc=False, limit = 1000, as_csv=False, columns="domain_name, domain_registration_date, nexus_category"):
+    """Fetch columns of up to limit rows from table, ordered by order_by."""
     try:
         if as_csv:
             response = (
                 supabase_client.table(table)
-                .select("domain_name, domain_registration_date, nexus_category")
+                .select(columns)
                 .order(order_by, desc=order_by_desc)
                 .limit(limit)
                 .csv()
@@ -51,7 +191,7 @@ def fetch_from_supabase(table, supabase_client, order_by = "domain_registration_
         else:
             response = (
                 supabase_client.table(table)
-                .select("domain_name, domain_registration_date, nexus_category")
+                .select(columns)
                 .order(order_by, desc=order_by_desc)
                 .limit(limit)
                 .execute()
@@ -61,6 +201,24 @@ def fetch_from_supabase(table, supabase_client, order_by = "domain_registration_
         print(f"Encountered exception while fetching from {table}: {e}")
         return None
 
+def fetch_due_from_supabase(table, supabase_client, due_at, limit = 1000, columns="domain_name, domain_registration_date, nexus_category"):
+    """Fetch columns of up to limit rows from table that are due by due_at (an ISO timestamp), soonest due first.
+    Rows without a next_due_at haven't been scheduled yet, so they come first, stalest first."""
+    try:
+        response = (
+            supabase_client.table(table)
+            .select(columns)
+            .or_(f"next_due_at.is.null,next_due_at.lte.{due_at}")
+            .order("next_due_at", desc=False, nullsfirst=True)
+            .order("last_updated_at", desc=False)
+            .limit(limit)
+            .execute()
+        )
+        return response
+    except Exception as e:
+        print(f"Encountered exception while fetching from {table}: {e}")
+        return None
+
 def test_writing_list():
     url = os.getenv('SUPABASE_URL')
     # Other keys available for different role types.
@@ -108,6 +266,7 @@ def test_upsert_file():
     print(response)
     
 if __name__ == '__main__':
+    from dotenv import load_dotenv
     load_dotenv('.env.local')
 
     # test_upsert_file()
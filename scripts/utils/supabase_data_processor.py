@@ -1,11 +1,19 @@
 from supabase import create_client
+from utils.rate_limiter import TokenBucket
+from utils.website_status import derive_row_status
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any
 import logging
-import time
+
+# Fields calculated from final_url, title, image and is_og_image_reachable
+DERIVED_COLUMNS = ('is_url_found', 'is_og_title_found', 'is_og_image_found', 'website_status')
+
+# Postgres' error code for a column that doesn't exist
+UNDEFINED_COLUMN_ERROR_CODE = '42703'
 
 class SupabaseDataProcessor:
-    def __init__(self, supabase_url: str, supabase_key: str, batch_size: int = 1000):
+    def __init__(self, supabase_url: str, supabase_key: str, batch_size: int = 1000, requests_per_second: float = 2.0, burst: float = 4):
         """
         Initialize the processor with Supabase credentials and configuration.
         
@@ -13,23 +21,31 @@ class SupabaseDataProcessor:
             supabase_url: Your Supabase project URL
             supabase_key: Your Supabase API key
             batch_size: Number of records to process in each batch
+            requests_per_second: Most requests to make to Supabase per second on average. 0 disables limiting. Defaults to 2.0
+            burst: Most requests to make back to back before the limit applies. Defaults to 4
         """
         self.supabase = create_client(supabase_url, supabase_key)
         self.table_name = "enriched_url_data"
         self.batch_size = batch_size
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+
+        # Tables from before image checks lack is_og_image_reachable, which is only fetched while it exists
+        self.has_image_reachability = True
 
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
     
-    def get_data_by_date(self, start_date: str, end_date: str = datetime.utcnow().isoformat()) -> List[Dict[Any]]:
+    def get_data_by_date(self, start_date: str, end_date: str = None, date_column: str = "domain_registration_date") -> List[Dict[str, Any]]:
         """
-        Get data from Supabase within the provided dates.
+        Get data from Supabase with date_column within the provided dates. end_date defaults to now.
         """
+        end_date = end_date or datetime.utcnow().isoformat()
         try:
+            self.rate_limiter.acquire()
             response = (self.supabase.table(self.table_name)
                         .select("*")
-                        .gte(start_date)
-                        .lte(end_date)
+                        .gte(date_column, start_date)
+                        .lte(date_column, end_date)
                         .execute())
             data = response.data
             self.logger.info(f"Successfully fetched {len(data)} rows")
@@ -42,109 +58,128 @@ class SupabaseDataProcessor:
         """Calculate metadata fields for a single row."""
         now = datetime.utcnow().isoformat()
 
-        # True if no conditions are true:
-        #   1. Does the column not have a value?
-        #   2. Is the value equal to "Error"?
-        #   3. Is the value equal to "Not found"?
-        is_url_found = (not
-                        ((not row.get('final_url'))
-                         or row.get('final_url') == "Error"
-                         or row.get('final_url') == "Not found"))
-        is_og_title_found = (not
-                             ((not row.get('title'))
-                              or row.get('title') == "Error"
-                              or row.get('title') == "Not found"))
-        is_og_image_found = (not ((not row.get('image'))
-                                  or row.get('image') == "Error"
-                                  or row.get('image') == "Not found"))
-        
-        if is_url_found and is_og_title_found: website_status = "is_complete"
-        elif is_url_found: website_status = "is_live"
-        else: website_status = "is_down"
-
         return {
-            "is_url_found": is_url_found,
-            "is_og_title_found": is_og_title_found,
-            "is_og_image_found": is_og_image_found,
+            **derive_row_status(row),
             "last_updated_at": now,
-            "website_status": website_status
             # "last_ping": 
         }
     
     def process_batch(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Process a batch of rows and prepare updates."""
+        now = datetime.utcnow().isoformat()
+
         updates = []
         for row in rows:
-            metadata = self.calculate_metadata(row)
             updates.append({
                 'domain_name': row['domain_name'], # 'domain_name' is the primary key of the database
-                **metadata
+                **derive_row_status(row),
+                'last_updated_at': now,
             })
         return updates
     
     def update_batch(self, updates: List[Dict[str, Any]]) -> None:
         """Update a batch of rows in Supabase."""
         try:
+            self.rate_limiter.acquire()
             self.supabase.table(self.table_name).upsert(updates, on_conflict='domain_name').execute()
             self.logger.info(f"Successfully updated {len(updates)} rows")
         except Exception as e:
             self.logger.error(f"Error updating batch: {e}")
             raise
     
-    def process_all_records(self) -> None:
-        """Process all records in batches."""
-        offset = 0
-        total_processed = 0
+    def fetch_page(self, after_domain_name: str = None, start_date: str = None, end_date: str = None, date_column: str = "domain_registration_date",
+                   changed_since: str = None, incremental: bool = False) -> List[Dict[str, Any]]:
+        """
+        Fetch the next batch_size records ordered by domain_name, starting after after_domain_name.
 
-        while True:
-            response = (
-                self.supabase.table(self.table_name)
-                .select("domain_name, final_url, title, image")
-                .range(offset, offset + self.batch_size - 1)
-                .execute()
-                )
-            
-            records = response.data
-            if not records:
-                break
+        Keyset pagination: each page picks up from the last domain_name seen, so it's an indexed lookup
+        however far into the table it is, and rows updated mid-scan aren't skipped or repeated like with offsets.
+        With incremental, the stored derived fields are fetched too, to compare against.
+        With changed_since, only rows updated after it, or never updated, are fetched.
+        is_og_image_reachable is fetched if the table has it, so images the image checker found don't load stay not found.
+        """
+        columns = "domain_name, final_url, title, image"
+        if self.has_image_reachability:
+            columns += ", is_og_image_reachable"
+        if incremental:
+            columns += ", " + ", ".join(DERIVED_COLUMNS)
 
-            updates = self.process_batch(records)
-            self.update_batch(updates)
+        query = (self.supabase.table(self.table_name)
+                 .select(columns))
 
-            total_processed += len(records)
-            offset += self.batch_size
+        if after_domain_name is not None:
+            query = query.gt("domain_name", after_domain_name)
+        if start_date is not None:
+            query = query.gte(date_column, start_date).lte(date_column, end_date)
+        if changed_since is not None:
+            query = query.or_(f"last_updated_at.gt.{changed_since},last_updated_at.is.null")
 
-            self.logger.info(f"Processed {total_processed} records so far")
-            time.sleep(1) # Rate limiting
+        self.rate_limiter.acquire()
+        try:
+            response = (query.order("domain_name")
+                             .limit(self.batch_size)
+                             .execute())
+        except Exception as e:
+            if not self.has_image_reachability or getattr(e, 'code', None) != UNDEFINED_COLUMN_ERROR_CODE:
+                raise
+            self.logger.warning(f"{self.table_name} has no is_og_image_reachable column, so every image is taken to load: {e}")
+            self.has_image_reachability = False
+            return self.fetch_page(after_domain_name, start_date, end_date, date_column, changed_since, incremental)
+        return response.data
 
-        self.logger.info(f"Processed all {total_processed} records")
-    
-    def process_all_records_by_date(self, start_date: str, end_date: str = datetime.utcnow().isoformat()) -> None:
-        """Process all records in batches."""
-        offset = 0
+    def find_outdated_records(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Get the records whose stored derived fields don't match what their final_url, title, image and is_og_image_reachable give."""
+        outdated = []
+        for record in records:
+            derived = derive_row_status(record)
+            # Missing stored values (None) never equal a derived value, so those rows are rewritten too
+            if any(record.get(column) != derived[column] for column in DERIVED_COLUMNS):
+                outdated.append(record)
+        return outdated
+
+    def process_pages(self, incremental: bool = False, **filters) -> None:
+        """
+        Process every record matching filters, reading the next page while the current batch is upserted.
+        With incremental, records whose derived fields are already correct are skipped instead of rewritten.
+        """
         total_processed = 0
+        total_skipped = 0
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = executor.submit(self.fetch_page, None, incremental=incremental, **filters)
+
+            while next_page is not None:
+                records = next_page.result()
+
+                # A short page is the last one
+                next_page = None
+                if len(records) == self.batch_size:
+                    next_page = executor.submit(self.fetch_page, records[-1]['domain_name'], incremental=incremental, **filters)
+
+                total_processed += len(records)
+                if incremental:
+                    outdated_records = self.find_outdated_records(records)
+                    total_skipped += len(records) - len(outdated_records)
+                    records = outdated_records
+
+                if records:
+                    updates = self.process_batch(records)
+                    self.update_batch(updates)
+
+                self.logger.info(f"Processed {total_processed} records so far, skipped {total_skipped} already correct")
+
+        self.logger.info(f"Processed all {total_processed} records, skipped {total_skipped} already correct, "
+                         f"waited {self.rate_limiter.waited:.1f} seconds for rate limiting")
+
+    def process_all_records(self, incremental: bool = False, changed_since: str = None) -> None:
+        """Process all records in batches.
+
+        Args:
+            incremental:    Only rewrite records whose derived fields are out of date. Defaults to False
+            changed_since:  Only read records updated after this timestamp, or never updated. Defaults to None (all records)
+        """
+        self.process_pages(incremental=incremental, changed_since=changed_since)
 
-        while True:
-            response = (
-                self.supabase.table(self.table_name)
-                .select("domain_name, final_url, title, image")
-                .gte(start_date)
-                .lte(end_date)
-                .range(offset, offset + self.batch_size - 1)
-                .execute()
-                )
-            
-            records = response.data
-            if not records:
-                break
-
-            updates = self.process_batch(records)
-            self.update_batch(updates)
-
-            total_processed += len(records)
-            offset += self.batch_size
-
-            self.logger.info(f"Processed {total_processed} records so far")
-            time.sleep(1) # Rate limiting
-
-        self.logger.info(f"Processed all {total_processed} records")
\ No newline at end of file
+    def process_all_records_by_date(self, start_date: str, end_date: str = None, date_column: str = "domain_registration_date") -> None:
+        """Process all records with date_column within the provided dates, in batches. end_date defaults to now."""
+        self.process_pages(start_date=start_date, end_date=end_date or datetime.utcnow().isoformat(), date_column=date_column)
@@ -0,0 +1,68 @@
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import time
+
+"""
+The synchronous hooks for RequestTracer (see utils/request_tracing.py).
+requests has no tracing of its own, so urllib3's connections are timed instead.
+"""
+
+class TracedHTTPConnection(HTTPConnection):
+    tracer = None
+
+    def _new_conn(self):
+        # Resolving the host happens inside, so connect includes DNS here
+        with self.tracer.time('connect'):
+            return super()._new_conn()
+
+    def getresponse(self, *args, **kwargs):
+        with self.tracer.time('ttfb'):
+            return super().getresponse(*args, **kwargs)
+
+class TracedHTTPSConnection(HTTPSConnection):
+    tracer = None
+
+    def _new_conn(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            self.new_conn_seconds = time.perf_counter() - start_time
+            self.tracer.observe('connect', self.new_conn_seconds)
+
+    def connect(self):
+        # Opening the socket is timed as connect, the rest of connecting is the TLS handshake
+        self.new_conn_seconds = 0.0
+        start_time = time.perf_counter()
+        super().connect()
+        self.tracer.observe('tls', time.perf_counter() - start_time - self.new_conn_seconds)
+
+    def getresponse(self, *args, **kwargs):
+        with self.tracer.time('ttfb'):
+            return super().getresponse(*args, **kwargs)
+
+class TracingAdapter(HTTPAdapter):
+    def __init__(self, tracer, **kwargs):
+        """A requests HTTPAdapter whose connections report their stages to tracer."""
+        self.tracer = tracer
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        # Subclassed per adapter, so each connection knows which tracer to report to
+        http_connection = type('TracedHTTPConnection', (TracedHTTPConnection,), {'tracer': self.tracer})
+        https_connection = type('TracedHTTPSConnection', (TracedHTTPSConnection,), {'tracer': self.tracer})
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('TracedHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': http_connection}),
+            'https': type('TracedHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': https_connection}),
+        }
+
+    def send(self, request, stream=False, **kwargs):
+        response = super().send(request, stream=True, **kwargs)
+        if not stream:
+            # requests would read the body right after this anyway, so read it here to time it
+            with self.tracer.time('download'):
+                response.content
+        return response
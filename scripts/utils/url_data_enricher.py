@@ -1,20 +1,120 @@
-import requests
-import pandas as pd
-from utils.populate_metadata import ensure_valid_protocol, parse_open_graph_metadata
-from utils.csv_processing import append_row_to_csv
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from __future__ import annotations
+from utils.populate_metadata import ensure_valid_protocol, get_hostname, parse_open_graph_metadata, get_charset, OpenGraphHeadParser
+from utils.checkpoint_store import CheckpointStore, default_checkpoint_path
+from utils.arrow_io import is_columnar_path, read_enriched_data, iter_row_batches
+from utils.concurrency_controller import AdaptiveConcurrencyController
+from utils.parse_cache import ParseCache
+from utils.image_checker import ImageChecker
+from utils.persistent_cache import PersistentCache
+from utils.redirect_targets import FetchedPage, RedirectTargets, get_redirect_url
+from utils.request_tracing import RequestTracer
+from utils.website_status import derive_row_status, is_data_found
+from typing import TYPE_CHECKING
 import os
-import aiohttp
 import asyncio
+import contextlib
 import logging
 import datetime
+import time
+
+# requests, aiohttp, pandas and the DNS resolver are imported where they're first needed,
+# so checking a single domain synchronously doesn't load the asynchronous stack, and vice versa
+if TYPE_CHECKING:
+    import aiohttp
+    import pandas as pd
+    import requests
+
+# Size of the chunks read from the response body in head-only mode
+HEAD_CHUNK_SIZE = 8192
+
+def is_present(value) -> bool:
+    """True if value isn't None, NaN, or an empty string, as missing cells come back from pandas and Supabase."""
+    return not (value is None or value == '' or (isinstance(value, float) and value != value))
 
 class UrlDataEnricher:
-    def __init__(self):
+    def __init__(self,
+                 head_only: bool = False,
+                 max_head_bytes: int = 512 * 1024,
+                 pre_resolve_dns: bool = True,
+                 dns_cache_path: str = None,
+                 conditional_requests: bool = False,
+                 parse_cache_size: int = 10000,
+                 parse_cache_path: str = None,
+                 probe_delay: float = 1.0,
+                 scheme_cache_path: str = None,
+                 share_redirect_targets: bool = True,
+                 check_images: bool = False,
+                 image_cache_path: str = None,
+                 metrics_json_path: str = None,
+                 metrics_textfile_path: str = None):
+        """
+        Initialize the UrlDataEnricher.
+
+        Args:
+            head_only:          Stream each response body into an incremental parser, and stop reading
+                                once the <head> has been parsed instead of downloading the whole page. Defaults to False
+            max_head_bytes:     The most bytes of a response body to read in head-only mode. Defaults to 512 KB
+            pre_resolve_dns:    Resolve every domain in a batch concurrently before fetching, and mark domains
+                                that don't exist as down without making any HTTP requests. Defaults to True
+            dns_cache_path:     JSON file to remember domains that don't resolve in between runs. Defaults to None
+            conditional_requests:   Send If-None-Match/If-Modified-Since using the etag/last_modified of each input row,
+                                    and keep the row's previous metadata when the site responds 304 Not Modified.
+                                    Adds etag and last_modified columns to the output. Defaults to False
+            parse_cache_size:   The most parsed pages to memoize by content hash, so identical parking and
+                                placeholder pages are only parsed once. 0 disables the cache. Defaults to 10000
+            parse_cache_path:   JSON file to keep the parse cache in between runs. Defaults to None
+            probe_delay:        Seconds to wait on the preferred scheme (HTTPS, or whichever worked last time)
+                                before also trying the other scheme in asynchronous mode. Defaults to 1 second
+            scheme_cache_path:  JSON file to remember which scheme each domain responded on in between runs. Defaults to None
+            share_redirect_targets: Follow redirects by hand, and fetch and parse each URL domains redirect to once per run,
+                                    sharing the page between them. Redirect targets are fetched without conditional headers.
+                                    Defaults to True
+            check_images:       Check each page's og:image loads with a HEAD (or ranged GET) request. Adds an
+                                is_og_image_reachable column to the output, and is_og_image_found is False for images
+                                that don't load, while the image URL is kept. Defaults to False
+            image_cache_path:   JSON file to remember which images load in between runs, with check_images. Defaults to None
+            metrics_json_path:  JSON file to write per-stage timing histograms, and status code and error counts, to
+                                at the end of each run. Defaults to None
+            metrics_textfile_path:  File to write the same metrics to in the Prometheus text format at the end of each run,
+                                    for node_exporter's textfile collector. Defaults to None
+        """
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-        self.requests_session = self.setup_requests_session()
+        self.head_only = head_only
+        self.max_head_bytes = max_head_bytes
+        self.pre_resolve_dns = pre_resolve_dns
+        self.dns_cache_path = dns_cache_path
+        self.conditional_requests = conditional_requests
+        self.parse_cache = ParseCache(parse_cache_size, parse_cache_path) if parse_cache_size > 0 else None
+        self.probe_delay = probe_delay
+
+        # Domain -> the scheme ('https' or 'http') it last responded on. Kept for 30 days
+        self.scheme_hints = PersistentCache(ttl=30 * 24 * 60 * 60, path=scheme_cache_path)
+
+        # The pages fetched from redirect targets during the current run
+        self.redirect_targets = RedirectTargets() if share_redirect_targets else None
+
+        # Whether each image URL loads, cached for a week (or a day for those that don't)
+        self.image_checker = ImageChecker(cache_path=image_cache_path) if check_images else None
+
+        # Set while a batch of domains is being enriched with pre_resolve_dns
+        self.dns_resolver = None
+
+        # Set while enrich_urls_async runs with parse_workers
+        self.parse_executor = None
+        self.parse_slots = None
+
+        # Stats collected during the last run, logged when it finishes
+        self.run_report = {}
+
+        # Per-stage timings of the last run's requests, exported when it finishes
+        self.tracer = RequestTracer()
+        self.metrics_json_path = metrics_json_path
+        self.metrics_textfile_path = metrics_textfile_path
+
+        # Created on the first synchronous request
+        self.requests_session = None
 
         self.CSV_ROWS_SCHEMA = [
             'domain_name',
@@ -34,6 +134,9 @@ class UrlDataEnricher:
 
     def setup_requests_session(self) -> requests.Session:
         """Create a requests Session to be used for all synchronous requests, with desired configuration."""
+        import requests
+        from urllib3.exceptions import InsecureRequestWarning
+
         session = requests.Session()
 
         # Disable SSL verification for the session to improve redirect handling
@@ -44,6 +147,9 @@ class UrlDataEnricher:
         # (otherwise, there would be an extra error for every row in the file) 
         requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+        # Time the stages of every request
+        self.tracer.mount(session)
+
         return session
 
     def read_csv_data(self, csv) -> pd.DataFrame | None:
@@ -55,7 +161,9 @@ class UrlDataEnricher:
         2. Provided CSV data is a List[Any]             -> Read from that data
         3. Provided CSV data is a valid file path       -> Read from that file
         4. Provided CSV data is an invalid file path    -> Create that file
+        Parquet and Arrow files (by extension) are read memory-mapped, with their typed columns.
         """
+        import pandas as pd
 
         if csv == None:
             self.logger.error(f"Failed to read invalid CSV: {csv}")
@@ -65,7 +173,10 @@ class UrlDataEnricher:
             return pd.DataFrame(csv)
         else:
             try:
-                if os.path.isfile(csv):
+                if os.path.isfile(csv) and is_columnar_path(csv):
+                    self.logger.info(f"Reading from columnar file: {csv}")
+                    return read_enriched_data(csv)
+                elif os.path.isfile(csv):
                     self.logger.info(f"Reading from CSV file: {csv}")
                     return pd.read_csv(csv)
                 else:
@@ -74,26 +185,39 @@ class UrlDataEnricher:
             except Exception as e:
                 self.logger.error(e)
 
-    def generate_row(self, url, registration_date, nexus_category, status_code, final_url, open_graph_metadata) -> dict:
-        """Generate a dict with all provided info."""
-
-        # True if no conditions are true:
-        #   1. Does the column not have a value?
-        #   2. Is the value equal to "Error"?
-        #   3. Is the value equal to "Not found"?
-        def is_data_found(data):
-            return (not
-                    ((not data)
-                    or data == "Error"
-                    or data == "Not found"))
-        
-        if is_data_found(final_url) and is_data_found(open_graph_metadata['title']): website_status = "is_complete"
-        elif is_data_found(final_url): website_status = "is_live"
-        else: website_status = "is_down"
+    def iter_input_batches(self, csv, batch_rows: int = 1000):
+        """
+        Read the provided CSV data batch_rows at a time, yielding each batch as a list of row dicts.
+        CSV, Parquet and Arrow files are read a batch at a time, so the whole file is never in memory.
+        Anything else read_csv_data() accepts is read up front, then yielded in batches.
+        """
+        if isinstance(csv, str) and os.path.isfile(csv):
+            self.logger.info(f"Streaming rows from: {csv}")
+            if is_columnar_path(csv):
+                yield from iter_row_batches(csv, batch_rows)
+            else:
+                import pandas as pd
+                for chunk in pd.read_csv(csv, chunksize=batch_rows):
+                    yield chunk.to_dict('records')
+            return
+
+        input_data = self.read_csv_data(csv)
+        if input_data is None:
+            return
+        for start in range(0, len(input_data), batch_rows):
+            yield input_data.iloc[start:start + batch_rows].to_dict('records')
+
+    def generate_row(self, url, registration_date, nexus_category, status_code, final_url, open_graph_metadata, validators=None, is_image_reachable=None) -> dict:
+        """Generate a dict with all provided info.
+        With conditional_requests, validators holds the etag and last_modified to store for the next refresh.
+        With check_images, is_image_reachable is whether the og:image loads, or None if it wasn't checked."""
+
+        status = derive_row_status({'final_url': final_url, **open_graph_metadata, 'is_og_image_reachable': is_image_reachable})
         
-        last_updated_at = datetime.datetime.now()
+        # In UTC, as SupabaseDataProcessor writes it and update_all_urls.py compares it
+        last_updated_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
 
-        return {
+        row = {
             # Original data
             'domain_name': url,
             'domain_registration_date': registration_date,
@@ -109,69 +233,367 @@ class UrlDataEnricher:
             # Convenience dates
             'last_updated_at': last_updated_at,
             # Convenience bools
-            'is_url_found': is_data_found(final_url),
-            'is_og_title_found': is_data_found(open_graph_metadata['title']),
-            'is_og_image_found': is_data_found(open_graph_metadata['image']),
+            'is_url_found': status['is_url_found'],
+            'is_og_title_found': status['is_og_title_found'],
+            'is_og_image_found': status['is_og_image_found'],
             # Website status
-            'website_status': website_status
+            'website_status': status['website_status']
+        }
+
+        if self.conditional_requests:
+            # Cache validators for conditional requests on the next refresh
+            validators = validators or {}
+            row['etag'] = validators.get('etag')
+            row['last_modified'] = validators.get('last_modified')
+
+        if self.image_checker is not None:
+            row['is_og_image_reachable'] = is_image_reachable
+
+        return row
+
+    def get_conditional_headers(self, previous_row) -> dict:
+        """Get If-None-Match/If-Modified-Since headers from the validators stored on previous_row."""
+        if not self.conditional_requests or previous_row is None:
+            return {}
+
+        # Only a previous successful fetch has metadata worth keeping
+        if not is_present(previous_row.get('final_url')) or previous_row.get('final_url') == "Error":
+            return {}
+
+        headers = {}
+        if is_present(previous_row.get('etag')):
+            headers['If-None-Match'] = previous_row['etag']
+        if is_present(previous_row.get('last_modified')):
+            headers['If-Modified-Since'] = previous_row['last_modified']
+        return headers
+
+    def get_validators(self, headers, previous_row=None) -> dict:
+        """Get the validators to store from response headers, falling back to those on previous_row."""
+        previous_row = previous_row or {}
+        return {
+            'etag': headers.get('ETag') or previous_row.get('etag'),
+            'last_modified': headers.get('Last-Modified') or previous_row.get('last_modified'),
+        }
+
+    def generate_not_modified_row(self, url, registration_date, nexus_category, previous_row, headers) -> dict:
+        """Generate a row for a 304 Not Modified response, keeping previous_row's status and metadata.
+        Only last_updated_at (and any new validators) change."""
+        self.count_in_run_report('not_modified')
+
+        open_graph_metadata = {
+            field: previous_row.get(field) if is_present(previous_row.get(field)) else 'Not found'
+            for field in ['title', 'description', 'image']
         }
 
+        return self.generate_row(url, registration_date, nexus_category, previous_row.get('status_code'),
+                                 previous_row.get('final_url'), open_graph_metadata,
+                                 validators=self.get_validators(headers, previous_row))
+
+
+    def get_scheme_order(self, url: str) -> list:
+        """Get the schemes to try for url, starting with the one that worked last time for its domain."""
+        if url.startswith('http://'):
+            return ['http']
+        if self.scheme_hints.get(get_hostname(url)) == 'http':
+            return ['http', 'https']
+        return ['https', 'http']
+
+    def record_scheme(self, url: str, scheme: str):
+        """Remember which scheme got a response from url's domain, so the next refresh goes straight to it."""
+        self.scheme_hints.set(get_hostname(url), scheme)
+        self.count_in_run_report(f"{scheme}_responses")
+
+    def get_response(self, url, headers=None) -> requests.Response | FetchedPage | None:
+        """Get the response at the provided url, sending any extra headers.
+        Attempts using both HTTPS and HTTP protocols to handle SSL and connection issues,
+        starting with the scheme that worked last time for the domain.
+        With share_redirect_targets, a redirect returns the FetchedPage its target leads to instead,
+        or None if fetching the target fails."""
+        import requests
+        if self.requests_session is None:
+            self.requests_session = self.setup_requests_session()
 
-    def get_response(self, url):
-        """Get the response at the provided url.
-        Attempts using both HTTPS and HTTP protocols to Handle SSL issues."""
         url = ensure_valid_protocol(url)
+        schemes = self.get_scheme_order(url)
 
-        try:
-            # Try with HTTPS
-            response = self.requests_session.get(url, timeout=5)
-            return response
-        except requests.exceptions.SSLError:
-            self.logger.warning(f"SSL error with {url}, trying HTTP instead.")
-            # Try with HTTP if HTTPS fails
-            url = url.replace("https://", "http://")
+        for scheme in schemes:
+            scheme_url = url.replace("https://", f"{scheme}://", 1)
             try:
-                response = self.requests_session.get(url, timeout=5)
+                response = self.requests_session.get(scheme_url, headers=headers, timeout=5, stream=self.head_only,
+                                                     allow_redirects=self.redirect_targets is None)
+                self.tracer.count_status(response.status_code)
+
+                target_url = get_redirect_url(response.status_code, response.headers, response.url) if self.redirect_targets is not None else None
+                if target_url is not None:
+                    response.close()
+                    try:
+                        response = self.redirect_targets.fetch(target_url, lambda: self.fetch_page(target_url))
+                    except requests.RequestException as e:
+                        # The other scheme would fetch this domain again, not the target, so the domain fails with it
+                        self.tracer.count_error(e)
+                        self.logger.error(f"Error fetching {target_url}, which {scheme_url} redirects to: {e!r}")
+                        return None
+                    self.logger.debug(f"{scheme_url} redirects to {' -> '.join(response.redirect_chain)}")
+
+                self.record_scheme(url, scheme)
                 return response
+            except (requests.exceptions.SSLError, requests.exceptions.ConnectionError) as e:
+                self.tracer.count_error(e)
+                if scheme != schemes[-1]:
+                    self.logger.warning(f"Error with {scheme_url}, trying {schemes[-1].upper()} instead: {e!r}")
+                    continue
+                self.logger.error(f"Error fetching {scheme_url}: {e!r}")
+                return None
             except requests.RequestException as e:
-                self.logger.error(f"Error fetching {url}: {e}")
+                self.tracer.count_error(e)
+                self.logger.error(f"Error fetching {scheme_url}: {e!r}")
                 return None
-        except requests.RequestException as e:
-            self.logger.error(f"Error fetching {url}: {e}")
-            return None
         
-    async def get_response_async(self, url: str, session: aiohttp.ClientSession) -> tuple[aiohttp.ClientResponse, str] | None:
-        """Get the response at the provided url using the provided aiohttp.ClientSession.
-        Attempts using both HTTPS and HTTP protocols to Handle SSL issues."""
-        # TODO: Can get_response and get_response_async be combined?
-        # Almost the entire function is the same, but the async processing
-        # works differently.
-        url = ensure_valid_protocol(url)
+    def fetch_page(self, url: str) -> FetchedPage:
+        """Fetch the page url leads to, following any further redirects, and parse its Open Graph metadata."""
+        response = self.requests_session.get(url, timeout=5, stream=self.head_only)
+        self.tracer.count_status(response.status_code)
+
+        final_url = response.url
+        validators = self.get_validators(response.headers)
+        redirect_chain = [history_response.url for history_response in response.history] + [final_url]
+
+        # Match the row the domain would get without sharing, which keeps "Error" for failed responses
+        open_graph_metadata = {'title': "Error", 'description': "Error", 'image': "Error"}
+        if response:
+            response_body = self.read_body(response)
+            with self.tracer.time('parse'):
+                open_graph_metadata = self.parse_body(response_body, final_url, url)
+        response.close()
+
+        return FetchedPage(response.status_code, final_url, validators, open_graph_metadata, redirect_chain)
+
+    def read_body(self, response: requests.Response) -> bytes | OpenGraphHeadParser:
+        """Read the body of the response.
+        In head-only mode, stream it into an OpenGraphHeadParser until the <head> is parsed."""
+        if not self.head_only:
+            return response.content
+
+        parser = OpenGraphHeadParser(get_charset(response.headers.get('Content-Type')))
+        bytes_read = 0
 
         try:
-            # Try with HTTPS
-            async with session.get(url, timeout=10) as response:
-                response_text = await response.text()
-                return response, response_text
-        except aiohttp.ClientSSLError:
-            self.logger.warning(f"SSL error with {url}, trying HTTP instead.")
-            # Try with HTTP if HTTPS fails
-            url = url.replace("https://", "http://")
-            try:
-                async with session.get(url, timeout=10) as response:
-                    response_text = await response.text()
-                    return response, response_text
-            except requests.RequestException as e:
-                self.logger.error(f"Error fetching {url}: {e}")
-                return None
-        except requests.RequestException as e:
-            self.logger.error(f"Error fetching {url}: {e}")
+            with self.tracer.time('download'):
+                for chunk in response.iter_content(chunk_size=HEAD_CHUNK_SIZE):
+                    parser.feed_bytes(chunk)
+                    bytes_read += len(chunk)
+                    if parser.is_complete or bytes_read >= self.max_head_bytes:
+                        break
+        finally:
+            # Closing the response drops the rest of the body
+            response.close()
+
+        return parser
+
+    async def read_body_async(self, response: aiohttp.ClientResponse) -> str | OpenGraphHeadParser:
+        """Read the body of the response asynchronously.
+        In head-only mode, stream it into an OpenGraphHeadParser until the <head> is parsed."""
+        if not self.head_only:
+            return await response.text()
+
+        parser = OpenGraphHeadParser(response.charset)
+        bytes_read = 0
+
+        async for chunk in response.content.iter_chunked(HEAD_CHUNK_SIZE):
+            parser.feed_bytes(chunk)
+            bytes_read += len(chunk)
+            if parser.is_complete or bytes_read >= self.max_head_bytes:
+                break
+
+        return parser
+
+    def parse_body(self, body: str | bytes | OpenGraphHeadParser, base_url: str, url: str = None) -> dict:
+        """Get the Open Graph metadata from a body returned by read_body or read_body_async.
+        Pages already parsed for another domain (ignoring the hosts of base_url and url) come from the parse cache."""
+        if isinstance(body, OpenGraphHeadParser):
+            return body.get_metadata(base_url)
+
+        if self.parse_cache is None:
+            return parse_open_graph_metadata(body, base_url)
+
+        cache_entry = self.parse_cache.lookup(body, base_url, [get_hostname(base_url), get_hostname(url or base_url)])
+        if cache_entry.metadata is not None:
+            return cache_entry.result()
+        return cache_entry.store(parse_open_graph_metadata(cache_entry.body, cache_entry.base_url))
+
+    async def parse_body_async(self, body: str | OpenGraphHeadParser, base_url: str, url: str = None) -> dict:
+        """Get the Open Graph metadata from a body returned by read_body_async.
+        If a parse process pool is running, parse there so the event loop isn't blocked."""
+        # Head-only bodies were already parsed incrementally while streaming
+        if self.parse_executor is None or isinstance(body, OpenGraphHeadParser):
+            return self.parse_body(body, base_url, url)
+
+        cache_entry = None
+        if self.parse_cache is not None:
+            cache_entry = self.parse_cache.lookup(body, base_url, [get_hostname(base_url), get_hostname(url or base_url)])
+            if cache_entry.metadata is not None:
+                return cache_entry.result()
+            body, base_url = cache_entry.body, cache_entry.base_url
+
+        # Bound the number of bodies waiting in the pool, so memory stays flat
+        async with self.parse_slots:
+            loop = asyncio.get_running_loop()
+            metadata = await loop.run_in_executor(self.parse_executor, parse_open_graph_metadata, body, base_url)
+
+        return cache_entry.store(metadata) if cache_entry else metadata
+
+    def check_image(self, open_graph_metadata: dict) -> bool | None:
+        """With check_images, check whether the og:image loads. None if it wasn't checked, or the check was inconclusive."""
+        image = open_graph_metadata['image']
+        if self.image_checker is None or not is_data_found(image):
             return None
 
+        try:
+            with self.tracer.time('image'):
+                return self.image_checker.check(image)
+        except Exception as e:
+            # Treat it as unchecked rather than lose the row
+            self.logger.error(f"Error checking image {image}: {e!r}")
+            return None
+
+    async def check_image_async(self, open_graph_metadata: dict) -> bool | None:
+        """Asynchronous version of check_image."""
+        image = open_graph_metadata['image']
+        if self.image_checker is None or not is_data_found(image):
+            return None
+
+        try:
+            with self.tracer.time('image'):
+                return await self.image_checker.check_async(image)
+        except Exception as e:
+            # Treat it as unchecked rather than lose the row
+            self.logger.error(f"Error checking image {image}: {e!r}")
+            return None
+
+    def start_run(self):
+        """Reset the run report and per-run stats at the start of a run."""
+        self.run_report = {}
+        self.tracer.reset()
+        if self.parse_cache is not None:
+            self.parse_cache.reset_stats()
+        if self.redirect_targets is not None:
+            self.redirect_targets.reset()
+        if self.image_checker is not None:
+            self.image_checker.reset_stats()
+
+    def finish_run(self):
+        """Save caches that persist between runs, add their stats to the run report, log it, and export the run's metrics."""
+        self.scheme_hints.save()
+
+        if self.parse_cache is not None:
+            self.parse_cache.save()
+            parse_cache_stats = self.parse_cache.stats()
+            self.run_report['parse_cache_hits'] = parse_cache_stats['hits']
+            self.run_report['parse_cache_misses'] = parse_cache_stats['misses']
+            self.run_report['parse_cache_size'] = parse_cache_stats['size']
+
+        if self.redirect_targets is not None:
+            self.run_report.update(self.redirect_targets.stats())
+            # Pages are only shared within a run
+            self.redirect_targets.reset()
+
+        if self.image_checker is not None:
+            self.image_checker.save()
+            self.run_report.update(self.image_checker.stats())
+
+        self.log_run_report()
+        self.export_metrics()
+
+    async def fetch_async(self, url: str, session: aiohttp.ClientSession, headers=None) -> tuple[aiohttp.ClientResponse, str | OpenGraphHeadParser] | tuple[FetchedPage, None]:
+        """Make a single request to url, returning the response and its body.
+        With share_redirect_targets, a redirect returns the FetchedPage its target leads to, and no body, instead."""
+        try:
+            async with session.get(url, headers=headers, timeout=10, allow_redirects=self.redirect_targets is None) as response:
+                self.tracer.count_status(response.status)
+                target_url = get_redirect_url(response.status, response.headers, response.url) if self.redirect_targets is not None else None
+                if target_url is None:
+                    with self.tracer.time('download'):
+                        response_body = await self.read_body_async(response)
+                    return response, response_body
+        except Exception as e:
+            self.tracer.count_error(e)
+            raise
+
+        # Errors fetching the target are counted once, by whichever domain's fetch_page_async() made the request
+        page = await self.redirect_targets.fetch_async(target_url, lambda: self.fetch_page_async(target_url, session))
+        self.logger.debug(f"{url} redirects to {' -> '.join(page.redirect_chain)}")
+        return page, None
+
+    async def fetch_page_async(self, url: str, session: aiohttp.ClientSession) -> FetchedPage:
+        """Fetch the page url leads to, following any further redirects, and parse its Open Graph metadata."""
+        try:
+            async with session.get(url, timeout=10) as response:
+                with self.tracer.time('download'):
+                    response_body = await self.read_body_async(response)
+                self.tracer.count_status(response.status)
+        except Exception as e:
+            self.tracer.count_error(e)
+            raise
+
+        final_url = str(response.url)
+        redirect_chain = [str(history_response.url) for history_response in response.history] + [final_url]
+        with self.tracer.time('parse'):
+            open_graph_metadata = await self.parse_body_async(response_body, final_url, url)
+
+        return FetchedPage(response.status, final_url, self.get_validators(response.headers), open_graph_metadata, redirect_chain)
+
+    async def get_response_async(self, url: str, session: aiohttp.ClientSession, headers=None) -> tuple[aiohttp.ClientResponse, str | OpenGraphHeadParser]:
+        """Get the response at the provided url using the provided aiohttp.ClientSession, sending any extra headers.
+
+        Probes HTTPS and HTTP happy-eyeballs style: the preferred scheme is tried first, and if it hasn't
+        responded within probe_delay seconds (or fails sooner) the other is started alongside it.
+        The first successful response wins. The preferred scheme is the one that won last time for the domain.
+        Raises the preferred scheme's error if neither gets a response."""
+        url = ensure_valid_protocol(url)
+        schemes = self.get_scheme_order(url)
+
+        tasks = {}
+        winner = None
+        try:
+            for scheme in schemes:
+                scheme_url = url.replace("https://", f"{scheme}://", 1)
+                tasks[asyncio.create_task(self.fetch_async(scheme_url, session, headers))] = scheme
+
+                # Give the preferred scheme a head start before racing the other against it
+                if scheme != schemes[-1]:
+                    done, _ = await asyncio.wait(tasks, timeout=self.probe_delay)
+                    if done and not any(task.exception() for task in done):
+                        break
+
+            errors = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        self.record_scheme(url, tasks[task])
+                        return task.result()
+                    errors[tasks[task]] = task.exception()
+                    self.logger.debug(f"Error with {tasks[task].upper()} for {url}: {task.exception()}")
+
+            raise errors[schemes[0]]
+        finally:
+            # Stop the slower attempt once there's a winner, and wait for it to give up its connection
+            losers = [task for task in tasks if task is not winner]
+            for task in losers:
+                task.cancel()
+            for result in await asyncio.gather(*losers, return_exceptions=True):
+                # A loser that got a response before it was cancelled still holds it
+                if isinstance(result, tuple) and not isinstance(result[0], FetchedPage):
+                    result[0].close()
+
     # Synchronous versions of the URL enriching functions
 
-    def enrich_url(self, url, registration_date, nexus_category):
-        """Process an individual URL to get status code and Open Graph data."""
+    def enrich_url(self, url, registration_date, nexus_category, previous_row=None):
+        """Process an individual URL to get status code and Open Graph data.
+        With conditional_requests, previous_row is the URL's last enriched row, reused if the site hasn't changed."""
+        import requests
         status_code = "Error"
         final_url = "Error"
         open_graph_metadata = {
@@ -179,49 +601,174 @@ class UrlDataEnricher:
             'description': "Error",
             'image': "Error"
         }
-        
-        response = self.get_response(url)
-
-        if response:
-            status_code = response.status_code
-            final_url = response.url
-            open_graph_metadata = parse_open_graph_metadata(response.content, final_url)
 
-        return self.generate_row(url, registration_date, nexus_category, status_code, final_url, open_graph_metadata)
+        if self.is_unresolvable(url):
+            self.logger.debug(f"Skipping unresolvable domain: {url}")
+            return self.generate_row(url, registration_date, nexus_category, status_code, final_url, open_graph_metadata)
+        
+        conditional_headers = self.get_conditional_headers(previous_row)
+        response = self.get_response(url, headers=conditional_headers)
+
+        validators = None
+        if isinstance(response, FetchedPage):
+            if response.ok:
+                status_code = response.status_code
+                final_url = response.final_url
+                validators = response.validators
+                open_graph_metadata = response.open_graph_metadata
+        elif conditional_headers and response is not None and response.status_code == 304:
+            response.close()
+            return self.generate_not_modified_row(url, registration_date, nexus_category, previous_row, response.headers)
+        elif response:
+            try:
+                # In head-only mode the body is streamed after get_response returns, so a server can still stall here
+                response_body = self.read_body(response)
+            except requests.RequestException as e:
+                self.tracer.count_error(e)
+                self.logger.error(f"Error reading {response.url}: {e!r}")
+            else:
+                status_code = response.status_code
+                final_url = response.url
+                validators = self.get_validators(response.headers)
+                with self.tracer.time('parse'):
+                    open_graph_metadata = self.parse_body(response_body, final_url, url)
+
+        is_image_reachable = self.check_image(open_graph_metadata)
+
+        return self.generate_row(url, registration_date, nexus_category, status_code, final_url, open_graph_metadata, validators, is_image_reachable)
+
+    def open_checkpoint_store(self, output_csv_path, checkpoint_path=None) -> CheckpointStore:
+        """Open the checkpoint store for a run that outputs to output_csv_path.
+        If there's no checkpoint yet but the output CSV (or Parquet or Arrow file) exists, its rows are imported so the run resumes after them.
+        Without either path, the store is kept in memory."""
+        if checkpoint_path is None and output_csv_path is None:
+            return CheckpointStore(':memory:')
+
+        checkpoint_store = CheckpointStore(checkpoint_path or default_checkpoint_path(output_csv_path))
+
+        if len(checkpoint_store) == 0 and output_csv_path and os.path.isfile(output_csv_path):
+            if is_columnar_path(output_csv_path):
+                imported_rows = checkpoint_store.import_columnar(output_csv_path)
+            else:
+                imported_rows = checkpoint_store.import_csv(output_csv_path)
+            self.logger.info(f"Imported {imported_rows} rows from {output_csv_path} into checkpoint store")
+
+        return checkpoint_store
+
+    def enrich_urls(self, input_csv_path, output_csv_path, checkpoint_path=None):
+        """Read URLs from CSV, process them, and save enriched data to a new CSV file.
+        Each row is recorded in a checkpoint store as it completes, so an interrupted run resumes where it stopped.
+        The output CSV is exported from the checkpoint store at the end of the run.
+
+        Args:
+            input_csv_path:     The CSV, Parquet or Arrow file, or list of rows, to enrich
+            output_csv_path:    The CSV file to export enriched rows to, or a .parquet or .arrow file to export them as typed columns
+            checkpoint_path:    The checkpoint store to record rows in. Defaults to default_checkpoint_path(output_csv_path)
+        """
+        self.start_run()
+        checkpoint_store = None
 
-    def enrich_urls(self, input_csv_path, output_csv_path):
-        """Read URLs from CSV, process them, and save enriched data to a new CSV file."""
         try:
-            existing_enriched_data = self.read_csv_data(output_csv_path)
-
-            # Collect the list of URLs that have already been processed into the output file
-            processed_urls = set(existing_enriched_data['domain_name'])
-            
+            checkpoint_store = self.open_checkpoint_store(output_csv_path, checkpoint_path)
             input_data = self.read_csv_data(input_csv_path)
 
             if 'domain_name' not in input_data.columns:
                 self.logger.exception("CSV must contain a 'domain_name' column")
                 return
 
-            # Iterate through rows, enrich the data, append to the output CSV
+            if self.pre_resolve_dns:
+                pending_domains = [domain for domain in input_data['domain_name'] if not checkpoint_store.is_processed(domain)]
+                asyncio.run(self.pre_resolve_domains(pending_domains))
+
+            # Iterate through rows, enrich the data, record it in the checkpoint store
             for index, row in input_data.iterrows():
-                if row['domain_name'] in processed_urls:
+                if checkpoint_store.is_processed(row['domain_name']):
                     continue # Skip URLs that we've already processed
 
-                enriched_row = self.enrich_url(row['domain_name'], row['domain_registration_date'], row['nexus_category'])
-                append_row_to_csv(enriched_row, output_csv_path)
+                enriched_row = self.enrich_url(row['domain_name'], row['domain_registration_date'], row['nexus_category'], row.to_dict())
+                with self.tracer.time('write'):
+                    checkpoint_store.record(enriched_row)
                 self.logger.debug(f"Finished processing: {row['domain_name']}")
+
+            with self.tracer.time('export'):
+                exported_rows = checkpoint_store.export(output_csv_path)
             
-            self.logger.info(f"Finished processing all data")
+            self.logger.info(f"Finished processing all data, exported {exported_rows} rows to {output_csv_path}")
+            self.finish_run()
 
         except Exception as e:
             self.logger.exception(f"Error during processing: {e}")
+        finally:
+            self.dns_resolver = None
+            if checkpoint_store is not None:
+                checkpoint_store.close()
+
+    async def pre_resolve_domains(self, domains) -> set:
+        """
+        Resolve the hosts of all domains concurrently before fetching them.
+        Returns the set of hosts that don't resolve, which is_unresolvable() reports on.
+        """
+        from utils.dns_resolver import CachingResolver
+        if self.dns_resolver is None:
+            self.dns_resolver = CachingResolver(negative_cache_path=self.dns_cache_path)
+
+        hosts = {get_hostname(domain) for domain in domains}
+        hosts.discard(None)
+
+        cached_unresolvable = sum(1 for host in hosts if self.dns_resolver.is_unresolvable(host))
+        unresolvable = await self.dns_resolver.pre_resolve(hosts)
+        self.dns_resolver.save()
+
+        self.logger.info(f"Pre-resolved {len(hosts)} domains: {len(unresolvable)} don't resolve ({cached_unresolvable} already known)")
+        # The asynchronous mode pre-resolves a batch at a time, so counts add up over the run
+        self.count_in_run_report('unresolvable_domains', len(unresolvable))
+        self.count_in_run_report('unresolvable_domains_from_cache', cached_unresolvable)
+
+        return unresolvable
+
+    def is_unresolvable(self, url) -> bool:
+        """True if url's domain was found not to resolve while pre-resolving the current batch."""
+        return self.dns_resolver is not None and self.dns_resolver.is_unresolvable(get_hostname(url))
+
+    def count_in_run_report(self, name: str, amount: int = 1):
+        """Add amount to the named counter in the run report."""
+        self.run_report[name] = self.run_report.get(name, 0) + amount
+
+    def log_run_report(self):
+        """Log the stats collected during the last run."""
+        for name, value in self.run_report.items():
+            self.logger.info(f"{name}: {value}")
+
+        for stage, histogram in self.tracer.histograms.items():
+            if histogram.count:
+                summary = histogram.summary()
+                self.logger.info(f"{stage}: {summary['count']} timed, p50 {summary['p50_ms']:.1f} ms, p95 {summary['p95_ms']:.1f} ms, p99 {summary['p99_ms']:.1f} ms")
+
+    def export_metrics(self):
+        """Write the last run's stage timings, status codes, errors and run report to the metrics files, if provided."""
+        try:
+            if self.metrics_json_path:
+                self.tracer.write_json(self.metrics_json_path, self.run_report)
+            if self.metrics_textfile_path:
+                self.tracer.write_textfile(self.metrics_textfile_path, self.run_report)
+        except OSError as e:
+            # Metrics shouldn't fail a run whose rows are already saved
+            self.logger.error(f"Failed to export metrics: {e}")
 
     # Asynchronous versions of the URL enriching functions
 
-    async def enrich_url_async(self, url, registration_date, nexus_category, session, semaphore):
+    def is_congestion_error(self, error: Exception) -> bool:
+        """True if the error suggests we're overloading the network or the machine,
+        rather than saying something about the site itself (like a missing domain or a bad certificate)."""
+        import aiohttp
+        if isinstance(error, (aiohttp.ClientConnectorDNSError, aiohttp.ClientSSLError)):
+            return False
+        return isinstance(error, (asyncio.TimeoutError, aiohttp.ServerDisconnectedError, aiohttp.ClientOSError))
+
+    async def enrich_url_async(self, url, registration_date, nexus_category, session, concurrency, previous_row=None):
         """Enrich one URL with HTTP status code and available Open Graph data.
-        Performed asynchronously using aiohttp, asyncio, and asyncio.Semaphore."""
+        Performed asynchronously using aiohttp, asyncio, and an AdaptiveConcurrencyController.
+        With conditional_requests, previous_row is the URL's last enriched row, reused if the site hasn't changed."""
 
         status_code = "Error"
         final_url = "Error"
@@ -230,72 +777,221 @@ class UrlDataEnricher:
             'description': "Error",
             'image': "Error"
         }
+        validators = None
 
-        async with semaphore:
+        if self.is_unresolvable(url):
+            self.logger.debug(f"Skipping unresolvable domain: {url}")
+            return self.generate_row(url, registration_date, nexus_category, status_code, final_url, open_graph_metadata)
+
+        async with concurrency:
             try:
-                response, response_text = await self.get_response_async(url, session)
-                if response:
+                conditional_headers = self.get_conditional_headers(previous_row)
+                start_time = time.perf_counter()
+                try:
+                    response, response_body = await self.get_response_async(url, session, headers=conditional_headers)
+                except Exception as e:
+                    concurrency.record(congested=self.is_congestion_error(e))
+                    raise
+                concurrency.record(latency=time.perf_counter() - start_time)
+
+                if isinstance(response, FetchedPage):
+                    status_code = response.status_code
+                    final_url = response.final_url
+                    validators = response.validators
+                    open_graph_metadata = response.open_graph_metadata
+                elif conditional_headers and response and response.status == 304:
+                    return self.generate_not_modified_row(url, registration_date, nexus_category, previous_row, response.headers)
+                elif response:
                     status_code = response.status
-                    final_url = response.url
-                    open_graph_metadata = parse_open_graph_metadata(response_text, final_url)
+                    final_url = str(response.url)
+                    validators = self.get_validators(response.headers)
+                    with self.tracer.time('parse'):
+                        open_graph_metadata = await self.parse_body_async(response_body, final_url, url)
 
             except Exception as e:
-                self.logger.error(f"Error processing URL {url}: {e}")
-            
-            self.logger.debug(f"Finished processing: {url}")
+                self.logger.error(f"Error processing URL {url}: {e!r}")
 
-            return self.generate_row(url, registration_date, nexus_category, status_code, final_url, open_graph_metadata)
+        # Images are checked after giving up the concurrency slot, as the checker has its own limit
+        is_image_reachable = await self.check_image_async(open_graph_metadata)
 
-    async def process_urls(self, input_data, session, processed_urls, output_csv_path):
+        self.logger.debug(f"Finished processing: {url}")
+
+        return self.generate_row(url, registration_date, nexus_category, status_code, final_url, open_graph_metadata, validators, is_image_reachable)
+
+    async def read_pending_batch(self, input_batches, checkpoint_store) -> list | None:
         """
-        Asynchronously process URLs. Tasks are performed separately:
-        1. Enrich each URL.
-        2. Add it to the output CSV.
+        Read the next batch of rows from input_batches, without blocking the event loop, and drop those already in the checkpoint store.
+        With pre_resolve_dns, the batch's domains are resolved before it's returned.
+        Returns None once input_batches is exhausted.
         """
+        while (batch := await asyncio.to_thread(next, input_batches, None)) is not None:
+            if batch and 'domain_name' not in batch[0]:
+                raise ValueError("CSV must contain a 'domain_name' column")
+
+            pending_rows = [row for row in batch if not checkpoint_store.is_processed(row['domain_name'])]
+            if pending_rows:
+                if self.pre_resolve_dns:
+                    await self.pre_resolve_domains([row['domain_name'] for row in pending_rows])
+                return pending_rows
+        return None
+
+    async def process_urls(self, input_batches, session, checkpoint_store, concurrency, row_sink=None, workers: int = 50, queue_size: int = None):
+        """
+        Asynchronously process URLs through bounded queues, so memory grows with workers rather than with the input:
+        1. A reader takes rows a batch at a time, skipping those already in the checkpoint store.
+           The next batch is read, and its domains pre-resolved, while this one is queued.
+        2. A fixed pool of workers enriches the queued rows, with at most as many in flight as the concurrency controller allows.
+        3. A writer records each enriched row in the checkpoint store. With row_sink, it passes the row on instead,
+           and the row is recorded once row_sink has written it, so a resumed run retries rows that never were.
+        Each stage waits while the queue to the next one is full.
+
+        Args:
+            input_batches:  An iterator of lists of row dicts, as iter_input_batches() yields
+            session:        The aiohttp.ClientSession to fetch with
+            checkpoint_store: The CheckpointStore to skip processed rows by, and record enriched or written ones in
+            concurrency:    The AdaptiveConcurrencyController limiting requests in flight
+            row_sink:       A BatchingSink to stream each enriched row to. Defaults to None
+            workers:        Number of worker tasks, which should be at least the controller's max_concurrency. Defaults to 50
+            queue_size:     The most rows waiting in each queue. Defaults to 2 * workers
+        """
+        queue_size = queue_size or 2 * workers
+        # None marks the end of input on row_queue, and a finished worker on enriched_queue
+        row_queue = asyncio.Queue(maxsize=queue_size)
+        enriched_queue = asyncio.Queue(maxsize=queue_size)
 
-        # Limit the number of async threads to manage network bandwidth and machine resources.
-        # TODO: Play around to find the right balance of processing speed and receiving valid responses
-        sem = asyncio.Semaphore(5)
-
-        async_url_tasks = [
-            self.enrich_url_async(row['domain_name'], row['domain_registration_date'], row['nexus_category'], session, sem)
-            for index, row in input_data.iterrows()
-            if row['domain_name'] not in processed_urls
-        ]
+        async def read():
+            next_batch = None
+            try:
+                batch = await self.read_pending_batch(input_batches, checkpoint_store)
+                while batch is not None:
+                    next_batch = asyncio.create_task(self.read_pending_batch(input_batches, checkpoint_store))
+                    for row in batch:
+                        await row_queue.put(row)
+                    batch = await next_batch
+            finally:
+                if next_batch is not None and not next_batch.done():
+                    next_batch.cancel()
+            for _ in range(workers):
+                await row_queue.put(None)
+
+        async def work():
+            while (row := await row_queue.get()) is not None:
+                enriched_row = await self.enrich_url_async(row['domain_name'], row['domain_registration_date'], row['nexus_category'], session, concurrency, row)
+                if enriched_row:
+                    await enriched_queue.put(enriched_row)
+            await enriched_queue.put(None)
+
+        async def write():
+            finished_workers = 0
+            while finished_workers < workers:
+                enriched_row = await enriched_queue.get()
+                if enriched_row is None:
+                    finished_workers += 1
+                    continue
+                if row_sink is not None:
+                    await row_sink.put(enriched_row)
+                else:
+                    with self.tracer.time('write'):
+                        checkpoint_store.record(enriched_row)
 
-        async for task in asyncio.as_completed(async_url_tasks):
-            enriched_row = await task
-            if enriched_row:
-                append_row_to_csv(enriched_row, output_csv_path)
+        if row_sink is not None:
+            row_sink.on_written = checkpoint_store.record_rows
 
-    async def enrich_urls_async(self, input_csv_path, output_csv_path):
+        # If any task fails, the others are cancelled rather than left waiting on its queue
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(read())
+                for _ in range(workers):
+                    tasks.create_task(work())
+                tasks.create_task(write())
+        except ExceptionGroup as group:
+            # Report what failed rather than the group, as the rest were only cancelled
+            raise group.exceptions[0]
+
+    async def enrich_urls_async(self, input_csv_path, output_csv_path=None, checkpoint_path=None, max_concurrency: int = 50, parse_workers: int = 0, parse_queue_size: int = None, row_sink=None, batch_rows: int = 1000, queue_size: int = None):
         """Enrich all urls in CSV at input_csv_path with HTTP status code and available Open Graph data.
-        Output to CSV at output_csv_path.
-        Performed asynchronously using aiohttp, asyncio, and asyncio.Semaphore."""
+        Output to CSV at output_csv_path, and/or stream rows to row_sink as they complete.
+        Performed asynchronously using aiohttp, asyncio, and an AdaptiveConcurrencyController.
+        Input rows are streamed through bounded queues, so memory doesn't grow with the size of the input.
+        Each row is recorded in a checkpoint store as it completes, and the output CSV is exported from it at the end.
+
+        Args:
+            input_csv_path:     The CSV, Parquet or Arrow file, or list of rows, to enrich
+            output_csv_path:    The CSV file to export enriched rows to, or a .parquet or .arrow file to export them as typed columns.
+                                Defaults to None, which skips the export
+            checkpoint_path:    The checkpoint store to record rows in. Defaults to default_checkpoint_path(output_csv_path),
+                                or an in-memory store without output_csv_path
+            max_concurrency:    The most requests to have in flight at once. Concurrency starts at 5,
+                                and is raised towards this while responses stay fast and healthy. Defaults to 50
+            parse_workers:      Number of processes to parse HTML in, keeping the event loop free for network I/O.
+                                Defaults to 0, which parses on the event loop
+            parse_queue_size:   The most pages waiting to be parsed at once. Defaults to 2 * parse_workers
+            row_sink:           A BatchingSink to stream each enriched row to while the run continues. Defaults to None
+            batch_rows:         Number of input rows to read, and pre-resolve the domains of, at a time. Defaults to 1000
+            queue_size:         The most rows waiting to be enriched, and waiting to be recorded. Defaults to 2 * max_concurrency
+        """
+        import aiohttp
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
         
-        try:
-            existing_enriched_data = self.read_csv_data(output_csv_path)
-            processed_urls = set(existing_enriched_data['domain_name'])
-            input_data = self.read_csv_data(input_csv_path)
+        self.start_run()
+        checkpoint_store = None
 
-            if 'domain_name' not in input_data.columns:
-                self.logger.exception("CSV must contain a 'domain_name' column")
-                return
-            
-            # Limit the number of concurrent connections to manage network bandwidth and machine resources.
-            # TODO: Play around to find the right balance of processing speed and receiving valid responses
-            conn = aiohttp.TCPConnector(limit=5)
-
-            async with aiohttp.ClientSession(connector=conn) as session:
-                await self.process_urls(
-                    input_data,
-                    session,
-                    processed_urls,
-                    output_csv_path,
-                )
+        try:
+            checkpoint_store = self.open_checkpoint_store(output_csv_path, checkpoint_path)
+            input_batches = self.iter_input_batches(input_csv_path, batch_rows)
             
-            self.logger.info(f'Finished processing all URLs.')
-        except FileNotFoundError:
+            # The controller limits requests in flight, so the connector only needs to allow its maximum
+            concurrency = AdaptiveConcurrencyController(max_concurrency=max_concurrency)
+
+            if self.pre_resolve_dns:
+                from utils.dns_resolver import CachingResolver
+                self.dns_resolver = CachingResolver(negative_cache_path=self.dns_cache_path)
+
+            # Fetches share the pre-resolving resolver, so they reuse its cached addresses
+            conn = aiohttp.TCPConnector(limit=max_concurrency, resolver=self.dns_resolver)
+
+            if parse_workers > 0:
+                # Forking this process, which already runs resolver and to_thread threads, can deadlock the workers.
+                # They're started from a fresh server process instead, and only need parse_open_graph_metadata,
+                # which they import from utils.populate_metadata
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self.parse_executor = ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context(start_method))
+                self.parse_slots = asyncio.Semaphore(parse_queue_size or 2 * parse_workers)
+
+            try:
+                # Images are checked in a session of their own, outside the tracer and the page connection limit
+                async with aiohttp.ClientSession(connector=conn, trace_configs=[self.tracer.trace_config()]) as session, \
+                           self.image_checker or contextlib.nullcontext():
+                    if row_sink is not None:
+                        async with row_sink:
+                            await self.process_urls(input_batches, session, checkpoint_store, concurrency, row_sink, max_concurrency, queue_size)
+                        self.run_report.update(row_sink.summary())
+                    else:
+                        await self.process_urls(input_batches, session, checkpoint_store, concurrency, workers=max_concurrency, queue_size=queue_size)
+            finally:
+                if self.redirect_targets is not None:
+                    self.redirect_targets.cancel()
+                if self.parse_executor is not None:
+                    self.parse_executor.shutdown()
+                    self.parse_executor = None
+                    self.parse_slots = None
+                if self.dns_resolver is not None:
+                    self.dns_resolver.save()
+                    self.dns_resolver = None
+
+            self.run_report.update(concurrency.summary())
+            if output_csv_path:
+                with self.tracer.time('export'):
+                    exported_rows = checkpoint_store.export(output_csv_path)
+                self.logger.info(f'Finished processing all URLs, exported {exported_rows} rows to {output_csv_path}')
+            else:
+                self.logger.info(f'Finished processing all URLs')
+            self.finish_run()
+        except FileNotFoundError as e:
             self.logger.exception(f"File not found at {input_csv_path}: {e}")
         except Exception as e:
-            self.logger.exception(f"Error during processing: {e}")
\ No newline at end of file
+            self.logger.exception(f"Error during processing: {e}")
+        finally:
+            if checkpoint_store is not None:
+                checkpoint_store.close()
\ No newline at end of file
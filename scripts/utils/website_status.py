@@ -0,0 +1,39 @@
+"""
+The rules for whether an enriched field was found, and the website_status they add up to.
+Used by UrlDataEnricher when generating rows, by SupabaseDataProcessor when recomputing them,
+and by RevisitScheduler when comparing refreshes.
+
+A field is found unless it's empty, "Error" or "Not found". An og:image is also not found if checking it showed
+it doesn't load (is_og_image_reachable is False). A website is:
+- is_complete if its final_url and title were found
+- is_live if only its final_url was found
+- is_down otherwise
+"""
+
+NOT_FOUND_VALUES = ['', 'Error', 'Not found']
+
+def is_data_found(data) -> bool:
+    """True if a single field was found."""
+    # NaN is truthy, but means the field is missing, like an empty cell read by pandas
+    if isinstance(data, float) and data != data:
+        return False
+    return not ((not data) or data in NOT_FOUND_VALUES)
+
+def get_website_status(is_url_found: bool, is_og_title_found: bool) -> str:
+    """Get the website_status of a single row from whether its final_url and title were found."""
+    if is_url_found and is_og_title_found: return "is_complete"
+    elif is_url_found: return "is_live"
+    else: return "is_down"
+
+def derive_row_status(row: dict) -> dict:
+    """Derive is_url_found, is_og_title_found, is_og_image_found and website_status for a single row."""
+    is_url_found = is_data_found(row.get('final_url'))
+    is_og_title_found = is_data_found(row.get('title'))
+
+    return {
+        'is_url_found': is_url_found,
+        'is_og_title_found': is_og_title_found,
+        # Unchecked images (None) are taken to load
+        'is_og_image_found': is_data_found(row.get('image')) and row.get('is_og_image_reachable') is not False,
+        'website_status': get_website_status(is_url_found, is_og_title_found),
+    }
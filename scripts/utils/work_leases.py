@@ -0,0 +1,211 @@
+import hashlib
+import random
+import time
+import uuid
+
+"""
+Split a refresh of the whole table across parallel runners without enriching the same domain twice.
+
+Domains are assigned to one of shard_count shards by a stable hash of domain_name. Runners working
+on the same run_id claim shards one at a time with a lease that expires, process the domains in it,
+and mark it complete. A runner that crashes stops renewing its lease, so another runner picks the
+shard up once it expires.
+
+The leases live in a work_leases table, created in Supabase (Postgres) with:
+
+    CREATE TABLE work_leases (
+        run_id TEXT NOT NULL,
+        shard INTEGER NOT NULL,
+        owner TEXT,
+        expires_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+        completed BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (run_id, shard)
+    );
+
+SqlLeaseStore creates the same table itself, so a local SQLite or Postgres database can stand in for Supabase.
+"""
+
+def shard_of(domain_name: str, shard_count: int) -> int:
+    """Get the shard domain_name belongs to. Stable across processes and machines, unlike hash()."""
+    digest = hashlib.blake2b(domain_name.lower().encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+class SqlLeaseStore:
+    def __init__(self, connection, table: str = "work_leases", paramstyle: str = "qmark"):
+        """
+        Keep leases in a database through a DB-API connection, e.g. from sqlite3 or psycopg.
+
+        Args:
+            connection: An open DB-API connection
+            table:      The table to keep leases in. Created if it doesn't exist yet. Defaults to "work_leases"
+            paramstyle: "qmark" (?) for sqlite3 or "format" (%s) for psycopg. Defaults to "qmark"
+        """
+        self.connection = connection
+        self.table = table
+        self.placeholder = '?' if paramstyle == 'qmark' else '%s'
+
+        self.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                run_id TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                owner TEXT,
+                expires_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+                completed BOOLEAN NOT NULL DEFAULT FALSE,
+                PRIMARY KEY (run_id, shard)
+            )
+        """)
+
+    def execute(self, query: str, params=()) -> int:
+        """Run query in its own transaction, and return the number of rows it changed."""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query.replace('?', self.placeholder), params)
+            self.connection.commit()
+            return cursor.rowcount
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def create_shards(self, run_id: str, shard_count: int):
+        """Add a row for each shard of run_id that doesn't have one yet."""
+        for shard in range(shard_count):
+            self.execute(f"INSERT INTO {self.table} (run_id, shard) VALUES (?, ?) ON CONFLICT (run_id, shard) DO NOTHING",
+                         (run_id, shard))
+
+    def claim(self, run_id: str, shard: int, owner: str, expires_at: float, now: float) -> bool:
+        """Lease shard to owner until expires_at, if it isn't complete and any previous lease has expired."""
+        # A single conditional UPDATE, so two runners can't both claim the same shard
+        return self.execute(f"UPDATE {self.table} SET owner = ?, expires_at = ? "
+                            f"WHERE run_id = ? AND shard = ? AND completed = FALSE AND expires_at < ?",
+                            (owner, expires_at, run_id, shard, now)) > 0
+
+    def renew(self, run_id: str, shard: int, owner: str, expires_at: float) -> bool:
+        """Extend owner's lease on shard until expires_at. False if owner no longer holds it."""
+        return self.execute(f"UPDATE {self.table} SET expires_at = ? "
+                            f"WHERE run_id = ? AND shard = ? AND owner = ? AND completed = FALSE",
+                            (expires_at, run_id, shard, owner)) > 0
+
+    def complete(self, run_id: str, shard: int, owner: str) -> bool:
+        """Mark owner's shard complete, so no one claims it again in this run."""
+        return self.execute(f"UPDATE {self.table} SET completed = TRUE "
+                            f"WHERE run_id = ? AND shard = ? AND owner = ?",
+                            (run_id, shard, owner)) > 0
+
+    def release(self, run_id: str, shard: int, owner: str) -> bool:
+        """Give up owner's lease on shard without completing it, so another runner can claim it straight away."""
+        return self.execute(f"UPDATE {self.table} SET expires_at = 0 "
+                            f"WHERE run_id = ? AND shard = ? AND owner = ? AND completed = FALSE",
+                            (run_id, shard, owner)) > 0
+
+class SupabaseLeaseStore:
+    def __init__(self, supabase_client, table: str = "work_leases"):
+        """
+        Keep leases in a Supabase table. See the top of this module for the table definition.
+
+        Args:
+            supabase_client:    The Supabase client to use
+            table:              The table to keep leases in. Defaults to "work_leases"
+        """
+        self.supabase_client = supabase_client
+        self.table = table
+
+    def create_shards(self, run_id: str, shard_count: int):
+        """Add a row for each shard of run_id that doesn't have one yet."""
+        rows = [{"run_id": run_id, "shard": shard} for shard in range(shard_count)]
+        (self.supabase_client.table(self.table)
+                             .upsert(rows, on_conflict="run_id,shard", ignore_duplicates=True)
+                             .execute())
+
+    def claim(self, run_id: str, shard: int, owner: str, expires_at: float, now: float) -> bool:
+        """Lease shard to owner until expires_at, if it isn't complete and any previous lease has expired."""
+        # PostgREST runs this as a single conditional UPDATE, so two runners can't both claim the same shard
+        response = (self.supabase_client.table(self.table)
+                                        .update({"owner": owner, "expires_at": expires_at})
+                                        .eq("run_id", run_id)
+                                        .eq("shard", shard)
+                                        .eq("completed", False)
+                                        .lt("expires_at", now)
+                                        .execute())
+        return len(response.data) > 0
+
+    def renew(self, run_id: str, shard: int, owner: str, expires_at: float) -> bool:
+        """Extend owner's lease on shard until expires_at. False if owner no longer holds it."""
+        response = (self.supabase_client.table(self.table)
+                                        .update({"expires_at": expires_at})
+                                        .eq("run_id", run_id)
+                                        .eq("shard", shard)
+                                        .eq("owner", owner)
+                                        .eq("completed", False)
+                                        .execute())
+        return len(response.data) > 0
+
+    def complete(self, run_id: str, shard: int, owner: str) -> bool:
+        """Mark owner's shard complete, so no one claims it again in this run."""
+        response = (self.supabase_client.table(self.table)
+                                        .update({"completed": True})
+                                        .eq("run_id", run_id)
+                                        .eq("shard", shard)
+                                        .eq("owner", owner)
+                                        .execute())
+        return len(response.data) > 0
+
+    def release(self, run_id: str, shard: int, owner: str) -> bool:
+        """Give up owner's lease on shard without completing it, so another runner can claim it straight away."""
+        response = (self.supabase_client.table(self.table)
+                                        .update({"expires_at": 0})
+                                        .eq("run_id", run_id)
+                                        .eq("shard", shard)
+                                        .eq("owner", owner)
+                                        .eq("completed", False)
+                                        .execute())
+        return len(response.data) > 0
+
+class ShardLeaser:
+    def __init__(self, store, run_id: str, shard_count: int, lease_seconds: float = 2 * 60 * 60, owner: str = None):
+        """
+        Claim shards of a run one at a time from a lease store.
+
+        Args:
+            store:          A SqlLeaseStore or SupabaseLeaseStore
+            run_id:         Identifies one pass over the table. Shards completed under a run_id aren't claimed again
+                            for it, so use a new run_id (e.g. the date) for each refresh
+            shard_count:    How many shards to split the domains into. Every runner must use the same value for a run_id
+            lease_seconds:  How long a claim lasts before another runner can take the shard over. Defaults to 2 hours
+            owner:          A name for this runner. Defaults to a random unique id
+        """
+        self.store = store
+        self.run_id = run_id
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+        self.owner = owner or uuid.uuid4().hex
+
+        self.store.create_shards(run_id, shard_count)
+
+    def claim_shard(self) -> int | None:
+        """Claim the next available shard, or return None if every shard is complete or leased by another runner."""
+        # Start at a random shard, so runners starting together don't all race for shard 0
+        offset = random.randrange(self.shard_count)
+        for i in range(self.shard_count):
+            shard = (offset + i) % self.shard_count
+            now = time.time()
+            if self.store.claim(self.run_id, shard, self.owner, now + self.lease_seconds, now):
+                return shard
+        return None
+
+    def renew(self, shard: int) -> bool:
+        """Extend the lease on shard by lease_seconds from now. False if it was lost to another runner."""
+        return self.store.renew(self.run_id, shard, self.owner, time.time() + self.lease_seconds)
+
+    def complete(self, shard: int) -> bool:
+        """Mark shard as done for this run."""
+        return self.store.complete(self.run_id, shard, self.owner)
+
+    def release(self, shard: int) -> bool:
+        """Hand shard back unfinished, e.g. after an error."""
+        return self.store.release(self.run_id, shard, self.owner)
+
+    def in_shard(self, domain_name: str, shard: int) -> bool:
+        """True if domain_name belongs to shard."""
+        return shard_of(domain_name, self.shard_count) == shard